@@ -1,3 +1,4 @@
+import os
 import streamlit as st
 import pandas as pd
 import numpy as np
@@ -11,8 +12,128 @@ import SoC_0thorder_parameters_link
 import socpolarization
 import energyconsumptionfirstorder
 import SoH_degradation
+import cell_model
+import cell_data_cache
+import pipeline
+import instrumentation
+from io import BytesIO
 files = plot_tests.get_cell_files()
 
+# --- PIPELINE ---
+# Streamlit reruns this whole script on every widget interaction. The work is therefore described as a dependency
+# graph (see pipeline.py): cell load -> parameter extraction and interpolators (CellModel) -> power profiles ->
+# 0th/1st order simulations -> figures. Each node declares its inputs, and after a widget change only the nodes
+# downstream of the changed parameters are recomputed: changing the mass does not refit the cell parameters, and
+# changing the R1 multiplier does not rerun the WLTP power model. Each session keeps its own pipeline, holding one
+# value per node.
+# The nodes compute through the cached functions below: fitted cell models are shared resources, and simulation
+# results and rendered figures are cached on their exact inputs (bounded number of entries), shared between sessions
+# and kept for earlier inputs, so going back to a previous setting is not recomputed either. Everything read from a
+# cell file is keyed on the file signature (size and modification time), so an edited file is read again.
+MAX_CACHED_RESULTS = 32
+
+@st.cache_resource
+def load_cell_model(filepath, signature):
+    return cell_model.get_cell_model(filepath)
+
+@st.cache_data(max_entries=MAX_CACHED_RESULTS)
+def cell_capacity(filepath, signature):
+    return load_cell_model(filepath, signature).capacity
+
+@st.cache_data(max_entries=MAX_CACHED_RESULTS)
+def cell_ocv(filepath, signature, SOC):
+    return float(load_cell_model(filepath, signature).ocv_interp(SOC))
+
+# power profile, shared by the plots and both models (wind in km/h, as every simulation takes it)
+@st.cache_data(max_entries=MAX_CACHED_RESULTS)
+def wltp_results(total_mass, theta_rad, wind_kmh):
+    return power_from_WLTP.run_simulation(mass=total_mass, theta=theta_rad, wind_speed=wind_kmh)
+
+@st.cache_data(max_entries=MAX_CACHED_RESULTS)
+def zero_order_results(filepath, signature, N_series, N_parallel, R0_multiplier, OCV_multipler, SOC, *wltp_inputs):
+    return zero_order_energy_consumed.energy_consumption_cell(
+        load_cell_model(filepath, signature), N_series, N_parallel, R0_multiplier, OCV_multipler, SOC,
+        None, None, None, power_profile=wltp_results(*wltp_inputs))
+
+@st.cache_data(max_entries=MAX_CACHED_RESULTS)
+def first_order_energy(filepath, signature, N_series, N_parallel, R0_multiplier, R1_multiplier, OCV_multipler, SOC, *wltp_inputs):
+    return energyconsumptionfirstorder.energy_consumption_cell(
+        load_cell_model(filepath, signature), N_series, N_parallel, R0_multiplier, R1_multiplier, OCV_multipler, SOC,
+        None, None, None, power_profile=wltp_results(*wltp_inputs))[0]
+
+# Figures are rendered to PNG once per set of inputs, then only the image is sent again.
+def figure_png(fig):
+    buffer = BytesIO()
+    fig.savefig(buffer, format="png", bbox_inches="tight")
+    plt.close(fig)
+    return buffer.getvalue()
+
+@st.cache_data(max_entries=MAX_CACHED_RESULTS)
+def cached_figure(plot_name, *args):
+    plots = {
+        "cell": lambda filepath, signature: plot_tests.plot_file(filepath),
+        "soh": lambda signatures: SoH_degradation.plot_range_against_soh(),
+        "speed": lambda *wltp: power_from_WLTP.plot_speed(wltp_results(*wltp)),
+        "total": lambda *wltp: power_from_WLTP.plot_total_power(wltp_results(*wltp)),
+        "battery": lambda *wltp: power_from_WLTP.plot_battery_power(wltp_results(*wltp)),
+        "components": lambda *wltp: power_from_WLTP.plot_power_components(wltp_results(*wltp)),
+        "distance_SOC": lambda *sim: zero_order_energy_consumed.plot_distance_SOC(zero_order_results(*sim)),
+        "voltage_time": lambda *sim: zero_order_energy_consumed.plot_voltage_time(zero_order_results(*sim)),
+        "R0_SOC": lambda filepath, signature, r0: SoC_0thorder_parameters_link.plot_R0_SOC(filepath, r0),
+        "OCV_SOC": lambda filepath, signature, ocv: SoC_0thorder_parameters_link.plot_ocv_soc_full_link(filepath, ocv),
+        "R1_SOC": lambda filepath, signature, r1: socpolarization.plot_SOC_R1(filepath, r1),
+    }
+    return figure_png(plots[plot_name](*args))
+
+def build_pipeline():
+    p = pipeline.Pipeline()
+    p.add_params(filepath=None, cell_signature=None, soh_signatures=None, SOC=100, total_mass=1502.0, theta_rad=0.0,
+                 wind_kmh=0.0, N_series=110.0, N_parallel=2, R0_multiplier=1.0, OCV_multipler=1.0, R1_multiplier=1.0)
+    cell = ["filepath", "cell_signature"]
+    wltp = ["total_mass", "theta_rad", "wind_kmh"]
+    zero_order = cell + ["N_series", "N_parallel", "R0_multiplier", "OCV_multipler", "SOC"] + wltp
+
+    # cell data and fitted parameters
+    p.add_node("cell_data", lambda filepath, signature: cell_data_cache.load_cell_data(filepath), cell)
+    p.add_node("cell_model", lambda filepath, signature, cell_data: load_cell_model(filepath, signature), cell + ["cell_data"])
+    p.add_node("capacity", lambda filepath, signature, model: cell_capacity(filepath, signature), cell + ["cell_model"])
+    p.add_node("cell_ocv", lambda filepath, signature, model, SOC: cell_ocv(filepath, signature, SOC), cell + ["cell_model", "SOC"])
+
+    # power profile
+    p.add_node("wltp_power", wltp_results, wltp)
+
+    # simulations; a node input listed last only places the node in the graph, the cached function is keyed on
+    # the parameters before it
+    p.add_node("zero_order", lambda *inputs: zero_order_results(*inputs[:-1]), zero_order + ["wltp_power"])
+    p.add_node("first_order_energy", lambda *inputs: first_order_energy(*inputs[:-1]),
+               cell + ["N_series", "N_parallel", "R0_multiplier", "R1_multiplier", "OCV_multipler", "SOC"] + wltp + ["wltp_power"])
+
+    # figures
+    p.add_node("fig_cell", lambda filepath, signature, cell_data: cached_figure("cell", filepath, signature), cell + ["cell_data"])
+    p.add_node("fig_soh", lambda signatures: cached_figure("soh", signatures), ["soh_signatures"])
+    for name, plot_name in [("fig_speed", "speed"), ("fig_total", "total"), ("fig_battery", "battery"),
+                            ("fig_components", "components")]:
+        p.add_node(name, lambda *inputs, plot_name=plot_name: cached_figure(plot_name, *inputs[:-1]), wltp + ["wltp_power"])
+    for name, plot_name in [("fig_distance_SOC", "distance_SOC"), ("fig_voltage_time", "voltage_time")]:
+        p.add_node(name, lambda *inputs, plot_name=plot_name: cached_figure(plot_name, *inputs[:-1]), zero_order + ["zero_order"])
+    for name, plot_name, multiplier in [("fig_R0_SOC", "R0_SOC", "R0_multiplier"), ("fig_OCV_SOC", "OCV_SOC", "OCV_multipler"),
+                                        ("fig_R1_SOC", "R1_SOC", "R1_multiplier")]:
+        p.add_node(name, lambda filepath, signature, model, value, plot_name=plot_name: cached_figure(plot_name, filepath, signature, value),
+                   cell + ["cell_model", multiplier])
+    return p
+
+# BATTERY_PROFILE=<prefix> times every rerun (see instrumentation.py) and writes <prefix>.json and <prefix>.folded.
+# The counters are cleared at the start of each rerun, so the files describe the last rerun only.
+PROFILE_PREFIX = os.environ.get("BATTERY_PROFILE")
+if PROFILE_PREFIX:
+    instrumentation.enable()
+    instrumentation.PROFILER.reset()
+
+if "pipeline" not in st.session_state:
+    st.session_state.pipeline = build_pipeline()
+gui_pipeline = st.session_state.pipeline
+gui_pipeline.clear_log()  # the log only lists the nodes recomputed by this rerun
+
 st.title("Renault Zoe Battery Simulation")
 
 def reset_defaults():
@@ -56,10 +177,8 @@ wind_kmh = get_float_input('Wind speed (km/h)', 0.0, "wind_input")
 additional_mass = get_float_input('Additional mass (kg)', 0.0, "mass_input")
 
 filepath = files[[f.stem for f in files].index(selected_file)]
-capacity = round(SoC_computation.overall_capacity(filepath), 3)
 
 theta_rad = np.radians(theta_deg)
-wind_ms = wind_kmh / 3.6
 total_mass = 1502 + additional_mass
 
 st.sidebar.markdown("---")
@@ -86,11 +205,18 @@ N_parallel = st.sidebar.slider(
     key="n_parallel_slider"
 )
 N_series = N_cells/N_parallel
-current_cell_ocv = SoC_0thorder_parameters_link.interpolate_ocv(filepath, SOC) 
+
+gui_pipeline.set_params(filepath=filepath, cell_signature=cell_data_cache.file_signature(filepath),
+                        soh_signatures=tuple(cell_data_cache.file_signature(f) for f in SoH_degradation.cell_files),
+                        SOC=SOC, total_mass=total_mass, theta_rad=theta_rad, wind_kmh=wind_kmh,
+                        N_series=N_series, N_parallel=N_parallel, R0_multiplier=R0_multiplier,
+                        OCV_multipler=OCV_multipler, R1_multiplier=R1_multiplier)
+capacity = round(gui_pipeline.get("capacity"), 3)
+current_cell_ocv = gui_pipeline.get("cell_ocv")
 pack_voltage_real = N_series * current_cell_ocv
 # Real-time Pack Stats Calculation
 
-results_cell = zero_order_energy_consumed.energy_consumption_cell(filepath, N_series, N_parallel, R0_multiplier, OCV_multipler, SOC, total_mass, wind_ms, theta_rad)
+results_cell = gui_pipeline.get("zero_order")
 capacity_cell = capacity # from your existing variable
 pack_voltage = N_series * pack_voltage_real
 pack_capacity_kwh = results_cell["energyconsumed"]
@@ -100,50 +226,40 @@ st.sidebar.button("Reset to Defaults", on_click=reset_defaults)
 
 # --- BODY ---
 
-results = power_from_WLTP.run_simulation(
-    mass=total_mass, 
-    theta=theta_rad, 
-    wind_speed=wind_kmh, 
-)
+results = gui_pipeline.get("wltp_power")
 
 st.write("### Simulation Results")
 
 st.write("#### Cell plots and parameters")
-fig_cell = plot_tests.plot_file(filepath)
-st.pyplot(fig_cell)
+st.image(gui_pipeline.get("fig_cell"))
 
 st.write("The capacity of this cell is ", str(capacity), "Ah.")
 
 
 st.write("#### State of Health of the tests")
 
-figSOH = SoH_degradation.plot_range_against_soh()
-st.pyplot(figSOH)
+st.image(gui_pipeline.get("fig_soh"))
 
 col_plots, col_info = st.columns([2, 1], gap="medium")
 with col_plots:
     st.write("#### WLTP Speed Profile")
-    fig_speed = power_from_WLTP.plot_speed(results) 
-    st.pyplot(fig_speed)
+    st.image(gui_pipeline.get("fig_speed"))
 
     st.write("#### Power at Wheels")
-    fig_total = power_from_WLTP.plot_total_power(results)
-    st.pyplot(fig_total)
+    st.image(gui_pipeline.get("fig_total"))
 
     st.write("####  Battery Power (incl. Losses & Aux)")
-    fig_batt = power_from_WLTP.plot_battery_power(results)
-    st.pyplot(fig_batt)
+    st.image(gui_pipeline.get("fig_battery"))
 
     if st.checkbox("Show Power Components Breakdown"):
         st.write("####  Power Components")
-        fig_comp = power_from_WLTP.plot_power_components(results)
-        st.pyplot(fig_comp)
+        st.image(gui_pipeline.get("fig_components"))
 
 with col_info:
     st.write("#### Simulation Stats")
     
     st.write("**Cycle Type:** WLTP Class 3")
-    st.write("**Total Duration:** 1800 s")
+    st.write("**Total Duration:** ", str(int(results["time"][-1] - results["time"][0])), "s")
     st.write("**Energy needed for one WLTP cycle:** ", str(round(results["energy"],2)), "Wh")
     st.write("")
     st.write("")
@@ -169,13 +285,9 @@ col2.metric("Energy Consumable", f"{pack_capacity_kwh:.1f} kWh")
 col3.metric("System Voltage", f"{pack_voltage_real:.0f} V", f"at {SOC}% SOC")
 
 
-fig_distance_SOC = zero_order_energy_consumed.plot_distance_SOC(results_cell)
-fig_voltage_time = zero_order_energy_consumed.plot_voltage_time(results_cell)
-fig_current_time = zero_order_energy_consumed.plot_current_time(results_cell)
-
-st.pyplot(fig_distance_SOC)
-st.pyplot(fig_voltage_time)
-#st.pyplot(fig_current_time)
+st.image(gui_pipeline.get("fig_distance_SOC"))
+st.image(gui_pipeline.get("fig_voltage_time"))
+#st.image(gui_pipeline.get("fig_current_time"))
 
 st.write("#### 0th Order vs 1st Order model")
 
@@ -183,15 +295,15 @@ col_1, col_2 = st.columns(2)
 
 with col_1:
     st.write("### 0th Order")
-    fig_R0_SOC = SoC_0thorder_parameters_link.plot_R0_SOC(filepath, R0_multiplier)
-    st.pyplot(fig_R0_SOC)
-    fig_OCV_SOC = SoC_0thorder_parameters_link.plot_ocv_soc_full_link(filepath, OCV_multipler)
-    
-    st.pyplot(fig_OCV_SOC)
+    st.image(gui_pipeline.get("fig_R0_SOC"))
+    st.image(gui_pipeline.get("fig_OCV_SOC"))
 
 with col_2:
     st.write("### 1st Order")
-    fig_R1_SOC= socpolarization.plot_SOC_R1(filepath, R1_multiplier)
-    st.pyplot(fig_R1_SOC)
-    energy = energyconsumptionfirstorder.energy_consumption_cell(filepath, N_series, N_parallel, R0_multiplier, R1_multiplier, OCV_multipler, SOC, total_mass, wind_ms, theta_rad)[0]
-    st.write(" The energy that is consumable in the 1st order model is: ", str(round(energy, 1)), "kW")    
+    st.image(gui_pipeline.get("fig_R1_SOC"))
+    energy = gui_pipeline.get("first_order_energy")
+    st.write(" The energy that is consumable in the 1st order model is: ", str(round(energy, 1)), "kW")
+
+if PROFILE_PREFIX:
+    instrumentation.PROFILER.write_json(PROFILE_PREFIX + ".json")
+    instrumentation.PROFILER.write_folded(PROFILE_PREFIX + ".folded")
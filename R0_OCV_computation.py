@@ -1,6 +1,8 @@
 import pandas as pd
 from pathlib import Path
 import argparse
+from cell_data_cache import load_cell_data
+from step_segments import get_step_segments
 
 #This code identifies the internal resistance that is associated with the current spiking down (discharging R0)
 #This happens during step 7 of the CSV files where current typically spikes from 0 to -70.4A
@@ -18,10 +20,7 @@ def identify_R0_OCV(csv_path, charge = False):
     #The values stored with that key will be a list, full of tuples, where each tuple represents what we call a pulse, or spike.
     #In the tuple there will also be the corresponding internal resistance and OCV for that spike
     csv_path = Path(csv_path)
-    df = pd.read_csv(csv_path)
-
-    # Normalize column names
-    df.columns = [c.strip() for c in df.columns]
+    df = load_cell_data(csv_path) #parsed once with stripped column names and numeric values, shared with the other scripts
 
     #Defining our column names
     time_col = "Total Time" 
@@ -33,26 +32,19 @@ def identify_R0_OCV(csv_path, charge = False):
     if not all(c in df.columns for c in [time_col, curr_col, volt_col, step_col]):
         raise ValueError(
             f"{csv_path.name}: Missing one of required columns. Found columns: {df.columns.tolist()}")
-    
-    #Converts all values to numbers (basically just a safety check)
-    df[time_col] = pd.to_numeric(df[time_col], errors="coerce")
-    df[curr_col] = pd.to_numeric(df[curr_col], errors="coerce")
-    df[volt_col] = pd.to_numeric(df[volt_col], errors="coerce")
-    df[step_col] = pd.to_numeric(df[step_col], errors="coerce")
+
     #Indices in the csv file where spike we're interested in happens
     start_indices=[]
     key = ("file " + csv_path.stem[-1]) #creating key for the results dictionary
     results[key] = []
+    segments = get_step_segments(csv_path) #continuous blocks of each step, computed once per file
     for value in list_of_steps:
-        is_value = df[step_col].eq(value) #finds where step 9 happens
-        prev_is_value = is_value.shift(1, fill_value = False) #checks that at the previous index the step wasnt 9 (so identifies where step switches from not 9 to 9)
-        starts = is_value & (~prev_is_value)
-        start_indices_value = df.index[starts].tolist() #forms list of our indexes that interest us
+        #the first row of every step 9 block is where the step switches from not 9 to 9
+        start_indices_value = segments.loc[segments["step"] == value, "start_row"].tolist() #forms list of our indexes that interest us
         for element in start_indices_value:
             start_indices.append(element)
     start_indices.sort() #useful if list_of_steps has multiple elements, so in this case not strictly neccessary
-    idx_dictionary ={}
-    for idx in start_indices:
+    for pulse_number, idx in enumerate(start_indices): #0 for first pulse etc..
         prev_idx = idx - 1
         if prev_idx not in df.index:
             continue #just a safety net again
@@ -64,15 +56,11 @@ def identify_R0_OCV(csv_path, charge = False):
         v1 = df.at[prev_idx, volt_col]
         i1 = df.at[prev_idx, curr_col]
 
-        pulse_number = start_indices.index(idx) #0 for first pulse etc..
-        if pulse_number not in idx_dictionary.keys():
-            idx_dictionary[pulse_number] = [] #creates new list where for each pulse it will add the index that it happens at
-        idx_dictionary[pulse_number].append(idx)
         dV = v1 - v0
         dI = i1 - i0
         R = (dV / dI) #calculate internal resistance
         
-        OCV_index = idx_dictionary[pulse_number][0] -1 #find the index just before the spike (ie current will be zero)
+        OCV_index = prev_idx #the index just before the spike (ie current will be zero)
         
         I_for_OCV = df.at[OCV_index, curr_col] #typically zero but not always the case
         V_for_OCV = df.at[OCV_index, volt_col]
@@ -1,16 +1,12 @@
-from SoC_computation import *
-import matplotlib.pyplot as plt
+from SoC_computation import soc_by_spike
 from pathlib import Path
-from scipy.interpolate import PchipInterpolator
 import numpy as np
-from R0_OCV_computation import *
+from R0_OCV_computation import identify_R0_OCV
 import argparse 
 
 
 
 def OCV_SoC(csv_path, charge=False) : #Set this as false as default because we are typically interested in this link for discharging
-    df = pd.read_csv(csv_path)
-    df.columns = [c.strip() for c in df.columns]
     all_list = []
     
     # Get OCV and R0 during a charging spike.
@@ -36,6 +32,24 @@ def OCV_SoC(csv_path, charge=False) : #Set this as false as default because we a
         return {cells_dictionary[str(csv_path)]: all_list}
 
 
+# SoC, R0 and OCV points of one file, ready to be interpolated: SoC sorted increasingly, and the
+# R0 and OCV lists reversed to line up with it (the SoC decreases from one pulse to the next).
+def soc_parameter_points(csv_path, charge=False):
+    soc_dict = OCV_SoC(csv_path, charge)
+    SOC_points = []
+    R0_points = []
+    OCV_points = []
+    for key in soc_dict.keys():
+        for tuple_index in range(len(soc_dict[key])):
+            SOC_points.append(soc_dict[key][tuple_index][1])
+            R0_points.append(soc_dict[key][tuple_index][2])
+            OCV_points.append(soc_dict[key][tuple_index][3])
+    SOC_points.sort()
+    R0_points.reverse()
+    OCV_points.reverse()
+    return np.array(SOC_points), np.array(R0_points), np.array(OCV_points)
+
+
 # Plot OCV vs SoC for charge points and discharge points on the same axes.
 def plot_OCV_SOC(csv_path, OCV_multiplier):
     ocv_soc_link_charge = OCV_SoC(csv_path, True)
@@ -43,6 +57,7 @@ def plot_OCV_SOC(csv_path, OCV_multiplier):
 
     csv_path = Path(csv_path)
 
+    import matplotlib.pyplot as plt
     fig, ax = plt.subplots(figsize=(9, 6))
 
     # Charge data
@@ -90,6 +105,7 @@ def plot_R0_SOC(csv_path, R0_multiplier):
 
     csv_path = Path(csv_path)
 
+    import matplotlib.pyplot as plt
     fig, ax = plt.subplots(figsize=(9, 6))
 
     # Charge data
@@ -130,42 +146,34 @@ def plot_R0_SOC(csv_path, R0_multiplier):
     return fig
     
 
+# PCHIP interpolators of OCV and R0 against SoC, for discharge or charge: those of the CellModel of the file
+# (see cell_model.py), which is fitted once, saved, and refitted only if the cell file changes on disk.
+def soc_interpolators(csv_path, charge=False):
+    from cell_model import get_cell_model  # cell_model imports this module
+    model = get_cell_model(csv_path)
+    if charge:
+        return model.ocv_charge_interp, model.r0_charge_interp
+    return model.ocv_interp, model.r0_interp
+
 # Interpolate OCV as a function of SoC using a shape-preserving cubic interpolator (PCHIP).
+# ocv_query can be a single SoC or an array of SoC values, evaluated in one call.
 def interpolate_ocv(csv_path, ocv_query, charge=False):
-    ocv_soc_dict = OCV_SoC(csv_path, charge)
-    SOC_points = []
-    OCV_points = []
-    for key in ocv_soc_dict.keys():
-        for tuple_index in range(len(ocv_soc_dict[key])):
-            SOC_points.append(ocv_soc_dict[key][tuple_index][1])
-            OCV_points.append(ocv_soc_dict[key][tuple_index][3])
-    SOC_points.sort()
-    OCV_points.reverse()
-    ocv_interp = PchipInterpolator(SOC_points, OCV_points)
+    ocv_interp, _ = soc_interpolators(csv_path, charge)
     return ocv_interp(ocv_query)
 
 # Interpolate R0 as a function of SoC using a shape-preserving cubic interpolator (PCHIP).
+# R0_query can be a single SoC or an array of SoC values, evaluated in one call.
 def interpolate_R0(csv_path, R0_query, charge = False):
-    R0_soc_dict = OCV_SoC(csv_path, charge)
-    SOC_points = []
-    R0_points = []
-    for key in R0_soc_dict.keys():
-        for tuple_index in range(len(R0_soc_dict[key])):
-            SOC_points.append(R0_soc_dict[key][tuple_index][1])
-            R0_points.append(R0_soc_dict[key][tuple_index][2])
-    SOC_points.sort()
-    R0_points.reverse()
-    r0_interp =  PchipInterpolator(SOC_points, R0_points)
+    _, r0_interp = soc_interpolators(csv_path, charge)
     return r0_interp(R0_query)
 
 
 # Evaluate the interpolated OCV vs SoC over many SoC values (0–100%) and plot the resulting curve.
 def plot_ocv_soc_full_link(csv_path, OCV_multiplier, charge=False):
     soc_points = np.linspace(0, 100, 100)
-    ocv_points = []
-    for point in soc_points:
-        ocv_points.append(interpolate_ocv(csv_path, point, charge) * OCV_multiplier)
+    ocv_points = interpolate_ocv(csv_path, soc_points, charge) * OCV_multiplier
     
+    import matplotlib.pyplot as plt
     fig, ax = plt.subplots(figsize=(9, 6))
     ax.plot(soc_points, ocv_points, linestyle="None", marker=".")
     ax.set_xlabel("State of Charge (%)")
@@ -179,9 +187,8 @@ def plot_ocv_soc_full_link(csv_path, OCV_multiplier, charge=False):
 # Evaluate the interpolated R0 for discharge vs SoC over many SoC values (0–100%) and plot the resulting curve.
 def plot_R0_soc_full_link(csv_path, R0_multiplier, charge = False):
     soc_points = np.linspace(0,100,100)
-    R0_points = []
-    for point in soc_points:
-        R0_points.append(interpolate_R0(csv_path, point, charge)*R0_multiplier)
+    R0_points = interpolate_R0(csv_path, soc_points, charge)*R0_multiplier
+    import matplotlib.pyplot as plt
     fig, ax = plt.subplots(figsize=(9, 6))
     ax.plot(soc_points, R0_points, linestyle="None", marker=".")
     ax.set_xlabel("State of Charge (%)")
@@ -192,6 +199,7 @@ def plot_R0_soc_full_link(csv_path, R0_multiplier, charge = False):
     return fig
 
 if __name__ == "__main__":
+    import matplotlib.pyplot as plt
     
     # 1. Setup Argparse
     parser = argparse.ArgumentParser(description="Plot OCV and R0 Analysis")
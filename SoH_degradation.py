@@ -1,32 +1,75 @@
-from SoC_computation import *
+from SoC_computation import overall_capacity
 from pathlib import Path
-from zero_order_energy_consumed import *
-import numpy as np
-from scipy.interpolate import PchipInterpolator
+from collections import OrderedDict
+from zero_order_energy_consumed import energy_consumption_cell, energy_consumption_cell_accelerated
+from parallel_extraction import map_files
+from cell_data_cache import file_signature
 
 cell_data_dir = Path("Cell_data")
 cell_files = list(cell_data_dir.glob("*.csv"))
 cell_files.sort()
 
+# Results of the study are kept per cell file, keyed on the file (path, size, modification time) and on the
+# vehicle/pack parameters, so changing one input only recomputes the points it affects.
+MAX_CACHED_RESULTS = 512
+_capacity_cache = OrderedDict()
+_range_cache = OrderedDict()
 
-def SoH_by_cell():
-    capacity_brandnew_cell = overall_capacity("Cell_data/CELL_E_TEST_00.csv")
+def _cached(cache, key, value):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > MAX_CACHED_RESULTS:
+        cache.popitem(last=False)
+
+def _file_key(file):
+    return (str(Path(file).resolve()), file_signature(file))
+
+# Capacity of every file, computing only the ones not cached yet (over `workers` processes, see parallel_extraction.py)
+def capacities_by_cell(files, workers=None):
+    keys = [_file_key(file) for file in files]
+    # values are read from the cache before anything is added to it, so an eviction cannot lose them
+    values = {key: _capacity_cache[key] for key in keys if key in _capacity_cache}
+    missing = list({key: (file, key) for file, key in zip(files, keys) if key not in values}.values())  # each file once
+    for (_, key), capacity in zip(missing, map_files(overall_capacity, [file for file, _ in missing], workers)):
+        values[key] = capacity
+        _cached(_capacity_cache, key, capacity)
+    return [values[key] for key in keys]
+
+# workers: number of processes reading the files (see parallel_extraction.py), serial by default
+def SoH_by_cell(workers=None):
+    capacity_brandnew_cell, *capacities = capacities_by_cell([Path("Cell_data/CELL_E_TEST_00.csv")] + cell_files, workers)
     SoH_dictionary = {}
-    for file in cell_files: 
-        capacity_required_cell = overall_capacity(file)
+    for file, capacity_required_cell in zip(cell_files, capacities): 
         SoH_dictionary[str(file)] = float((capacity_required_cell/capacity_brandnew_cell)*100)
     return SoH_dictionary
 
-def range_of_car_with_SoH():
+def _range_of_file(task):
+    file, parameters, accelerated = task
+    if accelerated:
+        return energy_consumption_cell_accelerated(file, *parameters)['range']
+    return float(energy_consumption_cell(file, *parameters)['distance'][-1])
+
+# Range of the pack built with each cell file, for the given pack design and vehicle parameters.
+# Only the files whose data or parameters changed since the last call are simulated, over `workers` processes.
+# accelerated=True skips whole WLTC cycles (see energy_consumption_cell_accelerated), within a reported error bound
+def range_of_car_with_SoH(number_series_cells=110, number_parallel_cells=2, R0_coefficient=1, OCV_coefficient=1, SoC=100, mass=1502, wind=0, angle=0, accelerated=False, workers=None):
+    parameters = (number_series_cells, number_parallel_cells, R0_coefficient, OCV_coefficient, SoC, mass, wind, angle)
+    keys = [(_file_key(file), parameters, accelerated) for file in cell_files]
+    values = {key: _range_cache[key] for key in keys if key in _range_cache}
+    missing = [(file, key) for file, key in zip(cell_files, keys) if key not in values]
+    ranges = map_files(_range_of_file, [(file, parameters, accelerated) for file, _ in missing], workers)
+    for (_, key), range_value in zip(missing, ranges):
+        values[key] = range_value
+        _cached(_range_cache, key, range_value)
+
     range_for_SoH = {}
-    SoH_dictionary = SoH_by_cell()
-    for file in cell_files:
-        energy_consumption_dict = energy_consumption_cell(file, 110, 2, 1, 1, 100, 1502, 0, 0)
-        range_for_SoH[SoH_dictionary[str(file)]] = float(energy_consumption_dict['distance'][-1])
+    SoH_dictionary = SoH_by_cell(workers)
+    for file, key in zip(cell_files, keys):
+        range_for_SoH[SoH_dictionary[str(file)]] = values[key]
     return range_for_SoH
 
-def plot_range_against_soh():
-    range_for_SoH = range_of_car_with_SoH()
+def plot_range_against_soh(**study_parameters):
+    range_for_SoH = range_of_car_with_SoH(**study_parameters)
     SoH_points = []
     range_points = []
     for key in range_for_SoH.keys():
@@ -35,6 +78,7 @@ def plot_range_against_soh():
     SoH_points.reverse()
     range_points.reverse()
 
+    import matplotlib.pyplot as plt
     fig, ax = plt.subplots(figsize=(9, 6))
     ax.plot(SoH_points, range_points, linestyle="None", marker="o")
     ax.set_xlabel("State of Health (%)")
@@ -47,6 +91,7 @@ def plot_range_against_soh():
 
 
 if __name__ == "__main__":
+    import matplotlib.pyplot as plt
     fig = plot_range_against_soh()
     plt.show()
-    
\ No newline at end of file
+    
@@ -0,0 +1,182 @@
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import columnar_format
+from cell_model import as_cell_model
+from parallel_extraction import map_files
+from batch_simulation import energy_consumption_batch
+
+# Headless runner for scenario tables, for long unattended design sweeps.
+# A scenario table is a CSV with one row per run: the cell file and any of the columns of SCENARIO_DEFAULTS
+# (a missing column takes its default value, the values of the GUI). The rows are simulated with
+# batch_simulation.energy_consumption_batch for their model order (0 or 1), the same model as the single-run
+# energy_consumption_cell of each order, without plotting or printing. The energy consumed (kWh), the distance (m)
+# and whether the power demand could not be delivered before the SoC floor ("infeasible": the run stopped early)
+# are written with the scenario columns to a columnar folder (see columnar_format.py).
+#
+# The rows are sorted by cell file and cut into chunks of `chunk_rows` rows, which are spread over `workers`
+# processes (see parallel_extraction.py). Every cell model is fitted (or loaded) once before the workers start,
+# so they only read the saved models. The rows of a chunk with the same order are simulated together; a row that fails (e.g. order 1 for a cell without polarization data) does
+# not stop the sweep: its error message is stored in the "error" column and its results are NaN.
+#
+#   file,number_series_cells,number_parallel_cells,mass,order
+#   CELL_E_TEST_00.csv,110,2,1502,0
+#   CELL_E_TEST_00.csv,110,2,1502,1
+
+DATA_FOLDER = Path("Cell_data")
+SCENARIO_DEFAULTS = {
+    "number_series_cells": 110,
+    "number_parallel_cells": 2,
+    "R0_coefficient": 1.0,
+    "OCV_coefficient": 1.0,
+    "R1_coefficient": 1.0,
+    "SoC": 100.0,
+    "mass": 1502.0,
+    "wind": 0.0,
+    "angle": 0.0,
+    "order": 0,
+}
+RESULT_COLUMNS = ["energyconsumed", "distance", "infeasible", "error"]
+# stored as integers when all their values are whole, so integer scenario columns come back as integers
+INTEGER_COLUMNS = ["number_series_cells", "number_parallel_cells", "order", "infeasible"]
+DEFAULT_CHUNK_ROWS = 50
+
+
+def read_scenarios(csv_path):
+    scenarios = pd.read_csv(csv_path, skipinitialspace=True)
+    scenarios.columns = [c.strip() for c in scenarios.columns]
+    if "file" not in scenarios.columns:
+        raise ValueError(f"{csv_path}: the scenario table needs a 'file' column")
+    unknown = [c for c in scenarios.columns if c != "file" and c not in SCENARIO_DEFAULTS]
+    if unknown:
+        raise ValueError(f"{csv_path}: unknown columns {unknown}. Expected 'file' and any of {list(SCENARIO_DEFAULTS)}")
+    for column, default in SCENARIO_DEFAULTS.items():
+        if column not in scenarios.columns:
+            scenarios[column] = default
+    scenarios = scenarios[["file"] + list(SCENARIO_DEFAULTS)]
+    if not scenarios["order"].isin([0, 1]).all():
+        raise ValueError(f"{csv_path}: the order column must be 0 or 1")
+    return scenarios
+
+
+def resolve_cell_file(name, data_folder=DATA_FOLDER):
+    path = Path(name)
+    return path if path.exists() else Path(data_folder) / name  # bare file names are looked up in Cell_data
+
+
+# Energy (kWh), distance (m) and infeasible flag of scenario rows (a list of dicts) of the same order
+def run_scenarios_of_order(model, rows, order, lut_resolution=None, cycle=None):
+    columns = {column: [row[column] for row in rows] for column in SCENARIO_DEFAULTS if column != "order"}
+    results = energy_consumption_batch(
+        model, columns["number_series_cells"], columns["number_parallel_cells"], columns["R0_coefficient"],
+        columns["OCV_coefficient"], columns["SoC"], columns["mass"], columns["wind"], columns["angle"],
+        R1_coefficient=columns["R1_coefficient"], order=order, lut_resolution=lut_resolution, cycle=cycle)
+    return list(zip(results["energyconsumed"].tolist(), results["distance"].tolist(), results["infeasible"].tolist()))
+
+
+def run_scenario(model, row, lut_resolution=None, cycle=None):
+    return run_scenarios_of_order(model, [row], int(row["order"]), lut_resolution, cycle)[0]
+
+
+def _error(e):
+    return f"{type(e).__name__}: {e}"
+
+
+def _run_chunk(task):
+    cell_file, rows, lut_resolution, cycle = task
+    try:
+        model = as_cell_model(cell_file)
+    except Exception as e:  # the whole chunk fails with the same message
+        return [(index, np.nan, np.nan, False, _error(e)) for index, _ in rows]
+    results = []
+    for order in sorted({int(row["order"]) for _, row in rows}):
+        group = [(index, row) for index, row in rows if int(row["order"]) == order]
+        try:
+            values = run_scenarios_of_order(model, [row for _, row in group], order, lut_resolution, cycle)
+            results += [(index, *value, "") for (index, _), value in zip(group, values)]
+        except Exception:
+            # run the rows one by one, so only the ones that fail get an error
+            for index, row in group:
+                try:
+                    results.append((index, *run_scenario(model, row, lut_resolution, cycle), ""))
+                except Exception as e:
+                    results.append((index, np.nan, np.nan, False, _error(e)))
+    return results
+
+
+"""
+Runs every row of the scenario table (a DataFrame from read_scenarios) and returns the table with the
+RESULT_COLUMNS added, in the order of the rows. workers: see parallel_extraction.py (0 = one per CPU).
+"""
+def run_scenarios(scenarios, workers=None, chunk_rows=DEFAULT_CHUNK_ROWS, lut_resolution=None, cycle=None,
+                  data_folder=DATA_FOLDER):
+    scenarios = scenarios.reset_index(drop=True)
+    cell_files = [resolve_cell_file(name, data_folder) for name in scenarios["file"]]
+    for cell_file in sorted(set(cell_files)):
+        try:
+            as_cell_model(cell_file)  # fitted and saved once here, the workers load the saved model
+        except Exception:
+            pass  # reported per row by the workers
+
+    tasks = []
+    records = scenarios.to_dict("records")
+    for cell_file in sorted(set(cell_files)):
+        rows = [(k, records[k]) for k in range(len(records)) if cell_files[k] == cell_file]
+        for start in range(0, len(rows), chunk_rows):
+            tasks.append((cell_file, rows[start:start + chunk_rows], lut_resolution, cycle))
+
+    energy = np.full(len(scenarios), np.nan)
+    distance = np.full(len(scenarios), np.nan)
+    infeasible = np.zeros(len(scenarios), dtype=bool)
+    error = np.full(len(scenarios), "", dtype=object)
+    for chunk in map_files(_run_chunk, tasks, workers):
+        for index, energy_value, distance_value, infeasible_value, message in chunk:
+            energy[index], distance[index], infeasible[index], error[index] = (energy_value, distance_value,
+                                                                               infeasible_value, message)
+
+    results = scenarios.copy()
+    results["energyconsumed"] = energy
+    results["distance"] = distance
+    results["infeasible"] = infeasible
+    results["error"] = error
+    return results
+
+
+def write_results(results, out_dir, scenario_file=None):
+    source = columnar_format.source_stat(scenario_file) if scenario_file is not None else None
+    return columnar_format.write_columnar(results, out_dir, source=source, integer_columns=INTEGER_COLUMNS)
+
+
+def read_results(out_dir):
+    results = pd.DataFrame({name: np.asarray(values) for name, values in columnar_format.load_columnar(out_dir).items()})
+    if "infeasible" in results.columns:
+        results["infeasible"] = results["infeasible"].astype(bool)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a scenario table through the 0th / 1st order models, without plotting")
+    parser.add_argument("scenarios", help="CSV with a 'file' column and any of: " + ", ".join(SCENARIO_DEFAULTS))
+    parser.add_argument("--output", default=None, help="Output columnar folder (default: next to the scenario file, .cols)")
+    parser.add_argument("--workers", type=int, default=0, help="Worker processes (0 = one per CPU, 1 = serial)")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS, help="Rows sent to a worker at a time")
+    parser.add_argument("--lut", type=float, default=None, help="Use lookup tables with this SoC resolution (%%)")
+    parser.add_argument("--cycle", default=None, help="Drive cycle CSV or registered name (default: WLTC class 3)")
+    args = parser.parse_args()
+
+    scenarios = read_scenarios(args.scenarios)
+    start = time.perf_counter()
+    results = run_scenarios(scenarios, args.workers, args.chunk_rows, args.lut, args.cycle)
+    elapsed = time.perf_counter() - start
+    out_dir = write_results(results, args.output or columnar_format.columnar_path(args.scenarios), args.scenarios)
+
+    failed = int((results["error"] != "").sum())
+    infeasible = int(results["infeasible"].sum())
+    print(f"{len(results)} scenarios in {elapsed:.1f} s ({len(results)/elapsed:.1f} scenarios/s), {failed} failed, "
+          f"{infeasible} infeasible (power not delivered before the SoC floor) -> {out_dir}")
+    for message, count in results.loc[results["error"] != "", "error"].value_counts().items():
+        print(f"  {count} x {message}")
@@ -0,0 +1,258 @@
+import argparse
+import math
+from pathlib import Path
+
+import numpy as np
+
+from cell_model import as_cell_model
+from soc_lut import StackedCurves
+from power_from_WLTP import run_simulation_batch
+import zero_order_energy_consumed
+import energyconsumptionfirstorder
+
+# Many pack configurations simulated together.
+# Every scenario is one combination of pack design (cells in series / parallel), parameter multipliers (R0, OCV,
+# R1), starting SoC and vehicle loading (mass, wind, angle). All scenarios are advanced second by second in
+# lockstep, their states (SoC, polarization voltage) being NumPy arrays: one step costs a handful of array
+# operations whatever the number of scenarios. A scenario leaves the arrays when it reaches its SoC floor (or
+# when its power demand cannot be delivered), and its energy, distance and end time are then read from the
+# cumulative sums of its power profile.
+# A vectorised step costs tens of microseconds whatever the number of scenarios, against a few microseconds per
+# scenario for the scalar loops of the single-run models, so small batches (fewer than SCALAR_SCENARIOS) are run
+# one scenario at a time with those loops instead, with the same results.
+
+SOC_FLOOR = {0: 0.1, 1: 1.0} # same stopping SoC (%) as zero_order_energy_consumed / energyconsumptionfirstorder
+PROFILE_CHUNK = 256 # loadings whose power model is computed at once: it holds a dozen (loadings x time) matrices
+SCALAR_SCENARIOS = 16 # below this number of scenarios, the scalar loops are faster than the vectorised one
+
+
+# The curves the loop needs, evaluated together for all the scenarios (see soc_lut.StackedCurves):
+# OCV, R0 and R0 charge for order 0, OCV, R0, R1 and tau for order 1.
+def _vector_curves(model, order, lut_resolution):
+    names = ["ocv", "r0", "r0_charge"] if order == 0 else ["ocv", "r0", "r1", "tau"]
+    if order == 1 and not model.has_polarization:
+        raise ValueError(f"{model.name}: no polarization (R1, tau) data, the 1st order model is unavailable")
+    if lut_resolution is not None:
+        tables = model.lookup_tables(lut_resolution)
+        return StackedCurves([tables[name] for name in names])
+    interpolators = {"ocv": model.ocv_interp, "r0": model.r0_interp, "r0_charge": model.r0_charge_interp,
+                     "r1": model.r1_interp, "tau": model.tau_interp}
+    return StackedCurves([interpolators[name] for name in names])
+
+
+"""
+One scenario with the scalar loop of its model (simulate_0th_order / simulate_1st_order), with the same cycle skipping
+as the vectorised loop. Returns the seconds simulated exactly, the final SoC, whether the power could not be
+delivered, the cycles skipped, the SoC error bound and the SoC drop of the last exact cycle.
+"""
+def _scalar_run(curves, order, p_batt, SoC, ocv_scale, r0_scale, r1_scale, capacity_pack, soc_floor, max_steps,
+                max_soc_jump, floor_margin):
+    period = len(p_batt)
+    soc, V1 = float(SoC), 0.0
+    t_now = 0
+    cycles_skipped = 0
+    soc_error_bound = 0.0
+    last_drop = 0.0
+    jump, jump_drop = 0, 0.0
+    while soc > soc_floor and (max_steps is None or t_now < max_steps):
+        n = None if max_soc_jump is None else period  # one exact cycle at a time when skipping cycles
+        if max_steps is not None:
+            n = max_steps - t_now if n is None else min(n, max_steps - t_now)
+        cycle_start = soc
+        if order == 0:
+            currents, socs, infeasible = zero_order_energy_consumed.simulate_0th_order(
+                curves, p_batt, soc, ocv_scale, r0_scale, capacity_pack, soc_floor, start_step=t_now, max_steps=n)
+        else:
+            currents, socs, V1, infeasible = energyconsumptionfirstorder.simulate_1st_order(
+                curves, p_batt, soc, ocv_scale, r0_scale, r1_scale, capacity_pack, V1, soc_floor, start_step=t_now,
+                max_steps=n)
+        t_now += len(currents)
+        if len(socs):
+            soc = float(socs[-1])
+        if infeasible:
+            return t_now, soc, True, cycles_skipped, soc_error_bound, last_drop
+        if max_soc_jump is not None and t_now % period == 0 and len(currents) == period:
+            # end of an exact cycle: same correction and jump as in energy_consumption_batch
+            drop = cycle_start - soc
+            soc -= jump*(drop - jump_drop)/2
+            soc_error_bound += jump*abs(drop - jump_drop)/2
+            last_drop = drop
+            jump = 0
+            if drop > 0:
+                stop_jumping_at = soc_floor + max(floor_margin, 2*drop)
+                jump = max(int(math.floor(min(max_soc_jump, soc - stop_jumping_at)/drop)), 0)
+            jump_drop = drop
+            soc -= jump*drop
+            cycles_skipped += jump
+    return t_now, soc, False, cycles_skipped, soc_error_bound, last_drop
+
+
+"""
+Runs every scenario until its SoC floor and returns, for each one, the energy consumed (kWh), the distance
+travelled (m), the end time (s) and SoC, and whether it stopped because the power could not be delivered.
+Every parameter can be a scalar or a 1D array; they are broadcast together into scenarios.
+order=0 uses the 0th order model (R0 for charge and discharge), order=1 adds the RC branch (R1, tau) and,
+like energyconsumptionfirstorder, uses the discharge R0 throughout. cycle is the drive cycle (see drive_cycles.py), WLTC class 3 by default.
+max_soc_jump (%) skips whole cycles as energy_consumption_cell_accelerated does, for every scenario at once: all the
+scenarios still running are at the same second of the cycle, so at the end of each cycle those far from their floor
+are moved down by whole cycles (at most max_soc_jump of SoC). The cycles skipped and the error bounds on the final
+SoC (%) and range (m) of each scenario are returned with the results; None (default) simulates every second.
+Batches smaller than scalar_scenarios are run one scenario at a time with the scalar loops (0 always vectorises).
+"""
+def energy_consumption_batch(csv_path, number_series_cells, number_parallel_cells, R0_coefficient, OCV_coefficient,
+                             SoC, mass, wind, angle, R1_coefficient=1.0, order=0, lut_resolution=None, max_steps=None, cycle=None,
+                             max_soc_jump=None, floor_margin=2.0, scalar_scenarios=SCALAR_SCENARIOS):
+    if order not in SOC_FLOOR:
+        raise ValueError("order must be 0 or 1")
+    model = as_cell_model(csv_path)
+    n_series, n_parallel, r0_coeff, ocv_coeff, r1_coeff, soc_start, mass, wind, angle = (
+        a.astype(float) for a in np.broadcast_arrays(*(np.atleast_1d(np.asarray(v, dtype=float)) for v in (
+            number_series_cells, number_parallel_cells, R0_coefficient, OCV_coefficient, R1_coefficient,
+            SoC, mass, wind, angle))))
+    if n_series.ndim != 1:
+        raise ValueError("scenario parameters must be scalars or 1D arrays")
+    n_scenarios = len(n_series)
+
+    # One power profile per distinct vehicle loading
+    loadings, profile_of = np.unique(np.stack([mass, angle, wind], axis=1), axis=0, return_inverse=True)
+    profile_of = profile_of.ravel()
+    # only the battery power is kept, so the memory used grows with one matrix, not with all of the power model
+    p_batt = []
+    for k in range(0, len(loadings), PROFILE_CHUNK):
+        chunk = loadings[k:k + PROFILE_CHUNK]
+        power = run_simulation_batch(chunk[:, 0], chunk[:, 1], chunk[:, 2], cycle)
+        p_batt.append(power["p_batt"])
+    p_batt = p_batt[0] if len(p_batt) == 1 else np.concatenate(p_batt)
+    period = p_batt.shape[1]
+    cumulative_energy = np.hstack([np.zeros((len(loadings), 1)), np.cumsum(p_batt, axis=1)])/3600000
+    cumulative_distance = np.concatenate([[0.0], np.cumsum(power["speed_ms"])])
+
+    # per-scenario constants
+    ocv_scale = n_series*ocv_coeff
+    r0_scale = n_series*r0_coeff/n_parallel
+    r1_scale = n_series*r1_coeff/n_parallel
+    capacity_pack = n_parallel*model.capacity
+    soc_floor = SOC_FLOOR[order]
+
+    steps = np.zeros(n_scenarios, dtype=np.int64)
+    soc_end = soc_start.copy()
+    infeasible = np.zeros(n_scenarios, dtype=bool)
+    cycles_skipped = np.zeros(n_scenarios, dtype=np.int64)
+    soc_error_bound = np.zeros(n_scenarios)
+    last_drop = np.zeros(n_scenarios)  # SoC drop (%) of the last exact cycle, to convert the SoC error to distance
+
+    if n_scenarios < scalar_scenarios:
+        module = zero_order_energy_consumed if order == 0 else energyconsumptionfirstorder
+        curves = module.parameter_curves(model, lut_resolution)
+        for k in range(n_scenarios):
+            (steps[k], soc_end[k], infeasible[k], cycles_skipped[k], soc_error_bound[k], last_drop[k]) = _scalar_run(
+                curves, order, p_batt[profile_of[k]], soc_start[k], ocv_scale[k], r0_scale[k], r1_scale[k],
+                capacity_pack[k], soc_floor, max_steps, max_soc_jump, floor_margin)
+        active = np.array([], dtype=np.intp)
+    else:
+        curves = _vector_curves(model, order, lut_resolution)
+        active = np.flatnonzero(soc_start > soc_floor)
+
+    # state (and constants) of the scenarios still running, compacted whenever some of them finish
+    soc = soc_start[active]
+    V1 = np.zeros(len(active))
+    profile_a, ocv_scale_a, r0_scale_a, r1_scale_a, capacity_a = (
+        a[active] for a in (profile_of, ocv_scale, r0_scale, r1_scale, capacity_pack))
+    cycle_start_a = soc.copy()                  # SoC at the start of the current cycle
+    jump_a = np.zeros(len(active), dtype=np.int64)  # cycles skipped at the start of the current cycle
+    jump_drop_a = np.zeros(len(active))             # and the drop per cycle used for that jump
+    t_now = 0
+    while len(active) and (max_steps is None or t_now < max_steps):
+        power_demand = p_batt[profile_a, t_now % period]
+        if order == 0:
+            ocv_cell, r0_cell, r0_charge_cell = curves(soc)
+            ocv_now = ocv_cell*ocv_scale_a
+            R0_now = np.where(power_demand < 0, r0_charge_cell, r0_cell)*r0_scale_a
+        else:
+            ocv_cell, r0_cell, r1_cell, tau_now = curves(soc) #tau is not impacted by series or parallel
+            ocv_now = ocv_cell*ocv_scale_a
+            R0_now = r0_cell*r0_scale_a
+            R1_now = r1_cell*r1_scale_a
+            ocv_now = ocv_now - V1 # OCVeff = OCV - V1
+        discriminant = ocv_now*ocv_now - 4*power_demand*R0_now
+        feasible = discriminant >= 0
+        I2 = (ocv_now - np.sqrt(np.where(feasible, discriminant, 0)))/(2*R0_now)
+        soc = np.where(feasible, soc - ((I2/3600)/capacity_a)*100, soc)
+        if order == 1:
+            alpha = np.where(tau_now > 0, np.exp(-1/np.where(tau_now > 0, tau_now, 1)), 0.0)
+            V1 = V1*alpha + I2*R1_now*(1 - alpha)
+        t_now += 1
+
+        if max_soc_jump is not None and t_now % period == 0:
+            # end of an exact cycle: correct the last jump with the mean of the drops before and after it
+            drop = cycle_start_a - soc
+            soc = soc - jump_a*(drop - jump_drop_a)/2
+            soc_error_bound[active] += jump_a*np.abs(drop - jump_drop_a)/2
+            last_drop[active] = drop
+            # then skip whole cycles while staying clear of the floor
+            stop_jumping_at = soc_floor + np.maximum(floor_margin, 2*drop)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                jump = np.where(drop > 0, np.floor(np.minimum(max_soc_jump, soc - stop_jumping_at)/drop), 0)
+            jump_a = np.maximum(jump, 0).astype(np.int64)
+            jump_drop_a = drop
+            soc = soc - jump_a*drop
+            cycles_skipped[active] += jump_a
+            cycle_start_a = soc
+
+        done = ~feasible | (soc <= soc_floor)
+        if done.any():
+            finished = active[done]
+            steps[finished] = np.where(feasible[done], t_now, t_now - 1)
+            soc_end[finished] = soc[done]
+            infeasible[finished] = ~feasible[done]
+            keep = ~done
+            active, soc, V1 = active[keep], soc[keep], V1[keep]
+            profile_a, ocv_scale_a, r0_scale_a, r1_scale_a, capacity_a, cycle_start_a, jump_a, jump_drop_a = (
+                a[keep] for a in (profile_a, ocv_scale_a, r0_scale_a, r1_scale_a, capacity_a, cycle_start_a, jump_a,
+                                  jump_drop_a))
+    # scenarios cut by max_steps
+    steps[active] = t_now
+    soc_end[active] = soc
+    steps += cycles_skipped*period
+
+    full_cycles, remainder = np.divmod(steps, period)
+    energy = full_cycles*cumulative_energy[profile_of, -1] + cumulative_energy[profile_of, remainder]
+    distance = full_cycles*cumulative_distance[-1] + cumulative_distance[remainder]
+    return {
+        "number_series_cells": n_series, "number_parallel_cells": n_parallel,
+        "R0_coefficient": r0_coeff, "OCV_coefficient": ocv_coeff, "R1_coefficient": r1_coeff,
+        "SoC": soc_start, "mass": mass, "wind": wind, "angle": angle,
+        "energyconsumed": energy,
+        "distance": distance,
+        "end_time": steps,
+        "SOC_end": soc_end,
+        "infeasible": infeasible,
+        "cycles_skipped": cycles_skipped,
+        "soc_error_bound": soc_error_bound,
+        # a SoC error of one cycle's drop is one cycle of distance
+        "range_error_bound": np.divide(soc_error_bound*cumulative_distance[-1], last_drop,
+                                       out=np.zeros(n_scenarios), where=last_drop > 0),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep pack configurations in one batched simulation")
+
+    parser.add_argument(
+        "--file",
+        help="Filename of the cell (e.g., CELL_E_TEST_00.csv)",
+        default="CELL_E_TEST_00.csv"
+    )
+    parser.add_argument("--order", type=int, choices=[0, 1], default=0, help="Equivalent circuit model order")
+
+    args = parser.parse_args()
+
+    file_path = Path("Cell_data") / args.file
+
+    # every total cell count of the GUI, with 1 to 4 cells in parallel
+    n_parallel, n_cells = np.meshgrid(np.arange(1, 5), np.arange(200, 244, 4))
+    results = energy_consumption_batch(file_path, (n_cells/n_parallel).ravel(), n_parallel.ravel(), 1, 1, 100, 1502, 0, 0,
+                                       order=args.order)
+    for k in range(len(results["distance"])):
+        print(f"{results['number_series_cells'][k]:6.1f}S {results['number_parallel_cells'][k]:.0f}P: "
+              f"{results['energyconsumed'][k]:6.2f} kWh, {results['distance'][k]/1000:7.1f} km")
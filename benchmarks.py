@@ -0,0 +1,253 @@
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from io import BytesIO
+from pathlib import Path
+
+import matplotlib
+matplotlib.use("Agg")  # figures are rendered to PNG, never shown
+import matplotlib.pyplot as plt
+import numpy as np
+
+import cell_data_cache
+import cell_model
+import drive_cycles
+import power_from_WLTP
+import R0_OCV_computation
+import SoC_computation
+import socpolarization
+import zero_order_energy_consumed
+import energyconsumptionfirstorder
+import batch_simulation
+import pack_simulation
+import sensitivity
+import SoC_0thorder_parameters_link
+import plot_tests
+
+# Benchmark suite over the bundled Cell_data and WLTC_data.csv.
+# Every benchmark is run `repeat` times; the in-memory caches are cleared before each run (see _cold) so that
+# the extraction benchmarks measure the work and not a cache hit. Each benchmark reports min / median / mean
+# wall time and the peak memory allocated by Python during one run (tracemalloc, measured in a separate run so
+# that it does not slow the timed runs down). Results are written as JSON and two result files can be compared:
+#
+#   python benchmarks.py --output before.json
+#   python benchmarks.py --output after.json
+#   python benchmarks.py --compare before.json after.json --threshold 0.2
+#
+# The import stage times `import module` in a fresh interpreter for the modules used as entry points (importing
+# must not read data or load matplotlib / SciPy); a module slower to import than the budget fails the run:
+#
+#   python benchmarks.py --stage import --import-budget 1.0
+
+DATA_FOLDER = Path("Cell_data")
+REFERENCE_CELL = DATA_FOLDER / "CELL_E_TEST_00.csv"
+DEFAULT_REPEAT = 5
+DEFAULT_THRESHOLD = 0.2  # a median time more than 20 % slower than the reference is a regression
+
+STAGES = ["import", "ingestion", "extraction", "simulation", "gui_render"]
+IMPORTED_MODULES = ["cell_model", "power_from_WLTP", "socpolarization", "SoC_0thorder_parameters_link",
+                    "zero_order_energy_consumed", "energyconsumptionfirstorder", "SoH_degradation", "batch_simulation"]
+IMPORT_BUDGET_S = 1.0  # median time to import any module of IMPORTED_MODULES, interpreter start included
+
+
+def _cold():
+    # In-memory caches only: the columnar copies and saved cell models on disk are part of the setup being measured
+    cell_data_cache.invalidate()
+    cell_model._loaded_models.clear()
+    power_from_WLTP._profile_cache.clear()
+    drive_cycles._cycles.clear()
+
+
+def _figure_png(fig):
+    buffer = BytesIO()
+    fig.savefig(buffer, format="png", bbox_inches="tight")
+    plt.close(fig)
+    return buffer.getvalue()
+
+
+def _import_in_new_interpreter(module):
+    subprocess.run([sys.executable, "-c", f"import {module}"], cwd=Path(__file__).resolve().parent, check=True)
+
+
+def _cell_files():
+    return sorted(DATA_FOLDER.glob("*.csv"))
+
+
+# ---------------- Benchmarks ----------------
+# name -> (stage, setup, run). setup() is not timed; its result is passed to run().
+
+def _benchmarks():
+    reference_model = lambda: cell_model.get_cell_model(REFERENCE_CELL)
+    imports = {f"import_{module}": ("import", None, lambda _, module=module: _import_in_new_interpreter(module))
+               for module in IMPORTED_MODULES}
+    return {
+        **imports,
+
+        # ingestion
+        "parse_csv": ("ingestion", None, lambda _: [cell_data_cache.parse_cell_file(f) for f in _cell_files()]),
+        "load_cell_data": ("ingestion", None, lambda _: [cell_data_cache.load_cell_data(f) for f in _cell_files()]),
+        "load_wltc": ("ingestion", None, lambda _: power_from_WLTP.load_profile()),
+
+        # extraction
+        "identify_R0_OCV": ("extraction", None, lambda _: [R0_OCV_computation.identify_R0_OCV(f) for f in _cell_files()]),
+        "soc_by_spike": ("extraction", None, lambda _: [SoC_computation.soc_by_spike(f) for f in _cell_files()]),
+        "extract_step9_plateaus": ("extraction", None,
+                                   lambda _: socpolarization.extract_step9_plateaus_fixed_tau(DATA_FOLDER)),
+        "fit_cell_model": ("extraction", None, lambda _: cell_model.fit_cell_model(REFERENCE_CELL)),
+
+        # simulation
+        "run_simulation": ("simulation", None, lambda _: power_from_WLTP.run_simulation(1502, 0, 0)),
+        "zero_order": ("simulation", reference_model,
+                       lambda model: zero_order_energy_consumed.energy_consumption_cell(model, 110, 2, 1, 1, 100, 1502, 0, 0)),
+        "zero_order_accelerated": ("simulation", reference_model,
+                                   lambda model: zero_order_energy_consumed.energy_consumption_cell_accelerated(
+                                       model, 110, 2, 1, 1, 100, 1502, 0, 0)),
+        "first_order": ("simulation", reference_model,
+                        lambda model: energyconsumptionfirstorder.energy_consumption_cell(model, 110, 2, 1, 1, 1, 100, 1502, 0, 0)),
+        "pack_per_cell": ("simulation", lambda: pack_simulation.draw_cell_pack(seed=0),
+                          lambda pack: pack_simulation.energy_consumption_pack(pack, 100, 1502, 0, 0, max_soc_jump=None)),
+        "pack_per_cell_accelerated": ("simulation", lambda: pack_simulation.draw_cell_pack(seed=0),
+                                      lambda pack: pack_simulation.energy_consumption_pack(pack, 100, 1502, 0, 0)),
+        "pack_per_cell_first_order": ("simulation", lambda: pack_simulation.draw_cell_pack(seed=0),
+                                      lambda pack: pack_simulation.energy_consumption_pack(pack, 100, 1502, 0, 0, order=1,
+                                                                                           max_soc_jump=None)),
+        "batch_pack_sweep": ("simulation", reference_model,
+                             lambda model: batch_simulation.energy_consumption_batch(
+                                 model, np.arange(200, 241, 4) / 2, 2, 1, 1, 100, 1502, 0, 0)),
+        "sensitivity_given_data": ("simulation", reference_model,
+                                   lambda model: sensitivity.sensitivity_analysis(model, 1000, method="given_data", seed=0)),
+
+        # GUI render (figure + PNG encoding, as GUI.py does)
+        "plot_cell_file": ("gui_render", None, lambda _: _figure_png(plot_tests.plot_file(REFERENCE_CELL))),
+        "plot_wltp_power": ("gui_render", lambda: power_from_WLTP.run_simulation(1502, 0, 0),
+                            lambda results: [_figure_png(power_from_WLTP.plot_speed(results)),
+                                             _figure_png(power_from_WLTP.plot_total_power(results)),
+                                             _figure_png(power_from_WLTP.plot_battery_power(results))]),
+        "plot_zero_order": ("gui_render",
+                            lambda: zero_order_energy_consumed.energy_consumption_cell(reference_model(), 110, 2, 1, 1, 100, 1502, 0, 0),
+                            lambda results: [_figure_png(zero_order_energy_consumed.plot_distance_SOC(results)),
+                                             _figure_png(zero_order_energy_consumed.plot_voltage_time(results))]),
+        "plot_parameters": ("gui_render", None,
+                            lambda _: [_figure_png(SoC_0thorder_parameters_link.plot_R0_SOC(REFERENCE_CELL, 1.0)),
+                                       _figure_png(SoC_0thorder_parameters_link.plot_ocv_soc_full_link(REFERENCE_CELL, 1.0)),
+                                       _figure_png(socpolarization.plot_SOC_R1(REFERENCE_CELL, 1.0))]),
+    }
+
+
+def run_benchmark(name, repeat=DEFAULT_REPEAT):
+    stage, setup, run = _benchmarks()[name]
+    times = []
+    for _ in range(repeat):
+        _cold()
+        argument = setup() if setup is not None else None
+        _cold()
+        start = time.perf_counter()
+        run(argument)
+        times.append(time.perf_counter() - start)
+
+    # peak memory of one more run, traced separately
+    _cold()
+    argument = setup() if setup is not None else None
+    _cold()
+    tracemalloc.start()
+    run(argument)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "stage": stage,
+        "repeat": repeat,
+        "min_s": min(times),
+        "median_s": statistics.median(times),
+        "mean_s": statistics.fmean(times),
+        "peak_memory_mb": peak / 2**20,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(names=None, stages=None, repeat=DEFAULT_REPEAT, verbose=True):
+    benchmarks = _benchmarks()
+    names = names or [n for n, (stage, _, _) in benchmarks.items() if stages is None or stage in stages]
+    results = {}
+    for name in names:
+        if name not in benchmarks:
+            raise KeyError(f"Unknown benchmark '{name}'. Available: {', '.join(benchmarks)}")
+        results[name] = run_benchmark(name, repeat)
+        if verbose:
+            r = results[name]
+            print(f"{r['stage']:<11} {name:<36} median {r['median_s']*1000:9.1f} ms"
+                  f"   min {r['min_s']*1000:9.1f} ms   peak {r['peak_memory_mb']:8.1f} MB")
+    return {
+        "commit": _git_commit(),
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "benchmarks": results,
+    }
+
+
+# Import benchmarks whose median time is above the budget.
+def over_import_budget(results, budget=IMPORT_BUDGET_S):
+    return [name for name, r in results["benchmarks"].items() if r["stage"] == "import" and r["median_s"] > budget]
+
+
+# Benchmarks whose median time grew by more than `threshold` (relative) from `reference` to `current`.
+def compare_results(reference, current, threshold=DEFAULT_THRESHOLD, verbose=True):
+    regressions = []
+    for name, new in current["benchmarks"].items():
+        old = reference["benchmarks"].get(name)
+        if old is None:
+            continue
+        ratio = new["median_s"] / old["median_s"] if old["median_s"] > 0 else float("inf")
+        regressed = ratio > 1 + threshold
+        if regressed:
+            regressions.append(name)
+        if verbose:
+            print(f"{name:<36} {old['median_s']*1000:9.1f} ms -> {new['median_s']*1000:9.1f} ms  x{ratio:5.2f}"
+                  f"   peak {old['peak_memory_mb']:7.1f} -> {new['peak_memory_mb']:7.1f} MB"
+                  + ("   REGRESSION" if regressed else ""))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ingestion, extraction, simulation and GUI rendering")
+    parser.add_argument("--stage", choices=STAGES, action="append", help="Only run this stage (can be repeated)")
+    parser.add_argument("--bench", action="append", help="Only run this benchmark (can be repeated)")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="Timed runs per benchmark")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", nargs=2, metavar=("REFERENCE", "CURRENT"),
+                        help="Compare two result files instead of running the benchmarks")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Relative slowdown of the median time counted as a regression (default 0.2)")
+    parser.add_argument("--import-budget", type=float, default=IMPORT_BUDGET_S,
+                        help=f"Maximum median import time of a module, in s (default {IMPORT_BUDGET_S})")
+    args = parser.parse_args()
+
+    if args.compare:
+        reference, current = (json.loads(Path(p).read_text()) for p in args.compare)
+        regressions = compare_results(reference, current, args.threshold)
+        print(f"{len(regressions)} regression(s) above {args.threshold:.0%}" + (f": {', '.join(regressions)}" if regressions else ""))
+        raise SystemExit(1 if regressions else 0)
+
+    results = run_suite(args.bench, args.stage, args.repeat)
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+        print(f"Results written to {args.output}")
+    over_budget = over_import_budget(results, args.import_budget)
+    if over_budget:
+        print(f"Import time above {args.import_budget} s: {', '.join(over_budget)}")
+        raise SystemExit(1)
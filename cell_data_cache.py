@@ -0,0 +1,116 @@
+import hashlib
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import columnar_format
+
+# Shared loader for the cycler files of Cell_data.
+# Every file is parsed, its column names stripped and its values converted to numbers only once,
+# then the same DataFrame is served to every function that needs it.
+# The cache is bounded (least recently used files are evicted first) and an entry is dropped as soon
+# as the file on disk changes (modification time and size, or the content hash if asked for).
+# When an up-to-date binary columnar copy of the file exists (see columnar_format.py) it is read instead of the CSV.
+
+CELL_COLUMNS = ["Total Time", "Current", "Voltage", "Step"]
+MAX_CACHED_FILES = 8
+
+_cache = OrderedDict()
+
+
+# A cell file can be read from its CSV or from its columnar copy alone; the error names the CSV when neither exists.
+def _check_exists(csv_path):
+    manifest = columnar_format.columnar_path(csv_path) / columnar_format.MANIFEST_NAME
+    if not Path(csv_path).exists() and not manifest.exists():
+        raise FileNotFoundError(f"Cell file not found: {csv_path} (nor its columnar copy {manifest.parent})")
+
+
+def file_signature(csv_path, use_hash=False):
+    csv_path = Path(csv_path)
+    _check_exists(csv_path)
+    if not csv_path.exists():
+        csv_path = columnar_format.columnar_path(csv_path) / columnar_format.MANIFEST_NAME
+    stat = csv_path.stat()
+    if use_hash:
+        digest = hashlib.sha1()
+        with open(csv_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return (stat.st_size, digest.hexdigest())
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def parse_cell_file(csv_path):
+    df = pd.read_csv(csv_path)
+    # Normalize column names
+    df.columns = [c.strip() for c in df.columns]
+    #Converts all values to numbers (basically just a safety check)
+    for col in CELL_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+    return df
+
+
+def read_cell_file(csv_path):
+    _check_exists(csv_path)
+    if columnar_format.is_up_to_date(csv_path):
+        columns = columnar_format.load_columnar(columnar_format.columnar_path(csv_path))
+        return pd.DataFrame({name: np.asarray(values) for name, values in columns.items()})
+    return parse_cell_file(csv_path)
+
+
+def _cache_key(csv_path):
+    return str(Path(csv_path).resolve())
+
+
+def _cache_entry(csv_path, use_hash=False):
+    key = _cache_key(csv_path)
+    signature = file_signature(csv_path, use_hash)
+    entry = _cache.get(key)
+    if entry is None or entry["signature"] != signature:
+        entry = {"signature": signature, "data": read_cell_file(csv_path), "derived": {}}
+        _cache[key] = entry
+    _cache.move_to_end(key)
+    while len(_cache) > MAX_CACHED_FILES:
+        _cache.popitem(last=False)
+    return entry
+
+
+def load_cell_data(csv_path, use_hash=False):
+    """
+    Returns the parsed DataFrame of a cell file. The same object is shared by every caller,
+    so it must be treated as read-only (take a .copy() before modifying it).
+    """
+    return _cache_entry(csv_path, use_hash)["data"]
+
+
+def cached_derived(csv_path, name, builder):
+    """
+    Returns builder(df) for the cell file, computed once and kept with the cached DataFrame,
+    so it is invalidated and evicted together with it.
+    """
+    entry = _cache_entry(csv_path)
+    if name not in entry["derived"]:
+        entry["derived"][name] = builder(entry["data"])
+    return entry["derived"][name]
+
+
+def load_cell_columns(csv_path, columns=CELL_COLUMNS):
+    """
+    Returns {column name: array} for only the requested columns. With an up-to-date columnar copy the arrays
+    are memory-mapped straight from disk (zero-copy), otherwise they are views of the cached DataFrame.
+    Either way they are read-only.
+    """
+    if columnar_format.is_up_to_date(csv_path):
+        return columnar_format.load_columnar(columnar_format.columnar_path(csv_path), columns)
+    df = load_cell_data(csv_path)
+    return {c: df[c].to_numpy() for c in columns}
+
+
+def invalidate(csv_path=None):
+    if csv_path is None:
+        _cache.clear()
+    else:
+        _cache.pop(_cache_key(csv_path), None)
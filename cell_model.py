@@ -0,0 +1,179 @@
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+from cell_data_cache import file_signature
+from soc_lut import SocLookupTable, DEFAULT_RESOLUTION
+from SoC_computation import overall_capacity
+from SoC_0thorder_parameters_link import soc_parameter_points
+from socpolarization import polarization_points
+
+# A CellModel holds everything the simulations need from one cell data file: the capacity and the
+# OCV, R0 (charge and discharge), R1 and tau points linked to the SoC, with their PCHIP interpolators.
+# Fitting it runs the whole extraction pipeline once; it can then be saved to disk (.npz) and loaded
+# back in a few milliseconds, so the energy models take a CellModel instead of re-reading the CSV.
+
+MODEL_CACHE_DIR = Path("model_cache")
+MODEL_VERSION = 1  # bump when the extraction changes, so older saved models are refitted
+
+_loaded_models = {}
+
+
+class CellModel:
+
+    def __init__(self, name, capacity, soc, r0, ocv, soc_charge, r0_charge, ocv_charge,
+                 soc_pol=None, r1=None, tau=None, source_signature=None):
+        self.name = name
+        self.capacity = float(capacity)  # in Ah
+        self.soc = np.asarray(soc, dtype=float)
+        self.r0 = np.asarray(r0, dtype=float)
+        self.ocv = np.asarray(ocv, dtype=float)
+        self.soc_charge = np.asarray(soc_charge, dtype=float)
+        self.r0_charge = np.asarray(r0_charge, dtype=float)
+        self.ocv_charge = np.asarray(ocv_charge, dtype=float)
+        self.soc_pol = None if soc_pol is None else np.asarray(soc_pol, dtype=float)
+        self.r1 = None if r1 is None else np.asarray(r1, dtype=float)
+        self.tau = None if tau is None else np.asarray(tau, dtype=float)
+        self.source_signature = source_signature
+
+        # Shape-preserving cubic interpolators (PCHIP) of the parameters against the SoC (%).
+        from scipy.interpolate import PchipInterpolator  # loaded with the first model, not on import
+        self.ocv_interp = PchipInterpolator(self.soc, self.ocv)
+        self.r0_interp = PchipInterpolator(self.soc, self.r0)
+        self.ocv_charge_interp = PchipInterpolator(self.soc_charge, self.ocv_charge)
+        self.r0_charge_interp = PchipInterpolator(self.soc_charge, self.r0_charge)
+        if self.has_polarization:
+            self.r1_interp = PchipInterpolator(self.soc_pol, self.r1, extrapolate=True)
+            self.tau_interp = PchipInterpolator(self.soc_pol, self.tau, extrapolate=True)
+        else:
+            self.r1_interp = None
+            self.tau_interp = None
+        self._lookup_tables = {}
+
+    def lookup_tables(self, resolution=DEFAULT_RESOLUTION):
+        """
+        Returns {parameter: SocLookupTable} of every interpolator, tabulated with the given SoC resolution (%).
+        Tables are built once per resolution and kept with the model.
+        """
+        if resolution not in self._lookup_tables:
+            interpolators = {"ocv": self.ocv_interp, "r0": self.r0_interp,
+                             "ocv_charge": self.ocv_charge_interp, "r0_charge": self.r0_charge_interp,
+                             "r1": self.r1_interp, "tau": self.tau_interp}
+            self._lookup_tables[resolution] = {name: SocLookupTable(interp, resolution)
+                                               for name, interp in interpolators.items() if interp is not None}
+        return self._lookup_tables[resolution]
+
+    @property
+    def has_polarization(self):
+        return self.soc_pol is not None and len(self.soc_pol) >= 2
+
+    def __repr__(self):
+        return f"CellModel({self.name!r}, capacity={self.capacity:.3f} Ah, {len(self.soc)} SoC points)"
+
+    def save(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        arrays = {
+            "version": np.array(MODEL_VERSION),
+            "name": np.array(self.name),
+            "capacity": np.array(self.capacity),
+            "soc": self.soc, "r0": self.r0, "ocv": self.ocv,
+            "soc_charge": self.soc_charge, "r0_charge": self.r0_charge, "ocv_charge": self.ocv_charge,
+            "source_signature": np.array([str(v) for v in self.source_signature or ()]),
+        }
+        if self.soc_pol is not None:
+            arrays.update({"soc_pol": self.soc_pol, "r1": self.r1, "tau": self.tau})
+        with open(path, "wb") as f:  # an open file keeps numpy from appending ".npz" to the name
+            np.savez(f, **arrays)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            if int(data["version"]) != MODEL_VERSION:
+                raise ValueError(f"{path}: saved with model version {int(data['version'])}, expected {MODEL_VERSION}")
+            polarization = {k: data[k] for k in ("soc_pol", "r1", "tau")} if "soc_pol" in data.files else {}
+            return cls(
+                str(data["name"]), float(data["capacity"]),
+                data["soc"], data["r0"], data["ocv"],
+                data["soc_charge"], data["r0_charge"], data["ocv_charge"],
+                source_signature=tuple(data["source_signature"].tolist()),
+                **polarization,
+            )
+
+
+def fit_cell_model(csv_path):
+    csv_path = Path(csv_path)
+    soc, r0, ocv = soc_parameter_points(csv_path)
+    soc_charge, r0_charge, ocv_charge = soc_parameter_points(csv_path, charge=True)
+    try:
+        soc_pol, r1, tau = polarization_points(csv_path)
+    except ValueError:
+        soc_pol, r1, tau = None, None, None  # no usable Step 9 plateau: the 1st order model is unavailable
+    return CellModel(
+        csv_path.stem, overall_capacity(csv_path),
+        soc, r0, ocv, soc_charge, r0_charge, ocv_charge,
+        soc_pol, r1, tau,
+        source_signature=tuple(str(v) for v in file_signature(csv_path)),
+    )
+
+
+def model_path(csv_path, cache_dir=MODEL_CACHE_DIR):
+    return Path(cache_dir) / (Path(csv_path).stem + ".npz")
+
+
+def get_cell_model(csv_path, cache_dir=MODEL_CACHE_DIR):
+    """
+    Returns the CellModel of a cell file, fitted only if no saved model matches the current file
+    (same size and modification time). Models are kept in memory and saved in cache_dir;
+    cache_dir=None disables the disk cache.
+    """
+    key = str(Path(csv_path).resolve())
+    signature = tuple(str(v) for v in file_signature(csv_path))
+    model = _loaded_models.get(key)
+    if model is not None and model.source_signature == signature:
+        return model
+
+    model = None
+    if cache_dir is not None and model_path(csv_path, cache_dir).exists():
+        try:
+            model = CellModel.load(model_path(csv_path, cache_dir))
+        except (ValueError, KeyError, OSError):
+            model = None  # unreadable or outdated format, refit it
+        if model is not None and model.source_signature != signature:
+            model = None
+    if model is None:
+        model = fit_cell_model(csv_path)
+        if cache_dir is not None:
+            model.save(model_path(csv_path, cache_dir))
+    _loaded_models[key] = model
+    return model
+
+
+# Lets the simulations accept either a CellModel or the path of a cell data file.
+def as_cell_model(model_or_path):
+    if isinstance(model_or_path, CellModel):
+        return model_or_path
+    return get_cell_model(model_or_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit and save the cell models")
+
+    parser.add_argument(
+        "--file",
+        help="Filename to fit (e.g., CELL_E_TEST_00.csv). If omitted, fits all files in Cell_data folder.",
+        default=None
+    )
+
+    args = parser.parse_args()
+
+    if args.file:
+        files = [Path("Cell_data") / args.file]
+    else:
+        files = sorted(Path("Cell_data").glob("*.csv"))
+
+    for file in files:
+        model = fit_cell_model(file)
+        print(f"{model} -> {model.save(model_path(file))}")
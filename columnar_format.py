@@ -0,0 +1,113 @@
+import json
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+# Compact binary columnar copy of the cycler logs.
+# A file "Cell_data/CELL_E_TEST_00.csv" is converted to a folder "Cell_data/CELL_E_TEST_00.cols" holding
+# one typed .npy file per column plus a small manifest. The columns are memory-mapped when read, so only the
+# columns (and pages) a caller actually touches are read from disk, without any text parsing or copy.
+# The manifest records the size and modification time of the source CSV so a stale copy is never used.
+
+COLUMNAR_SUFFIX = ".cols"
+MANIFEST_NAME = "manifest.json"
+INTEGER_COLUMNS = ["Step"]
+
+
+def columnar_path(csv_path):
+    return Path(csv_path).with_suffix(COLUMNAR_SUFFIX)
+
+
+def _column_file_name(column):
+    return column.replace(" ", "_") + ".npy"
+
+
+def source_stat(csv_path):
+    stat = Path(csv_path).stat()
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+
+# integer_columns: columns stored as integers (when every value is a whole number, so no NaN), the others as float64; text columns
+# (e.g. file names) are stored as fixed-width unicode. parameters: how the columns were derived from the source
+# (e.g. column names and units), recorded in the manifest so a reader can tell whether the copy suits it.
+def write_columnar(df, out_dir, source=None, integer_columns=INTEGER_COLUMNS, parameters=None):
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    (out_dir / MANIFEST_NAME).unlink(missing_ok=True)  # a rewritten folder is unfinished until its new manifest exists
+    manifest = {"rows": len(df), "columns": {}, "source": source, "parameters": parameters}
+    for column in df.columns:
+        values = df[column].to_numpy()
+        if values.dtype.kind in "OUS":
+            values = values.astype(str)
+        # Step ids are stored as integers unless a value could not be read (NaN) or is not whole.
+        elif column in integer_columns and np.all(np.mod(values.astype(float), 1) == 0):
+            values = values.astype(np.int32)
+        else:
+            values = values.astype(np.float64)
+        np.save(out_dir / _column_file_name(column), np.ascontiguousarray(values))
+        manifest["columns"][column] = {"file": _column_file_name(column), "dtype": values.dtype.str}
+    # The manifest is written last: a folder without one is an unfinished conversion.
+    with open(out_dir / MANIFEST_NAME, "w") as f:
+        json.dump(manifest, f, indent=1)
+    return out_dir
+
+
+def convert_cell_file(csv_path, out_dir=None):
+    from cell_data_cache import parse_cell_file
+    out_dir = columnar_path(csv_path) if out_dir is None else Path(out_dir)
+    return write_columnar(parse_cell_file(csv_path), out_dir, source=source_stat(csv_path))
+
+
+def read_manifest(cols_dir):
+    manifest_file = Path(cols_dir) / MANIFEST_NAME
+    if not manifest_file.exists():
+        return None
+    with open(manifest_file) as f:
+        return json.load(f)
+
+
+def is_up_to_date(csv_path, cols_dir=None):
+    cols_dir = columnar_path(csv_path) if cols_dir is None else Path(cols_dir)
+    manifest = read_manifest(cols_dir)
+    if manifest is None:
+        return False
+    if not Path(csv_path).exists():
+        return True  # only the binary copy was shipped
+    return manifest["source"] == source_stat(csv_path)
+
+
+def load_columnar(cols_dir, columns=None):
+    """
+    Returns {column name: read-only memory-mapped array} for the requested columns (all by default).
+    """
+    cols_dir = Path(cols_dir)
+    manifest = read_manifest(cols_dir)
+    if manifest is None:
+        raise FileNotFoundError(f"{cols_dir} is not a columnar cell file (no {MANIFEST_NAME})")
+    if columns is None:
+        columns = list(manifest["columns"])
+    missing = [c for c in columns if c not in manifest["columns"]]
+    if missing:
+        raise ValueError(f"{cols_dir.name}: Missing columns {missing}. Found columns: {list(manifest['columns'])}")
+    return {c: np.load(cols_dir / manifest["columns"][c]["file"], mmap_mode="r") for c in columns}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert cell data files to the binary columnar format")
+
+    parser.add_argument(
+        "--file",
+        help="Filename to convert (e.g., CELL_E_TEST_00.csv). If omitted, converts all files in Cell_data folder.",
+        default=None
+    )
+
+    args = parser.parse_args()
+
+    if args.file:
+        files = [Path("Cell_data") / args.file]
+    else:
+        files = sorted(Path("Cell_data").glob("*.csv"))
+
+    for file in files:
+        print(f"{file} -> {convert_cell_file(file)}")
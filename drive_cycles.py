@@ -0,0 +1,187 @@
+import argparse
+import hashlib
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import columnar_format
+
+# Drive cycles for the power model.
+# A DriveCycle is a speed trace sampled every second (the simulations advance one second per sample). It can be
+# the bundled WLTC class 3 cycle, any CSV with a time and a speed column (a standard cycle or a real vehicle log),
+# or arrays built in code. Logs not sampled every second are resampled to 1 s when they are loaded.
+# Long logs are stored once in the binary columnar format of columnar_format.py, next to the CSV, and
+# memory-mapped from there afterwards: a multi-hour log is then opened without parsing and without loading it
+# in memory. The copy is refreshed when the CSV changes.
+
+WLTC_FILE = "WLTC_data.csv"
+WLTC_NAME = "WLTC class 3"
+WLTC_SPEED_COLUMN = "WLTC class 3, version 5, vehicle speed"
+TIME_COLUMN = "Time"    # column names of the stored (columnar) cycles
+SPEED_COLUMN = "Speed"  # m/s
+MEMMAP_MIN_SAMPLES = 100_000  # cycles at least this long (about 28 h at 1 Hz) are stored and memory-mapped
+
+SPEED_UNITS = {"kmh": 3.6, "ms": 1.0, "mph": 1/0.44704}  # speed in the file / SPEED_UNITS[unit] = speed in m/s
+
+_cycles = {}  # name -> DriveCycle, for the cycles registered by name
+
+
+class DriveCycle:
+
+    def __init__(self, name, time, speed_ms, source=None):
+        self.name = name
+        self.time = time            # s, one sample per second
+        self.speed_ms = speed_ms    # m/s
+        self.source = source        # (path, signature of the file) when loaded from disk
+        if len(time) != len(speed_ms):
+            raise ValueError(f"{name}: {len(time)} time values for {len(speed_ms)} speed values")
+
+    @property
+    def key(self):
+        """
+        Identifies the cycle in the power profile cache: its file and the version of it, or for a cycle built in
+        code, a hash of its time and speed values (two cycles of the same name can differ).
+        """
+        if self.source is not None:
+            return (self.name, self.source)
+        digest = hashlib.sha1(np.ascontiguousarray(self.time, dtype=float).tobytes())
+        digest.update(np.ascontiguousarray(self.speed_ms, dtype=float).tobytes())
+        return (self.name, digest.hexdigest())
+
+    @property
+    def period(self):
+        return len(self.speed_ms)  # samples (seconds) before the cycle repeats
+
+    @property
+    def distance(self):
+        return float(np.sum(self.speed_ms))  # m, one second per sample
+
+    def __repr__(self):
+        return f"DriveCycle({self.name!r}, {self.period} s, {self.distance/1000:.2f} km)"
+
+
+def _signature(path):
+    stat = Path(path).stat()
+    return (str(Path(path).resolve()), stat.st_mtime_ns, stat.st_size)
+
+
+def _is_current(cycle):
+    # cycles built in code, or read from a columnar copy without its CSV, cannot go stale
+    if cycle.source is None or cycle.source[1] is None:
+        return True
+    return Path(cycle.source[0]).exists() and cycle.source == _signature(cycle.source[0])
+
+
+def _find_column(columns, word, given):
+    if given is not None:
+        return given
+    matches = [c for c in columns if word in c.lower()]
+    if not matches:
+        raise ValueError(f"No {word} column found in {list(columns)}, pass its name explicitly")
+    return matches[0]
+
+
+def resample_to_seconds(time, speed):
+    """
+    Speed trace on a 1 s grid starting at the first time (linear interpolation). Samples without a time or a speed
+    (empty or non-numeric cells of a log) are dropped first.
+    """
+    time = np.asarray(time, dtype=float)
+    speed = np.asarray(speed, dtype=float)
+    valid = ~(np.isnan(time) | np.isnan(speed))
+    if not valid.all():
+        time, speed = time[valid], speed[valid]
+    if len(time) == 0:
+        raise ValueError("The cycle has no sample with both a numeric time and a numeric speed")
+    steps = np.diff(time)
+    if len(time) > 1 and np.all(steps == 1.0):
+        return time, speed
+    if np.any(steps <= 0):
+        raise ValueError("The time column must be strictly increasing")
+    grid = np.arange(time[0], time[-1] + 1e-9, 1.0)
+    return grid, np.interp(grid, time, speed)
+
+
+def load_cycle_csv(csv_path, time_column=None, speed_column=None, speed_unit="kmh", name=None, memmap=None):
+    """
+    Loads a drive cycle from a CSV. Without column names, the first column whose name contains "time" and the
+    first one containing "speed" are used. speed_unit is "kmh", "ms" or "mph". memmap=True stores the cycle in
+    the columnar format and memory-maps it (done automatically for cycles of MEMMAP_MIN_SAMPLES samples or more).
+    The copy holds the time and the speed in m/s, with the columns and unit they were read with: it is only used
+    by a call reading the same columns in the same unit (or when the CSV is not there any more).
+    """
+    csv_path = Path(csv_path)
+    name = csv_path.stem if name is None else name
+    cols_dir = columnar_format.columnar_path(csv_path)
+    source = _signature(csv_path) if csv_path.exists() else (str(cols_dir.resolve()), None, None)
+
+    if not csv_path.exists():
+        columns = columnar_format.load_columnar(cols_dir, [TIME_COLUMN, SPEED_COLUMN])
+        return DriveCycle(name, columns[TIME_COLUMN], columns[SPEED_COLUMN], source)
+
+    header = pd.read_csv(csv_path, nrows=0).columns
+    time_column = _find_column(header, "time", time_column)
+    speed_column = _find_column(header, "speed", speed_column)
+    parameters = {"time_column": time_column, "speed_column": speed_column, "speed_unit": speed_unit}
+    if memmap is not False and columnar_format.is_up_to_date(csv_path, cols_dir) and \
+            columnar_format.read_manifest(cols_dir).get("parameters") == parameters:
+        columns = columnar_format.load_columnar(cols_dir, [TIME_COLUMN, SPEED_COLUMN])
+        return DriveCycle(name, columns[TIME_COLUMN], columns[SPEED_COLUMN], source)
+
+    df = pd.read_csv(csv_path, usecols=[time_column, speed_column])
+    time, speed = resample_to_seconds(pd.to_numeric(df[time_column], errors="coerce").values,
+                                      pd.to_numeric(df[speed_column], errors="coerce").values/SPEED_UNITS[speed_unit])
+
+    if memmap or (memmap is None and len(time) >= MEMMAP_MIN_SAMPLES):
+        columnar_format.write_columnar(pd.DataFrame({TIME_COLUMN: time, SPEED_COLUMN: speed}), cols_dir,
+                                       source=columnar_format.source_stat(csv_path), parameters=parameters)
+        columns = columnar_format.load_columnar(cols_dir, [TIME_COLUMN, SPEED_COLUMN])
+        return DriveCycle(name, columns[TIME_COLUMN], columns[SPEED_COLUMN], source)
+    return DriveCycle(name, time, speed, source)
+
+
+def wltc_cycle():
+    if WLTC_NAME not in _cycles or not _is_current(_cycles[WLTC_NAME]):
+        cycle = load_cycle_csv(WLTC_FILE, "Total elapsed time", WLTC_SPEED_COLUMN, "kmh", name=WLTC_NAME, memmap=False)
+        cycle.time = cycle.time.astype(int)  # whole seconds, as in the file
+        _cycles[WLTC_NAME] = cycle
+    return _cycles[WLTC_NAME]
+
+
+def register_cycle(cycle):
+    _cycles[cycle.name] = cycle
+    return cycle
+
+
+def get_cycle(cycle=None):
+    """
+    Returns a DriveCycle from a DriveCycle, the name of a registered cycle or the path of a CSV / columnar
+    cycle. None is the WLTC class 3 cycle.
+    """
+    if cycle is None or cycle == WLTC_NAME:
+        return wltc_cycle()
+    if isinstance(cycle, DriveCycle):
+        return cycle
+    if cycle in _cycles and _is_current(_cycles[cycle]):
+        return _cycles[cycle]
+    path = Path(cycle)
+    if path.suffix == columnar_format.COLUMNAR_SUFFIX:
+        path = path.with_suffix(".csv")  # the columnar copy is used when the CSV is missing or unchanged
+    return register_cycle(load_cycle_csv(path, name=str(cycle)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load a drive cycle (and store long ones in the columnar format)")
+    parser.add_argument("--file", default=WLTC_FILE, help="CSV with a time and a speed column")
+    parser.add_argument("--time-column", default=None)
+    parser.add_argument("--speed-column", default=None)
+    parser.add_argument("--unit", choices=list(SPEED_UNITS), default="kmh", help="Unit of the speed column")
+    parser.add_argument("--memmap", action="store_true", help="Store the cycle in the columnar format")
+    args = parser.parse_args()
+
+    if args.file == WLTC_FILE:
+        cycle = wltc_cycle()
+    else:
+        cycle = load_cycle_csv(args.file, args.time_column, args.speed_column, args.unit, memmap=args.memmap or None)
+    print(cycle)
@@ -1,114 +1,99 @@
-from SoC_0thorder_parameters_link import *
-from power_from_WLTP import *
+import argparse
+from power_from_WLTP import run_simulation
 import math
+import numpy as np
 from pathlib import Path
-from scipy.interpolate import PchipInterpolator
-from socpolarization import (
-    overall_capacity,
-    soc_df_single,
-    extract_step9_plateaus_fixed_tau,
-)
-
-#R0_coeff, OCV_coeff, R1_coeff used in GUI to test sensitivity 
-def energy_consumption_cell(csv_path, number_series_cells, number_parallel_cells, R0_coefficient, R1_coefficient, OCV_coefficient,SOC, mass, wind, angle_theta):
-
-    #R0 interpolation 
-    soc_dict = OCV_SoC(csv_path) # the function OCV_SOC builds a list of tuples like (time_or_step_index, SOC%, R0, OCV) 
-    SOC_points = []
-    R0_points = []
-    OCV_points = []
-    for key in soc_dict.keys(): #loop extracts three arrays:SOC values, R0 values, OCV values
-        for tuple_index in range(len(soc_dict[key])): 
-            SOC_points.append(soc_dict[key][tuple_index][1]) #element [1] of tuple = SO
-            R0_points.append(soc_dict[key][tuple_index][2])
-            OCV_points.append(soc_dict[key][tuple_index][3])
-    SOC_points.sort() #interpolator expects x-values ordered
-    R0_points.reverse() #make R0 line up with sorted SOC
-    r0_interp =  PchipInterpolator(SOC_points, R0_points) #R0 is available for any SOC during simulation.
-
-    #OCV interpolation 
-    OCV_points.reverse()
-    ocv_interp = PchipInterpolator(SOC_points, OCV_points)
-
-    df_results = extract_step9_plateaus_fixed_tau("Cell_data") # Extract polarization params from Step 9 plateaus for each file
-    this_file = Path(csv_path).stem #Cell_data/CELL_E_TEST_00.csv" to "CELL_E_TEST_00. match the file name used in df_results["file"].
-    df_results = df_results[df_results["file"] == this_file].copy() #only use Step 9 pulses from the chosen cell file.
-
-    # SOC pulses for THIS file
-    df_soc = soc_df_single(csv_path) #returns a DataFrame with pulse_id and SoC.
-    df_soc["file"] = this_file #add a column "file" with the filename in order to merge by ["file", "pulse_id"].
-
-    df_merged = df_results.merge(df_soc, on=["file", "pulse_id"], how="inner") # each pulse has: SoC (from Step 15 coulomb counting) R_pol and tau (from Step 9 exponential behavior)
-
-    if df_merged.empty:
-        raise ValueError(
-            f"Empty merge for file '{this_file}'. "
-            f"Step=9 pulses and Step=15 pulses may not align by pulse_id."
-        )
-
-    df_merged = df_merged.dropna(subset=["SoC", "R_pol", "tau"]).sort_values("SoC") #removes any row where SoC, R_pol, or tau is NaN
-    # PCHIP needs strictly increasing x; group duplicates
-    df_merged = df_merged.groupby("SoC", as_index=False).median(numeric_only=True) #Combine duplicate SOC values (so x is strictly increasing)
-
-    r1_interp = PchipInterpolator(df_merged["SoC"].values, df_merged["R_pol"].values, extrapolate=True)
-    tau_interp = PchipInterpolator(df_merged["SoC"].values, df_merged["tau"].values, extrapolate=True)
-    # ------------------------------------------------------------------------
-
-    power_demand_dictionary = run_simulation(mass, angle_theta, wind ) #run_simulation outputs p_batt which we need to use to compute energy 
-    p_batt = power_demand_dictionary["p_batt"]
-    distance_demand = power_demand_dictionary["speed_ms"]
-    SOC_now = [SOC]
-    t_now = 0
-    energy_consumed=0
-    overall_capacity_cell = number_parallel_cells*overall_capacity(csv_path) # in parrallel you have to multiply, series doesnt change
-    U_list = []
+from cell_model import as_cell_model
+from soc_lut import ScalarCurve
+
+SOC_FLOOR = 1 # the simulation stops when the SoC reaches this value (%)
+
+
+"""
+Core of the 1st order model: from the SoC `SOC` and polarization voltage V1, at every second t the pack delivers
+p_batt[t % period] (t starting at start_step), until the SoC reaches soc_floor or max_steps seconds have been simulated.
+curves: (OCV, R0, R1, tau) of the cell, evaluated at the SoC of each second in plain Python floats.
+Returns the currents and the SoC after each second, the final V1, and whether the run stopped because the power
+demand could not be delivered.
+"""
+def simulate_1st_order(curves, p_batt, SOC, ocv_scale, r0_scale, r1_scale, capacity_pack, V1=0.0, soc_floor=SOC_FLOOR,
+                       start_step=0, max_steps=None):
+    ocv_interp, r0_interp, r1_interp, tau_interp = curves
+    power_list = np.asarray(p_batt, dtype=float).tolist()
+    period = len(power_list)
     I_list = []
-    distance_list = [0]
-
-    # --------- NEW: polarization state ----------
-    V1 = 0.0
+    SOC_list = []
+    soc = float(SOC)
     dt = 1.0
-    # ------------------------------------------
-
-    while SOC_now[-1]>1: #SOC never reaches 0
-        power_demand= p_batt[t_now%1801]
-        distance_list.append(float(distance_demand[t_now%1801]+distance_list[-1])) #add speed to previous distance, dt=1, so distance += speed*1s
-
-        ocv_cell = ocv_interp(SOC_now[-1])
-        ocv_now = ocv_cell*number_series_cells*OCV_coefficient
-
-        R0_cell = r0_interp(SOC_now[-1])
-        R0_now = (R0_cell*number_series_cells*R0_coefficient)/number_parallel_cells
-
-        R1_cell = float(r1_interp(SOC_now[-1]))
-        tau_now = float(tau_interp(SOC_now[-1])) #tau is not impacted by series or parallel
-        R1_now = (R1_cell*number_series_cells*R1_coefficient)/number_parallel_cells
+    infeasible = False
+    n = 0
+    while soc > soc_floor and (max_steps is None or n < max_steps): #SOC never reaches 0
+        power_demand = power_list[(start_step + n) % period]
+        ocv_now = ocv_interp(soc)*ocv_scale
+        R0_now = r0_interp(soc)*r0_scale
+        R1_now = float(r1_interp(soc))*r1_scale
+        tau_now = float(tau_interp(soc)) #tau is not impacted by series or parallel
 
         ocv_eff = ocv_now - V1  #simplify equation OCVeff = OCV - V1 since in quadratic equation there is R0​I^2−(OCV−V1​)I+P=0
-        try:
-            I2 = (ocv_eff - math.sqrt((ocv_eff)**2 - 4*power_demand*R0_now))/(2*R0_now)
-        except ValueError: # discriminant became negative → demanded power is impossible at that SOC.
-            print("Math domain error at time ", t_now, " seconds")
+        discriminant = ocv_eff*ocv_eff - 4*power_demand*R0_now
+        if discriminant < 0: # demanded power is impossible at that SOC
+            infeasible = True
             break
-
-        U2 = ocv_now - I2*R0_now - V1
-
-        U_list.append(U2)
+        I2 = (ocv_eff - math.sqrt(discriminant))/(2*R0_now)
+        soc = soc - ((I2/3600)/(capacity_pack))*100 #update the SOC value
         I_list.append(I2)
-
-        energy_consumed += float(power_demand/3600000)
-
-        new_SOC_2= SOC_now[-1] - ((I2/3600)/(overall_capacity_cell))*100 #update the SOC value 
-        SOC_now.append(float(new_SOC_2))
+        SOC_list.append(soc)
 
         alpha = math.exp(-dt/tau_now) if tau_now > 0 else 0.0
         V1 = V1*alpha + I2*R1_now*(1-alpha) #Update polarization voltage (have to take the last polvoltage into account and assume constant for one second)
+        n += 1
+    return np.array(I_list), np.array(SOC_list), V1, infeasible
 
-        t_now += 1
-        
-        
 
-    return energy_consumed, distance_list[-1]
+#R0_coeff, OCV_coeff, R1_coeff used in GUI to test sensitivity 
+#lut_resolution (SoC %) replaces the PCHIP curves by lookup tables (see soc_lut.py), faster but within model.lookup_tables(lut_resolution) errors
+#power_profile: output of run_simulation already computed by the caller, used instead of recomputing it
+#cycle: drive cycle repeated until the pack is empty (see drive_cycles.py), WLTC class 3 by default
+#verbose=False does not print when the power demand cannot be delivered (headless runs)
+def energy_consumption_cell(csv_path, number_series_cells, number_parallel_cells, R0_coefficient, R1_coefficient, OCV_coefficient,SOC, mass, wind, angle_theta, lut_resolution=None, power_profile=None, cycle=None, verbose=True):
+
+    # csv_path can also be a fitted CellModel, in which case no cell data is read at all
+    model = as_cell_model(csv_path)
+    curves = parameter_curves(model, lut_resolution)
+
+    power_demand_dictionary = run_simulation(mass, angle_theta, wind, cycle) if power_profile is None else power_profile #run_simulation outputs p_batt which we need to use to compute energy 
+    p_batt = power_demand_dictionary["p_batt"]
+    distance_demand = power_demand_dictionary["speed_ms"]
+    period = len(p_batt) # seconds before the drive cycle repeats
+    overall_capacity_cell = number_parallel_cells*model.capacity # in parrallel you have to multiply, series doesnt change
+
+    I_list, SOC_steps, V1, infeasible = simulate_1st_order(
+        curves, p_batt, SOC, number_series_cells*OCV_coefficient, (number_series_cells*R0_coefficient)/number_parallel_cells,
+        (number_series_cells*R1_coefficient)/number_parallel_cells, overall_capacity_cell)
+    t_now = len(I_list)
+    if infeasible and verbose:
+        print("Math domain error at time ", t_now, " seconds")
+
+    full_cycles, remainder = divmod(t_now, period)
+    energy_consumed = (full_cycles*float(np.sum(p_batt)) + float(np.sum(p_batt[:remainder])))/3600000
+    distance = full_cycles*float(np.sum(distance_demand)) + float(np.sum(distance_demand[:remainder]))
+    return energy_consumed, distance
+
+
+# Parameter curves used by the simulation loop: exact scalar PCHIP evaluation by default, or lookup tables
+# with the given SoC resolution (see soc_lut.py).
+def parameter_curves(model, lut_resolution=None):
+    if not model.has_polarization: # Step 9 pulses (R_pol, tau) could not be linked to the Step 15 SoC of this file
+        raise ValueError(
+            f"Empty merge for file '{model.name}'. "
+            f"Step=9 pulses and Step=15 pulses may not align by pulse_id."
+        )
+    if lut_resolution is None:
+        # exact PCHIP values, evaluated in plain Python floats (see soc_lut.ScalarCurve)
+        return (ScalarCurve(model.ocv_interp), ScalarCurve(model.r0_interp), ScalarCurve(model.r1_interp),
+                ScalarCurve(model.tau_interp))
+    tables = model.lookup_tables(lut_resolution)
+    return tables["ocv"], tables["r0"], tables["r1"], tables["tau"]
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Plot Cell Data Files")
@@ -0,0 +1,201 @@
+import argparse
+import time as timer
+from pathlib import Path
+
+import numpy as np
+
+from cell_model import as_cell_model
+from soc_lut import DEFAULT_RESOLUTION
+
+# SoC estimation for a whole fleet of cells with an extended Kalman filter (EKF).
+# Each cell has the state x = [SoC, V1] of the 1st order model (see online_estimator.py for the model and its
+# sign convention) and a 2x2 covariance P. Nothing is stored per cell as a Python object: the states, the three
+# distinct covariance terms (P00, P01, P11) and the cell parameters are NumPy arrays over all cells, and one
+# update() advances every cell by one sample with a fixed number of array operations.
+#
+# The parameter curves (OCV, R0, R0 charge, R1, tau) of every distinct cell model are tabulated on the same SoC
+# grid (soc_lut.py) and stacked in one (models x grid points) table, so evaluating them, and the slopes needed
+# for the EKF Jacobian, is an index computation and a gather for all cells at once, whatever model each cell uses.
+#
+# Predict (the previous current I held over dt):  SoC -= I*dt/3600/capacity*100,  V1 = alpha*V1 + I*R1*(1 - alpha)
+#                                                 P = F P F^T + Q*dt,  F = [[1, 0], [0, alpha]]
+# Update (new current I, measured voltage V):     V_pred = OCV(SoC) - I*R0(SoC) - V1,  H = [dOCV/dSoC - I*dR0/dSoC, -1]
+#                                                 K = P H^T / (H P H^T + R),  x += K (V - V_pred),  P -= K H P
+# Cells whose voltage is missing (NaN) are only predicted. The timestamps must be strictly increasing for every cell
+# (a dt <= 0 would make P lose its positive semi-definiteness and alpha exceed 1).
+
+PARAMETERS = ["ocv", "r0", "r0_charge", "r1", "tau"]
+PROCESS_NOISE = (1e-4, 1e-6)        # SoC (%^2/s) and V1 (V^2/s) random walk per cell
+MEASUREMENT_NOISE = 1e-4            # voltage measurement variance (V^2) per cell
+INITIAL_COVARIANCE = (25.0, 1e-4)   # initial SoC (%^2) and V1 (V^2) variances
+
+
+def _stacked_tables(models, resolution):
+    """
+    Returns (grid step, {parameter: flat values}, {parameter: flat slopes}): row m of each table holds
+    model m on the common SoC grid; cells without polarization data get R1 = tau = 0 (no RC branch).
+    """
+    values = {name: [] for name in PARAMETERS}
+    step = None
+    for model in models:
+        tables = model.lookup_tables(resolution)
+        reference = tables["ocv"]
+        step = reference.resolution
+        for name in PARAMETERS:
+            values[name].append(tables[name].values if name in tables else np.zeros(len(reference.grid)))
+    values = {name: np.stack(rows) for name, rows in values.items()}
+    slopes = {name: np.concatenate([np.diff(v, axis=1), np.zeros((len(v), 1))], axis=1) for name, v in values.items()}
+    return step, {name: v.ravel() for name, v in values.items()}, {name: s.ravel() for name, s in slopes.items()}
+
+
+class FleetSocEKF:
+
+    def __init__(self, models, model_of_cell, soc=100.0, number_series_cells=1, number_parallel_cells=1,
+                 R0_coefficient=1.0, R1_coefficient=1.0, OCV_coefficient=1.0, current_sign=1.0,
+                 process_noise=PROCESS_NOISE, measurement_noise=MEASUREMENT_NOISE,
+                 initial_covariance=INITIAL_COVARIANCE, lut_resolution=DEFAULT_RESOLUTION):
+        if not isinstance(models, (list, tuple)):
+            models = [models]
+        self.models = [as_cell_model(m) for m in models]
+        self.model_of_cell = np.asarray(model_of_cell, dtype=np.intp)
+        n = self.n_cells = len(self.model_of_cell)
+        if n and (self.model_of_cell.min() < 0 or self.model_of_cell.max() >= len(self.models)):
+            raise ValueError("model_of_cell must index the list of models")
+
+        self._step, self._values, self._slopes = _stacked_tables(self.models, lut_resolution)
+        self._n_grid = len(self._values["ocv"]) // len(self.models)
+        self._row_offset = self.model_of_cell*self._n_grid  # start of each cell's row in the flat tables
+
+        def per_cell(value):
+            return np.broadcast_to(np.asarray(value, dtype=float), (n,)).copy()
+
+        capacities = np.array([m.capacity for m in self.models])
+        n_series, n_parallel = per_cell(number_series_cells), per_cell(number_parallel_cells)
+        self.capacity = n_parallel*capacities[self.model_of_cell]  # Ah
+        self._ocv_scale = per_cell(OCV_coefficient)*n_series
+        self._r0_scale = per_cell(R0_coefficient)*n_series/n_parallel
+        self._r1_scale = per_cell(R1_coefficient)*n_series/n_parallel
+        self.current_sign = current_sign
+        self.q_soc, self.q_v1 = (per_cell(q) for q in process_noise)
+        self.measurement_noise = per_cell(measurement_noise)
+        self._initial_covariance = initial_covariance
+        self.reset(soc)
+
+    def reset(self, soc=100.0):
+        n = self.n_cells
+        self.soc = np.broadcast_to(np.asarray(soc, dtype=float), (n,)).copy()
+        self.v1 = np.zeros(n)
+        self.P00 = np.full(n, float(self._initial_covariance[0]))
+        self.P01 = np.zeros(n)
+        self.P11 = np.full(n, float(self._initial_covariance[1]))
+        self.time = None
+        self.current = np.zeros(n)      # current of the last sample, held until the next one
+        self.voltage = np.full(n, np.nan)  # predicted voltage at the last sample
+        self.innovation = np.full(n, np.nan)
+        self._R1 = np.zeros(n)
+        self._tau = np.zeros(n)
+        self.samples = 0
+
+    def _lookup(self, soc, names):
+        position = np.clip(soc/self._step, 0.0, self._n_grid - 1)
+        index = np.minimum(position.astype(np.intp), self._n_grid - 1)
+        fraction = position - index
+        flat = self._row_offset + index
+        return [(self._values[name][flat] + self._slopes[name][flat]*fraction, self._slopes[name][flat]/self._step)
+                for name in names]
+
+    def update(self, time, current, voltage=None):
+        """
+        Ingests one sample for every cell (time: scalar or per cell, current and voltage: per cell or scalar)
+        and returns the SoC estimates. voltage=None (or NaN for some cells) only runs the prediction.
+        The time of every cell must be later than its previous one.
+        """
+        current = self.current_sign*np.broadcast_to(np.asarray(current, dtype=float), (self.n_cells,))
+
+        # ---------------- Predict ----------------
+        if self.time is not None:
+            dt = np.broadcast_to(np.asarray(time, dtype=float) - self.time, (self.n_cells,))
+            stale = ~(dt > 0)
+            if stale.any():
+                cells = np.flatnonzero(stale)
+                raise ValueError(f"{len(cells)} cells (first: cell {cells[0]}, dt = {dt[cells[0]]} s) got a sample that "
+                                 "does not follow their previous one: the timestamps must be strictly increasing")
+            self.soc = self.soc - self.current*dt/3600/self.capacity*100
+            with np.errstate(divide="ignore", over="ignore"):
+                alpha = np.where(self._tau > 0, np.exp(-dt/np.where(self._tau > 0, self._tau, 1.0)), 0.0)
+            self.v1 = alpha*self.v1 + self.current*self._R1*(1 - alpha)
+            self.P00 = self.P00 + self.q_soc*dt
+            self.P01 = alpha*self.P01
+            self.P11 = alpha*alpha*self.P11 + self.q_v1*dt
+
+        # ---------------- Update ----------------
+        (ocv, docv), (r0, dr0), (r0c, dr0c) = self._lookup(self.soc, ["ocv", "r0", "r0_charge"])
+        charging = current < 0
+        R0 = np.where(charging, r0c, r0)*self._r0_scale
+        dR0 = np.where(charging, dr0c, dr0)*self._r0_scale
+        predicted = ocv*self._ocv_scale - current*R0 - self.v1
+
+        if voltage is not None:
+            innovation = np.broadcast_to(np.asarray(voltage, dtype=float), (self.n_cells,)) - predicted
+            measured = np.isfinite(innovation)
+            innovation = np.where(measured, innovation, 0.0)
+            h0 = docv*self._ocv_scale - current*dR0
+            h1 = -1.0
+            a = h0*self.P00 + h1*self.P01  # H P
+            b = h0*self.P01 + h1*self.P11
+            S = h0*a + h1*b + self.measurement_noise
+            K0 = np.where(measured, a/S, 0.0)
+            K1 = np.where(measured, b/S, 0.0)
+            self.soc = self.soc + K0*innovation
+            self.v1 = self.v1 + K1*innovation
+            self.P00 = self.P00 - K0*a
+            self.P01 = self.P01 - K0*b
+            self.P11 = self.P11 - K1*b
+            self.innovation = np.where(measured, innovation, np.nan)
+
+        # R1 and tau at the new SoC, used over the next interval
+        (r1, _), (tau, _) = self._lookup(self.soc, ["r1", "tau"])
+        self._R1 = r1*self._r1_scale
+        self._tau = tau
+
+        self.time = np.asarray(time, dtype=float)
+        self.current = current
+        self.voltage = predicted
+        self.samples += 1
+        return self.soc
+
+    @property
+    def soc_std(self):
+        return np.sqrt(np.maximum(self.P00, 0.0))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Throughput and convergence of the fleet EKF on synthetic data")
+    parser.add_argument("--cells", type=int, default=10000, help="Number of cells")
+    parser.add_argument("--steps", type=int, default=600, help="Samples per cell (1 s apart, at most 1800)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    models = [as_cell_model(f) for f in sorted(Path("Cell_data").glob("*.csv"))]
+    model_of_cell = rng.integers(0, len(models), args.cells)
+    true_soc = rng.uniform(60, 95, args.cells)
+    c_rate = rng.uniform(0.2, 1.0, args.cells)  # constant discharge (capacity per hour), at most 50 % SoC in 30 min
+    current = c_rate*np.array([m.capacity for m in models])[model_of_cell]
+
+    truth = FleetSocEKF(models, model_of_cell, soc=true_soc)       # open loop: the "real" cells
+    ekf = FleetSocEKF(models, model_of_cell, soc=100.0)            # starts with no knowledge of the SoC
+
+    elapsed = 0.0
+    for t in range(args.steps):
+        truth.update(t, current)
+        measured = truth.voltage + rng.normal(0, 0.005, args.cells)  # 5 mV noise
+        start = timer.perf_counter()
+        ekf.update(t, current, measured)
+        elapsed += timer.perf_counter() - start
+
+    error = ekf.soc - truth.soc
+    print(f"{args.cells} cells x {args.steps} samples in {elapsed:.2f} s "
+          f"({args.cells*args.steps/elapsed:,.0f} cell-samples/s)")
+    print(f"SoC error: RMS {np.sqrt(np.mean(error**2)):.2f} %, max {np.max(np.abs(error)):.2f} %, "
+          f"mean estimated std {np.mean(ekf.soc_std):.2f} %")
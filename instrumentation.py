@@ -0,0 +1,197 @@
+import argparse
+import functools
+import importlib
+import inspect
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+# Opt-in timing of the project's stages (loading, pulse detection, fitting, interpolation, stepping, plotting).
+# enable() replaces the public functions of INSTRUMENTED_MODULES by timing wrappers, everywhere they are referenced
+# (including the copies made by `from module import *`), and disable() puts the original functions back. Nothing
+# is wrapped until enable() is called, so the disabled cost is zero; span() costs one attribute lookup.
+#
+# For every function the profiler records the number of calls, the cumulative time (including the functions it
+# calls) and the self time (excluding the instrumented functions it calls). The report can be written as JSON or
+# as folded stacks ("caller;callee self_microseconds" lines), the input format of flamegraph.pl and speedscope.
+#
+#   with profiled() as profiler:
+#       energy_consumption_cell(...)
+#   profiler.write_json("profile.json")
+#   profiler.write_folded("profile.folded")
+
+INSTRUMENTED_MODULES = [
+    "cell_data_cache",
+    "step_segments",
+    "SoC_computation",
+    "R0_OCV_computation",
+    "SoC_0thorder_parameters_link",
+    "socpolarization",
+    "cell_model",
+    "power_from_WLTP",
+    "zero_order_energy_consumed",
+    "energyconsumptionfirstorder",
+]
+
+
+class Profiler:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.stats = {}     # name -> [calls, cumulative time, self time]
+            self.stacks = {}    # "outer;inner" call path -> self time
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    @contextmanager
+    def measure(self, name):
+        stack = self._stack()
+        frame = [name, 0.0]  # name, time spent in instrumented children
+        stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            self_time = elapsed - frame[1]
+            path = ";".join(f[0] for f in stack) + (";" if stack else "") + name
+            if stack:
+                stack[-1][1] += elapsed
+            outermost = name not in (f[0] for f in stack)  # recursive calls only count once in the cumulative time
+            with self._lock:
+                entry = self.stats.setdefault(name, [0, 0.0, 0.0])
+                entry[0] += 1
+                if outermost:
+                    entry[1] += elapsed
+                entry[2] += self_time
+                self.stacks[path] = self.stacks.get(path, 0.0) + self_time
+
+    def wrap(self, function, name):
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            with self.measure(name):
+                return function(*args, **kwargs)
+        timed.__wrapped_original__ = function
+        return timed
+
+    def report(self):
+        """Calls, cumulative and self time (s) of every instrumented function, by decreasing self time."""
+        with self._lock:
+            rows = [{"name": name, "calls": calls, "cumulative_s": cumulative, "self_s": self_time}
+                    for name, (calls, cumulative, self_time) in self.stats.items()]
+        return sorted(rows, key=lambda row: row["self_s"], reverse=True)
+
+    def write_json(self, path):
+        Path(path).write_text(json.dumps({"functions": self.report()}, indent=2))
+
+    def folded(self):
+        with self._lock:
+            return "\n".join(f"{path} {round(seconds * 1e6)}" for path, seconds in sorted(self.stacks.items())) + "\n"
+
+    def write_folded(self, path):
+        Path(path).write_text(self.folded())
+
+    def print_report(self, limit=20):
+        print(f"{'function':<60} {'calls':>8} {'cumulative (s)':>15} {'self (s)':>10}")
+        for row in self.report()[:limit]:
+            print(f"{row['name']:<60} {row['calls']:>8} {row['cumulative_s']:>15.4f} {row['self_s']:>10.4f}")
+
+
+PROFILER = Profiler()
+_originals = {}  # wrapper -> original function, for disable()
+_enabled = False
+
+
+def _public_functions(module):
+    for name, value in vars(module).items():
+        if not name.startswith("_") and inspect.isfunction(value) and value.__module__ == module.__name__:
+            yield name, value
+
+
+def _replace_everywhere(old, new):
+    # the function may have been copied into other modules (from module import *), replace every reference
+    for module in list(sys.modules.values()):
+        namespace = getattr(module, "__dict__", None)
+        if not namespace:
+            continue
+        for name, value in list(namespace.items()):
+            if value is old:
+                namespace[name] = new
+
+
+def enable(modules=INSTRUMENTED_MODULES, profiler=PROFILER):
+    global _enabled
+    if _enabled:
+        return profiler
+    for module_name in modules:
+        module = importlib.import_module(module_name)
+        for name, function in list(_public_functions(module)):
+            wrapper = profiler.wrap(function, f"{module_name}.{name}")
+            _originals[wrapper] = function
+            _replace_everywhere(function, wrapper)
+    _enabled = True
+    return profiler
+
+
+def disable():
+    global _enabled
+    for wrapper, function in _originals.items():
+        _replace_everywhere(wrapper, function)
+    _originals.clear()
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+# Time a block of code under `name` (e.g. a GUI pipeline step); does nothing unless instrumentation is enabled.
+def span(name, profiler=PROFILER):
+    return profiler.measure(name) if _enabled else nullcontext()
+
+
+@contextmanager
+def profiled(modules=INSTRUMENTED_MODULES, profiler=PROFILER):
+    already_enabled = _enabled
+    enable(modules, profiler)
+    try:
+        yield profiler
+    finally:
+        if not already_enabled:
+            disable()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile the model fit and the 0th and 1st order simulations of a cell")
+    parser.add_argument("--file", default="CELL_E_TEST_00.csv", help="Cell file in Cell_data (e.g., CELL_E_TEST_00.csv)")
+    parser.add_argument("--json", help="Write the report to this JSON file")
+    parser.add_argument("--folded", help="Write folded stacks (flame graph input) to this file")
+    args = parser.parse_args()
+
+    file_path = Path("Cell_data") / args.file
+    with profiled() as profiler:
+        import cell_model
+        import zero_order_energy_consumed
+        import energyconsumptionfirstorder
+        model = cell_model.fit_cell_model(file_path)
+        zero_order_energy_consumed.energy_consumption_cell(model, 110, 2, 1, 1, 100, 1502, 0, 0)
+        energyconsumptionfirstorder.energy_consumption_cell(model, 110, 2, 1, 1, 1, 100, 1502, 0, 0)
+
+    profiler.print_report()
+    if args.json:
+        profiler.write_json(args.json)
+    if args.folded:
+        profiler.write_folded(args.folded)
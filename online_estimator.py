@@ -0,0 +1,147 @@
+import argparse
+import math
+import time as timer
+from pathlib import Path
+
+import numpy as np
+
+from cell_model import as_cell_model
+from soc_lut import ScalarCurve
+
+# Online SoC / voltage estimation from live telemetry.
+# OnlineSocEstimator keeps the state of the 1st order model of energyconsumptionfirstorder.py (SoC from coulomb
+# counting and the polarization voltage V1 of the RC branch) and updates it one (time, current, voltage) sample at
+# a time, in constant time and memory: nothing is stored per sample. Each update follows the simulation loop:
+#
+#   over the interval since the previous sample (its current I held for dt):
+#       SoC -= I*dt / 3600 / capacity * 100
+#       V1   = V1*alpha + I*R1*(1 - alpha),   alpha = exp(-dt/tau), R1 and tau taken at the previous SoC
+#   at the new sample: OCV and R0 (charge R0 if I < 0) at the new SoC, predicted voltage U = OCV - I*R0 - V1
+#
+# The 1st order simulation uses the discharge R0 for every current, regeneration included: with charge_r0=False
+# the estimator does the same, and replaying the currents of a simulation with dt = 1 s then gives back its SoC
+# and voltages. The timestamps must be strictly increasing. Currents are positive when discharging, as in the
+# simulations; use current_sign=-1 for cycler logs (Cell_data), where the discharge current is negative.
+
+
+class OnlineSocEstimator:
+
+    def __init__(self, model, soc=100.0, number_series_cells=1, number_parallel_cells=1,
+                 R0_coefficient=1.0, R1_coefficient=1.0, OCV_coefficient=1.0, current_sign=1.0, lut_resolution=None,
+                 charge_r0=True):
+        self.model = as_cell_model(model)
+        self.number_series_cells = number_series_cells
+        self.number_parallel_cells = number_parallel_cells
+        self.current_sign = current_sign
+        self.capacity = number_parallel_cells*self.model.capacity  # Ah of the pack
+
+        if lut_resolution is None:
+            curves = {"ocv": self.model.ocv_interp, "r0": self.model.r0_interp, "r0_charge": self.model.r0_charge_interp,
+                      "r1": self.model.r1_interp, "tau": self.model.tau_interp}
+            curves = {name: ScalarCurve(interp) for name, interp in curves.items() if interp is not None}
+        else:
+            curves = self.model.lookup_tables(lut_resolution)
+        self._ocv = curves["ocv"]
+        self._r0 = curves["r0"]
+        # used while charging (negative current), as for regen in the 0th order model, unless charge_r0=False
+        self._r0_charge = curves["r0_charge"] if charge_r0 else curves["r0"]
+        self._r1_curve = curves.get("r1")   # no RC branch when the cell has no polarization parameters
+        self._tau_curve = curves.get("tau")
+
+        # pack scaling of the cell parameters, as in the energy models
+        self._ocv_scale = OCV_coefficient*number_series_cells
+        self._r0_scale = R0_coefficient*number_series_cells/number_parallel_cells
+        self._r1_scale = R1_coefficient*number_series_cells/number_parallel_cells
+
+        self.reset(soc)
+
+    def reset(self, soc=100.0):
+        self.soc = float(soc)
+        self.v1 = 0.0               # polarization voltage (V)
+        self.time = None            # time of the last sample (s)
+        self.current = 0.0          # current of the last sample (A), held until the next one
+        self.voltage = None         # predicted terminal voltage at the last sample (V)
+        self.voltage_error = None   # measured - predicted voltage at the last sample (V)
+        self.charge_ah = 0.0        # charge drawn since the reset (Ah)
+        self.samples = 0
+        self._R1 = 0.0              # R1 and tau at the SoC of the last sample, used over the next interval
+        self._tau = 0.0
+
+    def update(self, time, current, voltage=None):
+        """
+        Ingests one sample and returns (SoC, predicted voltage). With a measured voltage, the difference
+        measured - predicted is kept in voltage_error. The time must be later than that of the previous sample.
+        """
+        # 1. the current of the previous sample has been drawn since then
+        if self.time is not None:
+            dt = time - self.time
+            if not dt > 0:
+                raise ValueError(f"Sample at t = {time} s does not follow the previous one (t = {self.time} s): "
+                                 "the timestamps must be strictly increasing")
+            charge = self.current*dt/3600
+            self.soc = self.soc - charge/self.capacity*100
+            self.charge_ah += charge
+            alpha = math.exp(-dt/self._tau) if self._tau > 0 else 0.0
+            self.v1 = self.v1*alpha + self.current*self._R1*(1 - alpha)
+
+        # 2. parameters at the new SoC and voltage for the new current
+        current = self.current_sign*current
+        soc = self.soc
+        ocv = self._ocv(soc)*self._ocv_scale
+        R0 = (self._r0_charge(soc) if current < 0 else self._r0(soc))*self._r0_scale
+        predicted = ocv - current*R0 - self.v1
+        if self._r1_curve is not None:
+            self._R1 = self._r1_curve(soc)*self._r1_scale
+            self._tau = self._tau_curve(soc)
+
+        self.time = time
+        self.current = current
+        self.voltage = predicted
+        self.voltage_error = None if voltage is None else voltage - predicted
+        self.samples += 1
+        return soc, predicted
+
+    def update_batch(self, times, currents, voltages=None):
+        """
+        Ingests a micro-batch of samples (in time order) and returns the arrays of SoC and predicted voltage
+        at each of them.
+        """
+        times = np.asarray(times, dtype=float)
+        currents = np.asarray(currents, dtype=float)
+        socs = np.empty(len(times))
+        predicted = np.empty(len(times))
+        update = self.update
+        if voltages is None:
+            for k in range(len(times)):
+                socs[k], predicted[k] = update(times[k], currents[k])
+        else:
+            voltages = np.asarray(voltages, dtype=float)
+            for k in range(len(times)):
+                socs[k], predicted[k] = update(times[k], currents[k], voltages[k])
+        return socs, predicted
+
+    def state(self):
+        return {"time": self.time, "soc": self.soc, "v1": self.v1, "voltage": self.voltage,
+                "voltage_error": self.voltage_error, "charge_ah": self.charge_ah, "samples": self.samples}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a cell test file through the online SoC estimator")
+    parser.add_argument("--file", default="CELL_E_TEST_00.csv", help="Cell file in Cell_data (e.g., CELL_E_TEST_00.csv)")
+    parser.add_argument("--lut", type=float, default=None, help="Use lookup tables with this SoC resolution (%%)")
+    args = parser.parse_args()
+
+    from cell_data_cache import load_cell_data
+    file_path = Path("Cell_data") / args.file
+    df = load_cell_data(file_path)
+    # the replay starts at the rest before the first pulse (Step 6), where soc_by_spike takes the SoC as 100%
+    df = df[df["Total Time"] >= df.loc[df["Step"] == 6, "Total Time"].iloc[0]]
+    estimator = OnlineSocEstimator(file_path, current_sign=-1, lut_resolution=args.lut)
+
+    start = timer.perf_counter()
+    socs, predicted = estimator.update_batch(df["Total Time"], df["Current"], df["Voltage"])
+    elapsed = timer.perf_counter() - start
+
+    error = df["Voltage"].values - predicted
+    print(f"{len(socs)} samples in {elapsed:.3f} s ({len(socs)/elapsed:,.0f} samples/s)")
+    print(f"Final SoC: {estimator.soc:.2f} %, RMS voltage error: {np.sqrt(np.mean(error**2))*1000:.1f} mV")
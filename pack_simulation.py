@@ -0,0 +1,294 @@
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+
+from cell_model import as_cell_model
+from soc_lut import DEFAULT_RESOLUTION
+from power_from_WLTP import run_simulation
+from batch_simulation import SOC_FLOOR
+
+# Pack simulation with one state per cell.
+# The energy models treat the pack as one lumped cell scaled by number_series_cells / number_parallel_cells. Here
+# every cell of the pack has its own capacity, parameter curves (OCV, R0, R0 charge, R1, tau), SoC and
+# polarization voltage V1, all stored as (series x parallel) NumPy arrays, and every second:
+#
+#   cell j of parallel group k:  I_j = (E_j - V_k)/R0_j,      E_j = OCV_j - V1_j
+#   group k (cells in parallel): I = A_k - V_k*B_k,           A_k = sum_j E_j/R0_j,  B_k = sum_j 1/R0_j
+#                                i.e. a source A_k/B_k with a resistance 1/B_k, carrying the pack current I
+#   pack (groups in series):     P = I*sum_k V_k = I*(E_pack - I*R_pack),  E_pack = sum_k A_k/B_k,  R_pack = sum_k 1/B_k
+#
+# The pack current is the root of the same quadratic as in the lumped models; it then gives the voltage of each
+# group and the current of each cell, which lowers its own SoC and drives its own RC branch. A pack of identical
+# cells gives back the lumped run. The run stops when the first cell reaches the SoC floor.
+#
+# The curves of all the cells are tabulated on the same SoC grid (as in fleet_ekf.py) and stored end to end, so
+# evaluating them for every cell is one index computation and one gather for all the curves. A second costs a few
+# dozen array operations on the cells, whatever their number, so a pack of a few hundred cells runs an order of
+# magnitude slower than the lumped loop; by default whole cycles are skipped (max_soc_jump) as in the lumped models.
+
+PARAMETERS = ["ocv", "r0", "r0_charge", "r1", "tau"]
+MAX_DEVIATION = 3.0  # drawn cells stay within this many standard deviations of the mean cell
+DEFAULT_MAX_SOC_JUMP = 10.0  # % of SoC skipped at most at once, as in energy_consumption_cell_accelerated
+
+
+class CellPack:
+    """
+    The cells of a pack: capacity (Ah) and the tabulated curves of each cell, cell (k, j) being the j-th cell of
+    the k-th parallel group. values[name] has shape (series, parallel, grid points), on a grid of `resolution` (%).
+    """
+
+    def __init__(self, capacity, values, resolution, has_polarization=True):
+        self.capacity = np.asarray(capacity, dtype=float)
+        if self.capacity.ndim != 2:
+            raise ValueError("capacity must be a (series x parallel) array")
+        self.number_series_cells, self.number_parallel_cells = self.capacity.shape
+        self.values = {name: np.asarray(values[name], dtype=float) for name in PARAMETERS}
+        self.resolution = float(resolution)
+        self.has_polarization = has_polarization
+        self.n_grid = self.values["ocv"].shape[-1]
+
+    @property
+    def n_cells(self):
+        return self.capacity.size
+
+    def _flat_table(self, scales):
+        """
+        Values of the curves {name: scale} of every cell on the grid, then their slopes, end to end in one flat
+        array (curve, cell in (parallel, series) order, grid point): one gather reads all the curves of every cell.
+        """
+        values = np.stack([self.values[name].transpose(1, 0, 2)*scale for name, scale in scales.items()])
+        slopes = np.concatenate([np.diff(values, axis=3), np.zeros(values.shape[:3] + (1,))], axis=3)
+        return np.concatenate([values, slopes]).ravel()
+
+    def __repr__(self):
+        return (f"CellPack({self.number_series_cells}S {self.number_parallel_cells}P, capacity "
+                f"{self.capacity.min():.2f}-{self.capacity.max():.2f} Ah)")
+
+
+def _model_tables(model, resolution):
+    tables = model.lookup_tables(resolution)
+    reference = tables["ocv"]
+    return reference.resolution, {name: tables[name].values if name in tables else np.zeros(len(reference.grid))
+                                  for name in PARAMETERS}
+
+
+def _measured(model, name, grid):
+    """True at the grid points inside the SoC range measured for this curve of the model (not extrapolated)."""
+    points = {"ocv": model.soc, "r0": model.soc, "r0_charge": model.soc_charge, "r1": model.soc_pol,
+              "tau": model.soc_pol}[name]
+    return (grid >= points.min()) & (grid <= points.max())
+
+
+def _fill(values, valid):
+    # values at the invalid grid points, interpolated between the valid ones and held beyond them
+    index = np.arange(len(values))
+    return np.interp(index, index[valid], values[valid])
+
+
+def _spread(curves, measured, log):
+    """Standard deviation over the models at every grid point, only from the measured (not extrapolated) values."""
+    if log:
+        measured = measured & (curves > 0)
+        curves = np.log(np.where(measured, curves, 1.0))
+    valid = measured.sum(axis=0) >= 2
+    std = np.zeros(curves.shape[1])
+    if not valid.any():
+        return std
+    std[valid] = np.nanstd(np.where(measured, curves, np.nan)[:, valid], axis=0)
+    return _fill(std, valid)
+
+
+"""
+Draws the cells of a number_series_cells x number_parallel_cells pack from the spread of the given cell models
+(by default every file of Cell_data). Each curve of a cell is the mean curve of the models moved by z standard
+deviations of the models, z being a standard normal number drawn per cell (clipped to MAX_DEVIATION) and scaled by
+`spread`: spread=0, or a single model, gives identical cells. The capacity, the OCV, the resistance (R0 for discharge
+and charge together) and the RC branch (R1, tau) are drawn independently.
+The capacity, R0, R1 and tau are drawn in log space (mean * exp(z * std of the logarithm)), so they stay positive;
+the OCV is the mean plus z standard deviations. The standard deviations only use the SoC range measured for each
+model, not its extrapolation, and are held beyond it. Where the mean of a positive quantity is extrapolated to zero
+or below (R1 and tau below about 3 % SoC), the last positive value is held instead.
+R1 and tau are drawn from the models with polarization data only (none: no RC branch, order 0 only).
+"""
+def draw_cell_pack(models=None, number_series_cells=110, number_parallel_cells=2, spread=1.0, seed=None,
+                   lut_resolution=DEFAULT_RESOLUTION):
+    if models is None:
+        models = sorted(Path("Cell_data").glob("*.csv"))
+    if not isinstance(models, (list, tuple)):
+        models = [models]
+    models = [as_cell_model(m) for m in models]
+    shape = (int(number_series_cells), int(number_parallel_cells))
+    rng = np.random.default_rng(seed)
+    tables = []
+    for model in models:
+        resolution, table = _model_tables(model, lut_resolution)
+        tables.append(table)
+    grid = np.arange(len(tables[0]["ocv"]))*resolution
+
+    def deviation():
+        return np.clip(rng.standard_normal(shape), -MAX_DEVIATION, MAX_DEVIATION)*spread
+
+    def draw(name, members, z):
+        curves = np.array([tables[k][name] for k in members])  # (models, grid points)
+        measured = np.array([_measured(models[k], name, grid) for k in members])
+        mean = np.mean(curves, axis=0)
+        if name == "ocv":
+            return mean + z[..., None]*_spread(curves, measured, log=False)
+        positive = mean > 0
+        mean = mean if positive.all() else _fill(mean, positive)
+        return mean*np.exp(z[..., None]*_spread(curves, measured, log=True))
+
+    everyone = range(len(models))
+    log_capacities = np.log([m.capacity for m in models])
+    capacity = np.mean([m.capacity for m in models])*np.exp(deviation()*np.std(log_capacities))
+    values = {"ocv": draw("ocv", everyone, deviation())}
+    z = deviation()
+    values["r0"] = draw("r0", everyone, z)
+    values["r0_charge"] = draw("r0_charge", everyone, z)
+    with_polarization = [k for k, m in enumerate(models) if m.has_polarization]
+    z = deviation()
+    for name in ["r1", "tau"]:
+        values[name] = draw(name, with_polarization, z) if with_polarization else np.zeros(shape + (len(grid),))
+    return CellPack(capacity, values, resolution, has_polarization=bool(with_polarization))
+
+
+"""
+Runs the pack until its first cell reaches the SoC floor and returns the energy consumed (kWh), distance (m) and
+end time (s), the SoC and V1 of every cell at the end, the cell that reached the floor and whether the run stopped
+because the power could not be delivered. The R0 / OCV / R1 multipliers apply to every cell; order=0 and order=1
+are the models of energy_consumption_batch (R0 charge on regeneration / RC branch with the discharge R0).
+max_soc_jump (%) skips whole cycles as energy_consumption_cell_accelerated does, each cell being moved down by its
+own SoC drop over the last exact cycle; the error bounds on the SoC of the cells and on the range are returned.
+Skipping is on by default; max_soc_jump=None simulates every second.
+"""
+def energy_consumption_pack(pack, SoC, mass, wind, angle, R0_coefficient=1.0, OCV_coefficient=1.0, R1_coefficient=1.0,
+                            order=0, power_profile=None, cycle=None, max_steps=None,
+                            max_soc_jump=DEFAULT_MAX_SOC_JUMP, floor_margin=2.0):
+    if order not in SOC_FLOOR:
+        raise ValueError("order must be 0 or 1")
+    if order == 1 and not pack.has_polarization:
+        raise ValueError("the cells have no polarization (R1, tau) data, the 1st order model is unavailable")
+    power_demand_dictionary = run_simulation(mass, angle, wind, cycle) if power_profile is None else power_profile
+    p_batt = np.asarray(power_demand_dictionary["p_batt"], dtype=float)
+    period = len(p_batt)
+    power_list = p_batt.tolist()
+    cumulative_energy = np.concatenate([[0.0], np.cumsum(p_batt)])/3600000
+    cumulative_distance = np.concatenate([[0.0], np.cumsum(power_demand_dictionary["speed_ms"])])
+    soc_floor = SOC_FLOOR[order]
+
+    # inside the loop the cells are in (parallel, series) order: the cells of group k are column k
+    cells = (pack.number_parallel_cells, pack.number_series_cells)
+    soc_per_ah = 100/3600/np.ascontiguousarray(pack.capacity.T)  # SoC (%) drawn by 1 A over one second
+    soc = np.broadcast_to(np.asarray(SoC, dtype=float), pack.capacity.shape).T.copy()
+    V1 = np.zeros(cells)
+    last_point = float(pack.n_grid - 1)
+    in_group = np.ones(pack.number_parallel_cells)  # sums over the cells of each group and over the groups,
+    in_pack = np.ones(pack.number_series_cells)     # as products with vectors of ones (cheaper than sum() on small arrays)
+    if order == 0:
+        scales = {"ocv": OCV_coefficient, "r0": R0_coefficient, "r0_charge": R0_coefficient}
+    else:
+        scales = {"ocv": OCV_coefficient, "r0": R0_coefficient, "r1": R1_coefficient, "tau": 1.0}
+    table = pack._flat_table(scales)
+    n_curves = len(scales)
+    # position in the table of grid point 0 of each curve (values, then slopes) of each cell
+    row_start = (np.arange(2*n_curves)*pack.n_cells*pack.n_grid)[:, None, None] + \
+        (np.arange(pack.n_cells)*pack.n_grid).reshape(cells)
+
+    t_now = 0
+    infeasible = False
+    cycles_skipped = 0
+    soc_error_bound = np.zeros(cells)
+    last_drop = np.zeros(cells)
+    cycle_start = soc.copy()
+    jump, jump_drop = 0, np.zeros(cells)
+    while soc.min() > soc_floor and (max_steps is None or t_now < max_steps):
+        power_demand = power_list[t_now % period]
+        position = np.minimum(soc/pack.resolution, last_point)  # the SoC is above the floor, so above the grid start
+        index = position.astype(np.intp)
+        fraction = position - index
+        rows = table.take(row_start + index)
+        values = rows[:n_curves] + rows[n_curves:]*fraction  # every curve of every cell
+        E = values[0]
+        if order == 1:
+            E = E - V1
+        G = 1/values[2 if order == 0 and power_demand < 0 else 1]
+        B = in_group.dot(G)
+        A = in_group.dot(E*G)
+        R_group = 1/B
+        E_pack = float(A.dot(R_group))
+        R_pack = float(R_group.dot(in_pack))
+        discriminant = E_pack*E_pack - 4*power_demand*R_pack
+        if discriminant < 0:  # the demanded power cannot be delivered at these SoC
+            infeasible = True
+            break
+        I_pack = (E_pack - discriminant**0.5)/(2*R_pack)
+        V_group = (A - I_pack)*R_group
+        I_cell = (E - V_group)*G
+        soc = soc - I_cell*soc_per_ah
+        if order == 1:
+            alpha = np.exp(-1/np.maximum(values[3], 1e-300))  # 0 when tau <= 0, as in the lumped model
+            IR1 = I_cell*values[2]
+            V1 = IR1 + alpha*(V1 - IR1)
+        t_now += 1
+
+        if max_soc_jump is not None and t_now % period == 0:
+            # end of an exact cycle: correct the last jump with the mean of the drops before and after it
+            drop = cycle_start - soc
+            soc = soc - jump*(drop - jump_drop)/2
+            soc_error_bound += jump*np.abs(drop - jump_drop)/2
+            last_drop = drop
+            # then skip the whole cycles that keep every cell clear of the floor
+            jump = 0
+            if drop.min() > 0:
+                stop_jumping_at = soc_floor + np.maximum(floor_margin, 2*drop)
+                jump = max(int(np.floor(np.min(np.minimum(max_soc_jump, soc - stop_jumping_at)/drop))), 0)
+            jump_drop = drop
+            soc = soc - jump*drop
+            cycles_skipped += jump
+            cycle_start = soc
+
+    soc, V1, soc_error_bound, last_drop = soc.T, V1.T, soc_error_bound.T, last_drop.T  # back to (series, parallel)
+    steps = t_now + cycles_skipped*period
+    full_cycles, remainder = divmod(steps, period)
+    weakest = np.unravel_index(np.argmin(soc), soc.shape)
+    # a SoC error of one cycle's drop is one cycle of distance, for the cell that ends the run
+    range_error_bound = soc_error_bound[weakest]/last_drop[weakest]*cumulative_distance[-1] if last_drop[weakest] > 0 else 0.0
+    return {
+        "energyconsumed": float(full_cycles*cumulative_energy[-1] + cumulative_energy[remainder]),
+        "distance": float(full_cycles*cumulative_distance[-1] + cumulative_distance[remainder]),
+        "end_time": steps,
+        "SOC_end": soc,
+        "V1_end": V1,
+        "weakest_cell": tuple(int(i) for i in weakest),
+        "infeasible": infeasible,
+        "cycles_skipped": cycles_skipped,
+        "soc_error_bound": soc_error_bound,
+        "range_error_bound": float(range_error_bound),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-cell pack simulation, with cells drawn from the spread of Cell_data")
+    parser.add_argument("--series", type=int, default=110, help="Number of cells in series")
+    parser.add_argument("--parallel", type=int, default=2, help="Number of cells in parallel")
+    parser.add_argument("--order", type=int, choices=[0, 1], default=0, help="Equivalent circuit model order")
+    parser.add_argument("--spread", type=float, default=1.0, help="Cell-to-cell spread, in standard deviations of Cell_data")
+    parser.add_argument("--max-soc-jump", type=float, default=DEFAULT_MAX_SOC_JUMP,
+                        help="SoC (%%) skipped at most at once between exact cycles, 0 to simulate every second")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    models = [as_cell_model(f) for f in sorted(Path("Cell_data").glob("*.csv"))]
+    power_profile = run_simulation(1502, 0, 0)
+    packs = {"drawn cells": draw_cell_pack(models, args.series, args.parallel, args.spread, args.seed),
+             "mean cell (lumped)": draw_cell_pack(models, args.series, args.parallel, spread=0.0)}
+    for name, pack in packs.items():
+        start = time.perf_counter()
+        results = energy_consumption_pack(pack, 100, 1502, 0, 0, order=args.order, power_profile=power_profile,
+                                          max_soc_jump=args.max_soc_jump or None)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<19} {pack}: {results['distance']/1000:6.1f} km, {results['energyconsumed']:5.2f} kWh in "
+              f"{elapsed:.2f} s, first empty cell {results['weakest_cell']}, SoC of the cells at the end "
+              f"{results['SOC_end'].min():.2f}-{results['SOC_end'].max():.2f} %")
@@ -0,0 +1,44 @@
+import os
+import pickle
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Runs a per-file function over many cell data files, either serially or on a pool of worker processes.
+# Results always come back in the order of the files, so the merged output does not depend on which worker
+# finished first. If the pool cannot be used (no process support, a worker crashed, a function or file that
+# cannot be sent to a worker...) the files are processed serially instead, with a warning. Errors raised by the
+# function itself in a worker are raised as they are, without a serial rerun.
+# workers: None or 1 runs serially, 0 uses one worker per CPU, n > 1 uses n workers.
+
+
+def resolve_workers(workers, n_tasks):
+    if workers is None:
+        return 1
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    return max(1, min(int(workers), n_tasks))
+
+
+def map_files(function, files, workers=None):
+    files = list(files)
+    workers = resolve_workers(workers, len(files))
+    if workers <= 1:
+        return [function(file) for file in files]
+    try:
+        # checked here, as pickle raises AttributeError/TypeError for local functions and unpicklable objects,
+        # which could not be told apart from errors of the function once inside the pool
+        pickle.dumps(function)
+        pickle.dumps(files[0])
+    except (pickle.PicklingError, AttributeError, TypeError) as e:
+        return _serial_fallback(function, files, e)
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(function, files))
+    except (BrokenProcessPool, pickle.PicklingError, NotImplementedError, PermissionError) as e:
+        return _serial_fallback(function, files, e)
+
+
+def _serial_fallback(function, files, error):
+    warnings.warn(f"Parallel extraction unavailable ({error!r}), processing {len(files)} files serially")
+    return [function(file) for file in files]
@@ -0,0 +1,102 @@
+import numpy as np
+from instrumentation import span
+
+# Small dependency graph for incremental recomputation (used by GUI.py).
+# A pipeline has parameters (plain values set from outside) and nodes (functions of parameters and of other
+# nodes). Each node declares its inputs by name; its value is kept until one of its inputs changes. When a
+# parameter is set to a new value, only the nodes downstream of it are recomputed, and only when asked for.
+#
+#   pipeline = Pipeline()
+#   pipeline.add_node("power", run_simulation, ["mass", "theta", "wind"])
+#   pipeline.set_params(mass=1502, theta=0, wind=0)
+#   pipeline.get("power")
+
+
+def _same_value(a, b):
+    if a is b:
+        return True
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        return isinstance(a, np.ndarray) and isinstance(b, np.ndarray) and a.shape == b.shape and bool(np.all(a == b))
+    try:
+        return bool(a == b) and type(a) == type(b)
+    except (TypeError, ValueError):
+        return False
+
+
+class Pipeline:
+
+    def __init__(self):
+        self._functions = {}
+        self._inputs = {}
+        self._params = {}
+        self._versions = {}     # name -> number of times the parameter or node value changed
+        self._values = {}       # node -> last computed value
+        self._computed_with = {}  # node -> versions of its inputs when it was computed
+        self.recomputed = []    # nodes computed since the last clear_log(), in order
+
+    def add_node(self, name, function, inputs=()):
+        if name in self._functions or name in self._params:
+            raise ValueError(f"'{name}' is already defined in the pipeline")
+        missing = [i for i in inputs if i not in self._functions and i not in self._params]
+        if missing:
+            raise ValueError(f"Node '{name}': unknown inputs {missing} (parameters and nodes must be defined first)")
+        self._functions[name] = function
+        self._inputs[name] = list(inputs)
+        return self
+
+    def add_params(self, **defaults):
+        for name, value in defaults.items():
+            if name in self._functions:
+                raise ValueError(f"'{name}' is already a node of the pipeline")
+            self._params[name] = value
+            self._versions.setdefault(name, 0)
+        return self
+
+    def set_params(self, **params):
+        for name, value in params.items():
+            if name not in self._params:
+                if name in self._functions:
+                    raise ValueError(f"'{name}' is a node, not a parameter")
+                self.add_params(**{name: value})
+            elif not _same_value(self._params[name], value):
+                self._params[name] = value
+                self._versions[name] += 1
+        return self
+
+    def _input_versions(self, name):
+        versions = []
+        for input_name in self._inputs[name]:
+            if input_name in self._functions:
+                self._ensure(input_name)
+            versions.append(self._versions[input_name])
+        return tuple(versions)
+
+    def _ensure(self, name):
+        versions = self._input_versions(name)
+        if name in self._values and self._computed_with[name] == versions:
+            return
+        args = [self._params[i] if i in self._params else self._values[i] for i in self._inputs[name]]
+        with span(f"pipeline.{name}"):  # timed only when instrumentation is enabled
+            self._values[name] = self._functions[name](*args)
+        self._computed_with[name] = versions
+        self._versions[name] = self._versions.get(name, 0) + 1
+        self.recomputed.append(name)
+
+    def get(self, name):
+        if name in self._params:
+            return self._params[name]
+        if name not in self._functions:
+            raise KeyError(f"'{name}' is not a parameter or node of the pipeline")
+        self._ensure(name)
+        return self._values[name]
+
+    def downstream(self, name):
+        """Nodes that depend (directly or not) on the parameter or node `name`, in definition order."""
+        affected = {name}
+        for node in self._functions:  # nodes are defined after their inputs, so one pass in order is enough
+            if any(i in affected for i in self._inputs[node]):
+                affected.add(node)
+        return [node for node in self._functions if node in affected and node != name]
+
+    def clear_log(self):
+        self.recomputed = []
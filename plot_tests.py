@@ -1,7 +1,7 @@
 import pandas as pd
-import matplotlib.pyplot as plt
 from pathlib import Path
 import argparse
+from cell_data_cache import load_cell_data
 
 #the 5 csv_paths for the five test files are as follows: 
 # 'Cell_data/CELL_E_TEST_00.csv' 
@@ -13,8 +13,9 @@ import argparse
 def plot_file(csv_path):
     csv_path = Path(csv_path)
     #structures our csv file in memory with panda so it is easily accessible
-    df = pd.read_csv(csv_path)
+    df = load_cell_data(csv_path)
 
+    import matplotlib.pyplot as plt
     fig, axs = plt.subplots(3, 1, figsize=(9, 6))
 
     # Voltage vs Time
@@ -50,6 +51,7 @@ def get_cell_files():
 
 
 if __name__ == "__main__":
+    import matplotlib.pyplot as plt
 
     parser = argparse.ArgumentParser(description="Plot Cell Data Files")
     
@@ -1,98 +1,120 @@
-import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 import argparse
-
-def load_data():
-    data = pd.read_csv('WLTC_data.csv')
-    return data
+from collections import OrderedDict
+from drive_cycles import get_cycle
+
+# The drive cycles are loaded once (see drive_cycles.py) and the power profiles computed for a
+# (cycle, mass, theta, wind) are kept, so replaying a cycle does not rerun the power model.
+MAX_CACHED_PROFILES = 64
+_profile_cache = OrderedDict()
+
+# time (s) and speed (m/s) of a drive cycle, the WLTC class 3 cycle by default
+def load_profile(cycle=None):
+    cycle = get_cycle(cycle)
+    return cycle.time, cycle.speed_ms
+
+AIR_DENSITY = 1.225 #at sea level in 15°C 
+DRAG_COEF = 0.29 #specific to the car
+FRONT_AREA = 2.70726 #specific to the car 
+G = 9.81 #gravity
+C_RR = 0.01 #coeficient rolling resistance
+DRIVETRAIN_COEF = 0.95 #energy lost from the wheels to the road, friction, heat
+P_AUX = 1000 #screens, lights, AC
+REGEN_COEF = 0.6 #energy given back to the battery when the wheels spins by themselves
+ELEC_COEF = 0.89 #energy lost to make the wheels spin, from mechanical to electrical  
 
 """
-This function uses the WLTC data to be able to plot the Power at the wheels, then the mechanical power,
- then the electrical power at every second of the course of the whole 30min WLTP cycle.
+Computes every power of the model for the whole speed profile at once.
+mass, theta and wind_speed are column vectors of shape (n_scenarios, 1), so every output is a
+(n_scenarios x time) matrix. The first second of the cycle only draws the auxiliary power.
 """
-def run_simulation(mass, theta, wind_speed):
-    data = load_data()
-    time_values = data['Total elapsed time'].values
-    speed_values = data['WLTC class 3, version 5, vehicle speed'].values
-    speed_values_ms = speed_values / 3.6
-    
-    air_density = 1.225 #at sea level in 15°C 
-    drag_coef = 0.29 #specific to the car
-    front_area = 2.70726 #specific to the car 
-    g = 9.81 #gravity
-    C_rr = 0.01 #coeficient rolling resistance
-    drivetrain_coef = 0.95 #energy lost from the wheels to the road, friction, heat
-    p_aux = 1000 #screens, lights, AC
-    regen_coef = 0.6 #energy given back to the battery when the wheels spins by themselves
-    elec_coef = 0.89 #energy lost to make the wheels spin, from mechanical to electrical  
-
-    #initialising the lists and variables
-    power_acc_only = []
-    power_acc_roll = []
-    power_acc_aero_roll = []
-    power_total = []
-    p_mech = []
-    p_batt = []
-    energy = 0
-
-    for time in range(len(time_values)):
-        if time == 0:
-            power_acc_only.append(0)
-            power_acc_roll.append(0)
-            power_acc_aero_roll.append(0)
-            power_total.append(0)
-            p_mech.append(0)
-            p_batt.append(p_aux)
-            energy = energy
-        else: #at every sencond add the value of the power considering the speed of the WLTP in their respective lists of powers
-            v = speed_values_ms[time]
-            acc = (speed_values_ms[time] - speed_values_ms[time - 1])
-            
-            # different forces that have an impact on the power needed
-            force_acc = mass * acc 
-            force_aero = 0.5 * air_density * drag_coef * front_area * (v - wind_speed/3.6)**2
-            force_roll = C_rr * mass * g
-            force_slope = mass * g * np.sin(theta)
-            
-            # Cumulative Power
-            #p1 = force_acc * v
-            p2 = (force_acc + force_roll) * v # additional forces that affect the Energy 
-            p3 = (force_acc + force_aero + force_roll) * v #taken into account in the WLTP 
-            p4 = (force_acc + force_aero + force_roll + force_slope) * v # additional forces that affect the Energy 
-            
-           # power_acc_only.append(p1)
-            power_acc_roll.append(p2)
-            power_acc_aero_roll.append(p3)
-            power_total.append(p4)
-            #convert power at the wheels to mechanical power
-            p5 = p4 / drivetrain_coef
-            p_mech.append(p5)
-            #convert mechanical power to electrical power
-            if p4 >= 0: #here it is the power taking into account the regenerative braking
-                p6 = p4 / (drivetrain_coef * elec_coef) + p_aux
-            else:
-                p6 = p4 * regen_coef + p_aux
-            p_batt.append(p6)
-            energy = energy + p_batt[time]*(1/3600) #energy considering there is regenerative braking
+def _power_matrices(speed_values_ms, mass, theta, wind_speed):
+    v = speed_values_ms[1:]
+    acc = np.diff(speed_values_ms)
+
+    # different forces that have an impact on the power needed
+    force_acc = mass * acc
+    force_aero = 0.5 * AIR_DENSITY * DRAG_COEF * FRONT_AREA * (v - wind_speed/3.6)**2
+    force_roll = C_RR * mass * G
+    force_slope = mass * G * np.sin(theta)
+
+    # Cumulative Power
+    p1 = force_acc * v
+    p2 = (force_acc + force_roll) * v # additional forces that affect the Energy 
+    p3 = (force_acc + force_aero + force_roll) * v #taken into account in the WLTP 
+    p4 = (force_acc + force_aero + force_roll + force_slope) * v # additional forces that affect the Energy 
+    #convert power at the wheels to mechanical power
+    p5 = p4 / DRIVETRAIN_COEF
+    #convert mechanical power to electrical power, taking into account the regenerative braking
+    p6 = np.where(p4 >= 0, p4 / (DRIVETRAIN_COEF * ELEC_COEF), p4 * REGEN_COEF) + P_AUX
+
+    n_scenarios = p4.shape[0]
+    def with_first_second(values, first_value):
+        return np.hstack([np.full((n_scenarios, 1), float(first_value)), values])
+
     return {
-        "time": time_values,
-        "speed_ms": speed_values_ms,
-        "power_total": power_total,
-        "p_mech": p_mech,
-        "p_batt": p_batt,
-        "power_acc_only": power_acc_only,
-        "power_acc_roll": power_acc_roll,
-        "power_acc_aero_roll": power_acc_aero_roll,
-        "energy": energy #in Wh
+        "power_acc_only": with_first_second(p1, 0),
+        "power_acc_roll": with_first_second(p2, 0),
+        "power_acc_aero_roll": with_first_second(p3, 0),
+        "power_total": with_first_second(p4, 0),
+        "p_mech": with_first_second(p5, 0),
+        "p_batt": with_first_second(p6, P_AUX),
+        "energy": p6.sum(axis=1) / 3600 #energy considering there is regenerative braking, in Wh
     }
 
+"""
+This function uses the WLTC data (or the drive cycle given, see drive_cycles.py) to be able to plot the Power at the wheels,
+then the mechanical power, then the electrical power at every second of the course of the whole 30min WLTP cycle.
+The results are cached on (cycle, mass, theta, wind_speed) and shared by every caller: their arrays are read-only
+(a caller that needs to modify one takes a .copy()).
+"""
+def run_simulation(mass, theta, wind_speed, cycle=None):
+    cycle = get_cycle(cycle)
+    key = (cycle.key, float(mass), float(theta), float(wind_speed))
+    if key in _profile_cache:
+        _profile_cache.move_to_end(key)
+        return _profile_cache[key]
+
+    time_values, speed_values_ms = cycle.time, cycle.speed_ms
+    powers = _power_matrices(speed_values_ms, np.array([[mass]], dtype=float), np.array([[theta]], dtype=float), np.array([[wind_speed]], dtype=float))
+    results = {"time": time_values, "speed_ms": speed_values_ms}
+    for name, values in powers.items():
+        results[name] = values[0]
+    results["energy"] = float(powers["energy"][0])
+    for name, values in results.items():
+        if isinstance(values, np.ndarray):
+            results[name] = values = values.view()  # the cycle's own arrays stay writable
+            values.flags.writeable = False
+
+    _profile_cache[key] = results
+    while len(_profile_cache) > MAX_CACHED_PROFILES:
+        _profile_cache.popitem(last=False)
+    return results
+
+"""
+Same model as run_simulation, but for many vehicle loadings at once.
+mass, theta and wind_speed can be scalars or arrays (they are broadcast together), and every power
+is returned as a (scenario x time) matrix, "energy" being one value per scenario.
+"""
+def run_simulation_batch(mass, theta, wind_speed, cycle=None):
+    time_values, speed_values_ms = load_profile(cycle)
+    mass, theta, wind_speed = np.broadcast_arrays(
+        np.atleast_1d(np.asarray(mass, dtype=float)),
+        np.atleast_1d(np.asarray(theta, dtype=float)),
+        np.atleast_1d(np.asarray(wind_speed, dtype=float)))
+    if mass.ndim != 1:
+        raise ValueError("mass, theta and wind_speed must be scalars or 1D arrays")
+    results = {"time": time_values, "speed_ms": speed_values_ms, "mass": mass, "theta": theta, "wind_speed": wind_speed}
+    results.update(_power_matrices(speed_values_ms, mass[:, None], theta[:, None], wind_speed[:, None]))
+    return results
+
 """
 These are the plots callable from the GUI.py
 Each plot of the powers represent a different step of the power gotten for the WLTP
 
 """
 def plot_speed(results):
+    import matplotlib.pyplot as plt
     fig, ax = plt.subplots(figsize=(10, 4))
     ax.plot(results["time"], results["speed_ms"], color='black', linestyle = 'None', marker = '.')
     ax.set_title("WLTP Speed Profile")
@@ -102,6 +124,7 @@ def plot_speed(results):
     return fig
 
 def plot_total_power(results):
+    import matplotlib.pyplot as plt
     fig, ax = plt.subplots(figsize=(10, 4))
     ax.plot(results["time"], results["power_total"], color='blue', linestyle = 'None', marker = '.')
     ax.set_title("Total Power vs Time")
@@ -111,6 +134,7 @@ def plot_total_power(results):
     return fig
 
 def plot_mechanical_power(results):
+    import matplotlib.pyplot as plt
     fig, ax = plt.subplots(figsize=(10, 4))
     ax.plot(results["time"], results["p_mech"], color='blue', linestyle = 'None', marker = '.')
     ax.set_title("Mechanical Power vs Time")
@@ -120,6 +144,7 @@ def plot_mechanical_power(results):
     return fig
 
 def plot_battery_power(results):
+    import matplotlib.pyplot as plt
     fig, ax = plt.subplots(figsize=(10, 4))
     ax.plot(results["time"], results["p_batt"], color='blue', linestyle = 'None', marker = '.')
     ax.set_title("Battery Power vs Time")
@@ -129,6 +154,7 @@ def plot_battery_power(results):
     return fig
 
 def plot_power_components(results):
+    import matplotlib.pyplot as plt
     fig, ax = plt.subplots(figsize=(10, 4))
     t = results["time"]
     ax.plot(t, results["power_acc_roll"], label='WLTP forces', color='magenta', alpha=0.7, linestyle = 'None', marker = '.')
@@ -142,6 +168,7 @@ def plot_power_components(results):
 
 
 if __name__ == "__main__":
+    import matplotlib.pyplot as plt
 
     parser = argparse.ArgumentParser(description="Run WLTP Simulation")
 
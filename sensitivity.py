@@ -0,0 +1,225 @@
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+
+from batch_simulation import energy_consumption_batch
+from cell_model import as_cell_model
+from soc_lut import DEFAULT_RESOLUTION
+
+# Monte Carlo sensitivity of the range and energy to the cell parameter multipliers and the vehicle loading.
+# The R0, OCV and R1 multipliers, the mass, the wind (km/h) and the road angle (rad) are drawn from distributions,
+# and every sample is simulated in the batched engine of batch_simulation.py (all samples advanced together,
+# with whole cycles skipped, see max_soc_jump). The result holds the quantiles of the range and the energy and
+# their Sobol indices: the share of the output variance explained by each parameter alone (first order) and
+# with its interactions (total order).
+#
+# method="saltelli" estimates both indices from N*(d + 2) runs for d sampled parameters (two sample matrices
+# A and B, and A with column i taken from B for each parameter i; Saltelli 2010 for the first order, Jansen for
+# the total order). method="given_data" only runs N samples and estimates the first order indices from them,
+# as the variance of the output means over bins of each parameter. The bin means are noisy, which alone would give
+# every parameter an index of about bins/N (0.03 for N = 1000); that part is estimated from the spread within
+# the bins and removed, so a parameter without effect gets an index close to 0 (like the Saltelli estimates, it
+# can then come out slightly negative).
+#
+# The 0th order model has no RC branch: with order=0, the R1 multiplier is never sampled (it would only cost runs).
+#
+# A distribution is ("normal", mean, std), ("uniform", low, high) or ("triangular", low, mode, high);
+# a plain number keeps the parameter fixed.
+
+PARAMETERS = ["R0_coefficient", "OCV_coefficient", "R1_coefficient", "mass", "wind", "angle"]
+FIXED_VALUES = {"R0_coefficient": 1.0, "OCV_coefficient": 1.0, "R1_coefficient": 1.0, "mass": 1502.0,
+                "wind": 0.0, "angle": 0.0}
+DEFAULT_DISTRIBUTIONS = {
+    "R0_coefficient": ("normal", 1.0, 0.1),
+    "OCV_coefficient": ("normal", 1.0, 0.01),
+    "R1_coefficient": ("normal", 1.0, 0.1),
+    "mass": ("uniform", 1502.0, 1802.0),  # empty car to 300 kg of load
+    "wind": ("normal", 0.0, 10.0),        # km/h
+    "angle": ("normal", 0.0, 0.005),      # rad
+}
+OUTPUTS = {"range": "distance", "energy": "energyconsumed"}  # output name -> result of energy_consumption_batch
+DEFAULT_QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+DEFAULT_MAX_SOC_JUMP = 10.0
+DEFAULT_BATCH_SIZE = 4000  # samples simulated together (one power profile each, about 180 MB at most)
+
+
+def from_unit(distribution, u):
+    """Maps uniform numbers u in (0, 1) to the distribution (inverse of its cumulative distribution)."""
+    kind, *arguments = distribution
+    if kind == "uniform":
+        low, high = arguments
+        return low + u*(high - low)
+    if kind == "normal":
+        from scipy.special import ndtri
+        mean, std = arguments
+        return mean + std*ndtri(u)
+    if kind == "triangular":
+        low, mode, high = arguments
+        split = (mode - low)/(high - low)
+        return np.where(u < split, low + np.sqrt(u*(high - low)*(mode - low)),
+                        high - np.sqrt((1 - u)*(high - low)*(high - mode)))
+    raise ValueError(f"Unknown distribution {kind!r}: use 'normal', 'uniform' or 'triangular'")
+
+
+def _sampled(distributions, order):
+    # parameters given as a distribution, in the order of PARAMETERS, without those the model does not use
+    unknown = [name for name in distributions if name not in PARAMETERS]
+    if unknown:
+        raise ValueError(f"Unknown parameters {unknown}. Available: {PARAMETERS}")
+    unused = ["R1_coefficient"] if order == 0 else []
+    return [name for name in PARAMETERS if isinstance(distributions.get(name), (tuple, list)) and name not in unused]
+
+
+def _run_samples(model, values, number_series_cells, number_parallel_cells, SoC, order, lut_resolution,
+                 max_soc_jump, cycle, batch_size):
+    n_runs = len(values["mass"])
+    outputs = {name: np.empty(n_runs) for name in OUTPUTS}
+    infeasible = 0
+    range_error = 0.0
+    for start in range(0, n_runs, batch_size):
+        part = {name: v[start:start + batch_size] for name, v in values.items()}
+        results = energy_consumption_batch(model, number_series_cells, number_parallel_cells, part["R0_coefficient"],
+                                           part["OCV_coefficient"], SoC, part["mass"], part["wind"], part["angle"],
+                                           R1_coefficient=part["R1_coefficient"], order=order,
+                                           lut_resolution=lut_resolution, cycle=cycle, max_soc_jump=max_soc_jump)
+        for name, key in OUTPUTS.items():
+            outputs[name][start:start + batch_size] = results[key]
+        infeasible += int(np.sum(results["infeasible"]))
+        range_error = max(range_error, float(np.max(results["range_error_bound"]/np.maximum(results["distance"], 1.0))))
+    return outputs, infeasible, range_error
+
+
+def saltelli_indices(f_A, f_B, f_AB):
+    """First and total order Sobol indices from the outputs of A, B and the d matrices AB_i (shape d x N)."""
+    mean = np.mean(np.concatenate([f_A, f_B]))
+    f_A, f_B, f_AB = f_A - mean, f_B - mean, f_AB - mean  # same expectations, much less noise when mean >> std
+    variance = np.var(np.concatenate([f_A, f_B]))
+    if variance == 0:
+        return np.zeros(len(f_AB)), np.zeros(len(f_AB))
+    first = np.mean(f_B*(f_AB - f_A), axis=1)/variance
+    total = 0.5*np.mean((f_A - f_AB)**2, axis=1)/variance
+    return first, total
+
+
+def given_data_first_order(x, y, bins=None):
+    """
+    First order Sobol index of y to x, from the variance of the means of y over equal-count bins of x, less the
+    part of it due to the noise of the bin means (estimated from the variance within the bins, as in an ANOVA).
+    """
+    variance = np.var(y)
+    if variance == 0:
+        return 0.0
+    n = len(y)
+    bins = min(bins or max(2, int(np.sqrt(n))), n - 1)
+    groups = np.array_split(y[np.argsort(x, kind="stable")], bins)
+    between = sum(len(g)*(np.mean(g) - np.mean(y))**2 for g in groups)
+    within = sum(np.sum((g - np.mean(g))**2) for g in groups)
+    return float((between - (bins - 1)/(n - bins)*within)/n/variance)
+
+
+"""
+Samples the parameters, simulates every sample and returns {"samples": {parameter: values},
+"outputs": {"range": m, "energy": kWh}, "quantiles", "mean", "std", "sobol": {output: {"first", "total"}}, ...}.
+With order=0 the R1 multiplier is not sampled and has no Sobol index.
+The statistics are computed over the N (given_data) or 2N (saltelli, A and B) independent samples.
+lut_resolution: SoC resolution of the lookup tables (None runs the exact PCHIP curves), max_soc_jump: see
+batch_simulation.energy_consumption_batch (None simulates every second).
+"""
+def sensitivity_analysis(csv_path, n_samples=1000, distributions=DEFAULT_DISTRIBUTIONS, number_series_cells=110,
+                         number_parallel_cells=2, SoC=100, order=0, method="saltelli", quantiles=DEFAULT_QUANTILES,
+                         seed=None, lut_resolution=DEFAULT_RESOLUTION, max_soc_jump=DEFAULT_MAX_SOC_JUMP, cycle=None,
+                         batch_size=DEFAULT_BATCH_SIZE):
+    if method not in ("saltelli", "given_data"):
+        raise ValueError("method must be 'saltelli' or 'given_data'")
+    model = as_cell_model(csv_path)
+    sampled = _sampled(distributions, order)
+    d = len(sampled)
+    rng = np.random.default_rng(seed)
+
+    A = rng.random((n_samples, d))
+    if method == "saltelli":
+        B = rng.random((n_samples, d))
+        AB = [np.where(np.arange(d) == i, B, A) for i in range(d)]  # A with column i from B
+        unit = np.concatenate([A, B] + AB)
+    else:
+        unit = A
+
+    values = {}
+    for name in PARAMETERS:
+        if name in sampled:
+            values[name] = from_unit(distributions[name], unit[:, sampled.index(name)])
+        else:  # fixed, or a distribution the model does not use
+            value = distributions.get(name, FIXED_VALUES[name])
+            values[name] = np.full(len(unit), float(FIXED_VALUES[name] if isinstance(value, (tuple, list)) else value))
+
+    start = time.perf_counter()
+    outputs, infeasible, range_error = _run_samples(model, values, number_series_cells, number_parallel_cells, SoC,
+                                                    order, lut_resolution, max_soc_jump, cycle, batch_size)
+    elapsed = time.perf_counter() - start
+
+    n_independent = 2*n_samples if method == "saltelli" else n_samples
+    sobol = {}
+    for name, y in outputs.items():
+        if method == "saltelli":
+            f_A, f_B = y[:n_samples], y[n_samples:2*n_samples]
+            f_AB = y[2*n_samples:].reshape(d, n_samples)
+            first, total = saltelli_indices(f_A, f_B, f_AB)
+            sobol[name] = {"first": dict(zip(sampled, first.tolist())), "total": dict(zip(sampled, total.tolist()))}
+        else:
+            sobol[name] = {"first": {p: given_data_first_order(values[p], y) for p in sampled}, "total": None}
+
+    independent = {name: y[:n_independent] for name, y in outputs.items()}
+    return {
+        "samples": {name: v[:n_independent] for name, v in values.items()},
+        "outputs": independent,
+        "quantiles": {name: dict(zip(quantiles, np.quantile(y, quantiles).tolist())) for name, y in independent.items()},
+        "mean": {name: float(np.mean(y)) for name, y in independent.items()},
+        "std": {name: float(np.std(y)) for name, y in independent.items()},
+        "sobol": sobol,
+        "method": method,
+        "runs": len(unit),
+        "infeasible": infeasible,
+        "max_relative_range_error": range_error,  # bound from the skipped cycles
+        "elapsed_s": elapsed,
+    }
+
+
+def print_report(results):
+    units = {"range": ("km", 1/1000), "energy": ("kWh", 1.0)}
+    print(f"{results['runs']} runs ({results['method']}) in {results['elapsed_s']:.1f} s, "
+          f"{results['infeasible']} infeasible, range error bound {results['max_relative_range_error']:.2%}")
+    for name, quantiles in results["quantiles"].items():
+        unit, scale = units[name]
+        print(f"{name} ({unit}): mean {results['mean'][name]*scale:.2f}, std {results['std'][name]*scale:.2f}, "
+              + ", ".join(f"q{q*100:g} {v*scale:.2f}" for q, v in quantiles.items()))
+    for name, indices in results["sobol"].items():
+        print(f"Sobol indices of the {name}:")
+        for parameter, first in indices["first"].items():
+            total = "" if indices["total"] is None else f"   total {indices['total'][parameter]:6.3f}"
+            print(f"  {parameter:<16} first {first:6.3f}{total}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Monte Carlo sensitivity of the range and energy of a pack")
+    parser.add_argument("--file", default="CELL_E_TEST_00.csv", help="Cell file in Cell_data (e.g., CELL_E_TEST_00.csv)")
+    parser.add_argument("--samples", type=int, default=1000, help="Number of samples N")
+    parser.add_argument("--method", choices=["saltelli", "given_data"], default="saltelli",
+                        help="saltelli: first and total indices, N*(d + 2) runs; given_data: first order, N runs")
+    parser.add_argument("--order", type=int, choices=[0, 1], default=0, help="Equivalent circuit model order")
+    parser.add_argument("--series", type=float, default=110, help="Number of cells in series")
+    parser.add_argument("--parallel", type=float, default=2, help="Number of cells in parallel")
+    parser.add_argument("--soc", type=float, default=100, help="Initial SoC (%%)")
+    parser.add_argument("--lut", type=float, default=DEFAULT_RESOLUTION,
+                        help="SoC resolution (%%) of the lookup tables, 0 for the exact PCHIP curves")
+    parser.add_argument("--max-soc-jump", type=float, default=DEFAULT_MAX_SOC_JUMP,
+                        help="SoC (%%) skipped at most at once between exact cycles, 0 to simulate every second")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    results = sensitivity_analysis(Path("Cell_data") / args.file, args.samples, number_series_cells=args.series,
+                                   number_parallel_cells=args.parallel, SoC=args.soc, order=args.order,
+                                   method=args.method, seed=args.seed, lut_resolution=args.lut or None,
+                                   max_soc_jump=args.max_soc_jump or None)
+    print_report(results)
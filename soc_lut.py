@@ -0,0 +1,130 @@
+import math
+from bisect import bisect_right
+
+import numpy as np
+
+# Lookup tables of the cell parameters against the SoC, used as a fast path in the simulation loops.
+# A parameter curve (any callable of the SoC, typically a PCHIP interpolator) is tabulated once on a uniform
+# SoC grid; a lookup is then a couple of float operations (index arithmetic and linear interpolation between
+# the two nearest grid points) instead of a SciPy call. Queries outside the grid are clamped to its ends.
+# Every table measures its own maximum error against the curve it replaces, so the resolution
+# can be chosen knowing what accuracy is lost.
+
+DEFAULT_RESOLUTION = 0.1  # SoC (%) between two grid points
+ERROR_CHECK_POINTS = 10   # points checked against the exact curve between two grid points
+
+
+class SocLookupTable:
+
+    def __init__(self, curve, resolution=DEFAULT_RESOLUTION, soc_min=0.0, soc_max=100.0):
+        if resolution <= 0:
+            raise ValueError("resolution must be positive")
+        n_intervals = max(1, int(math.ceil((soc_max - soc_min) / resolution)))
+        self.soc_min = float(soc_min)
+        self.resolution = (soc_max - soc_min) / n_intervals
+        self.grid = np.linspace(soc_min, soc_max, n_intervals + 1)
+        self.values = np.asarray(curve(self.grid), dtype=float)
+        self._values = self.values.tolist()  # Python floats: the scalar path stays out of NumPy
+        self._last_index = n_intervals - 1
+        self._slopes = np.append(np.diff(self.values), 0.0)  # value change to the next grid point
+        self.max_error = self._measure_error(curve)
+
+    def _measure_error(self, curve):
+        check = np.linspace(self.grid[0], self.grid[-1], self._last_index * ERROR_CHECK_POINTS + 1)
+        return float(np.max(np.abs(self(check) - np.asarray(curve(check), dtype=float))))
+
+    def __call__(self, soc):
+        if isinstance(soc, (float, int)):
+            position = (soc - self.soc_min) / self.resolution
+            if position <= 0:
+                return self._values[0]
+            index = int(position)
+            if index > self._last_index:
+                return self._values[-1]
+            fraction = position - index
+            return self._values[index] + (self._values[index + 1] - self._values[index]) * fraction
+        position = np.clip((np.asarray(soc, dtype=float) - self.soc_min) / self.resolution, 0.0, self._last_index + 1)
+        index = position.astype(np.intp)
+        return self.values[index] + self._slopes[index] * (position - index)
+
+    def __repr__(self):
+        return f"SocLookupTable({len(self.grid)} points, resolution={self.resolution:g} %, max_error={self.max_error:.3g})"
+
+
+class ScalarCurve:
+    """
+    Exact scalar evaluation of a piecewise cubic interpolator (PCHIP) in plain Python floats.
+    Gives the same values as the interpolator itself (including its extrapolation beyond the data points)
+    without the overhead of a SciPy call for every single SoC.
+    """
+
+    def __init__(self, interpolator):
+        self._x = interpolator.x.tolist()
+        self._c = interpolator.c.T.tolist()  # one [c3, c2, c1, c0] row per interval
+        self._last_interval = len(self._x) - 2
+
+    def __call__(self, soc):
+        index = bisect_right(self._x, soc) - 1
+        if index < 0:
+            index = 0
+        elif index > self._last_interval:
+            index = self._last_interval
+        d = soc - self._x[index]
+        c3, c2, c1, c0 = self._c[index]
+        return ((c3 * d + c2) * d + c1) * d + c0
+
+
+class StackedCurves:
+    """
+    Evaluates several parameter curves (PCHIP interpolators or lookup tables) for an array of SoC values at
+    once and returns the list of their values. The interval search (or grid index) is done once for all the
+    curves sharing their breakpoints (or grid), and the pieces are evaluated as in ScalarCurve and
+    SocLookupTable, so every value is the one the scalar path gives.
+    """
+
+    def __init__(self, curves):
+        self.n_curves = len(curves)
+        groups = {}
+        for row, curve in enumerate(curves):
+            if isinstance(curve, SocLookupTable):
+                key = ("table", curve.soc_min, curve.resolution, len(curve.grid))
+            else:
+                key = ("pchip", curve.x.tobytes())
+            groups.setdefault(key, []).append((row, curve))
+
+        self._groups = []
+        for (kind, *_), members in groups.items():
+            first = members[0][1]
+            if kind == "table":
+                rows = [(row, c.values, c._slopes) for row, c in members]
+                self._groups.append((kind, (first.soc_min, first.resolution, first._last_index + 1), rows))
+            else:
+                # one contiguous array per polynomial coefficient: gathering from 1D arrays is the fast path
+                rows = [(row, [np.ascontiguousarray(k) for k in c.c]) for row, c in members]
+                self._groups.append((kind, (first.x, len(first.x) - 2), rows))
+
+    def __call__(self, soc):
+        soc = np.asarray(soc, dtype=float)
+        values = [None] * self.n_curves
+        for kind, grid, rows in self._groups:
+            if kind == "table":
+                soc_min, resolution, last = grid
+                position = np.minimum(np.maximum((soc - soc_min) / resolution, 0.0), last)
+                index = position.astype(np.intp)
+                fraction = position - index
+                for row, table_values, slopes in rows:
+                    values[row] = table_values.take(index) + slopes.take(index) * fraction
+            else:
+                x, last = grid
+                index = np.minimum(np.maximum(np.searchsorted(x, soc, side="right") - 1, 0), last)
+                d = soc - x.take(index)
+                for row, coefficients in rows:
+                    result = coefficients[0].take(index)
+                    for c in coefficients[1:]:
+                        result = result * d + c.take(index)
+                    values[row] = result
+        return values
+
+
+def lut_error_report(tables):
+    return {name: table.max_error for name, table in tables.items()}
@@ -1,9 +1,10 @@
 import numpy as np
 import pandas as pd
 from pathlib import Path
-from scipy.optimize import curve_fit
-import matplotlib.pyplot as plt
 import argparse
+from cell_data_cache import load_cell_columns
+from step_segments import segments_of_step
+from parallel_extraction import map_files
 
 # ---------------- Parameters ----------------
 DATA_FOLDER = "Cell_data"
@@ -15,31 +16,22 @@ T_MAX = 25000           # optional end of analysis
 
 # ---------------- Capacity & SoC functions ----------------
 def overall_capacity(csv_path):
-    df = pd.read_csv(csv_path)
-    df.columns = [c.strip() for c in df.columns]
-    step_data = df[df["Step"] == 27]
-    time_values = step_data["Total Time"].values
-    current_values = step_data["Current"].values
-    start_time = time_values[0]
-    end_time = time_values[-1]
-    current = current_values[0]
+    step_data = segments_of_step(csv_path, 27)
+    start_time = step_data["start_time"].iloc[0]
+    end_time = step_data["end_time"].iloc[-1]
+    current = step_data["start_current"].iloc[0]
     return abs(current * (end_time - start_time) / 3600)
 
 def soc_by_spike_single(csv_path):
-    df = pd.read_csv(csv_path)
-    df.columns = [c.strip() for c in df.columns]
-    is_step15 = df["Step"] == 15
-    block_id = (is_step15 != is_step15.shift()).cumsum()
-    step15_df = df[is_step15]
+    capacity = overall_capacity(csv_path)
+    step15_blocks = segments_of_step(csv_path, 15)
     soc_dict = {0: 100.0}  # start at 100%
     tot_SOC = 100
-    for i, (_, block) in enumerate(step15_df.groupby(block_id[is_step15]), 1):
-        t_start = block["Total Time"].iloc[0]
-        t_end = block["Total Time"].iloc[-1]
-        duration = t_end - t_start
-        current = block["Current"].iloc[0]
+    for i, block in enumerate(step15_blocks.itertuples(), 1):
+        duration = block.end_time - block.start_time
+        current = block.start_current
         current_capacity = abs(duration * current / 3600)
-        SOC_drop = current_capacity / overall_capacity(csv_path) * 100
+        SOC_drop = current_capacity / capacity * 100
         tot_SOC = tot_SOC - SOC_drop
         soc_dict[i] = tot_SOC
     return soc_dict
@@ -51,116 +43,171 @@ def soc_df_single(csv_path):
         "SoC": list(soc_dict.values())
     })
 
-def soc_df_all(folder_path):
+def _soc_df_with_file(csv_file):
+    df_soc = soc_df_single(csv_file)
+    df_soc["file"] = Path(csv_file).stem
+    return df_soc
+
+# workers: number of processes to spread the files over (see parallel_extraction.py), serial by default
+def soc_df_all(folder_path, workers=None):
     folder = Path(folder_path)
-    rows = []
-    for csv_file in sorted(folder.glob("*.csv")):
-        df_soc = soc_df_single(csv_file)
-        df_soc["file"] = csv_file.stem
-        rows.append(df_soc)
+    rows = map_files(_soc_df_with_file, sorted(folder.glob("*.csv")), workers)
     return pd.concat(rows, ignore_index=True)
 
 # ---------------- Extraction function ----------------
-def extract_step9_plateaus_fixed_tau(data_folder):
-    data_folder = Path(data_folder)
-    files = sorted(data_folder.glob("*.csv"))
+RESULT_COLUMNS = ["file", "step_start_time",  "R_pol", "tau", "C_pol", "fit_rmse"]
+
+# Plateau of one Step=9 pulse (the rows after its first row), with tau from the 63.2% method, ready to be fitted.
+# Returns None when the plateau is too short, its current too small or its voltage flat.
+def plateau_candidate(file_stem, step_start_time, t_plateau, v_plateau, I_step):
+    if abs(I_step) < MIN_CURRENT or len(v_plateau) < 3:
+        return None
+
+    if abs(v_plateau[-1] - v_plateau[0]) < 1e-3:  # 1 mV threshold
+        return None
+
+    # ---------------- Tau from 63.2% method ----------------
+    delta_V = v_plateau[-1] - v_plateau[0]
+    V_tau = v_plateau[0] + 0.632 * delta_V
+    V_tau = min(max(V_tau, min(v_plateau)), max(v_plateau))
+    tau = np.interp(V_tau, v_plateau, t_plateau) - t_plateau[0]
+
+    # ---------------- Store (fitted later, with every other plateau) ----------------
+    return {
+        "file": file_stem,
+        "step_start_time": step_start_time,
+        "tau": tau,
+        "I_step": I_step,
+        "t_fit": t_plateau - t_plateau[0],
+        "V_fit": v_plateau,
+    }
+
+def _step9_plateau_rows(file):
+    file = Path(file)
     results = []
 
-    for file in files: 
-        df = pd.read_csv(file)
-        df.columns = [c.strip() for c in df.columns]
-
-        # Convert to numeric
-        for col in ["Total Time", "Current", "Voltage", "Step"]:
-            df[col] = pd.to_numeric(df[col], errors="coerce")
-
-        # Restrict time window
-        df = df[(df["Total Time"] >= T_MIN) & (df["Total Time"] <= T_MAX)].reset_index(drop=True)
-
-        time = df["Total Time"].values
-        current = df["Current"].values
-        voltage = df["Voltage"].values
-        step = df["Step"].values
-
-        # Detect Step=9 starts
-        is_step = step == STEP_VALUE
-        starts = is_step & (~np.roll(is_step, 1))
-        starts[0] = False
-        start_indices = np.where(starts)[0]
-
-        # print(f"{file.name}: detected {len(start_indices)} Step={STEP_VALUE} events")
-
-        for idx in start_indices:
-
-            # ---------------- Plateau ----------------
-            end_idx = idx
-            while end_idx + 1 < len(step) and step[end_idx + 1] == STEP_VALUE:
-                end_idx += 1
-
-            if end_idx <= idx + 1:
-                continue  # skip too short
-
-            v_plateau = voltage[idx+1:end_idx+1]
-            t_plateau = time[idx+1:end_idx+1]
-            I_step = current[idx+1]
-
-            if abs(I_step) < MIN_CURRENT or len(v_plateau) < 3:
-                continue
+    columns = load_cell_columns(file) # already numeric, memory-mapped when a columnar copy exists
+
+    # Restrict time window (Total Time is increasing, so the window is one block of rows)
+    first_row = np.searchsorted(columns["Total Time"], T_MIN, side="left")
+    last_row = np.searchsorted(columns["Total Time"], T_MAX, side="right") - 1
+
+    time = columns["Total Time"][first_row:last_row+1]
+    current = columns["Current"][first_row:last_row+1]
+    voltage = columns["Voltage"][first_row:last_row+1]
+
+    # Step=9 plateaus starting inside the window (a plateau already running at the window start is ignored),
+    # cut at the end of the window. Rows are counted from the start of the window.
+    segments = segments_of_step(file, STEP_VALUE)
+    segments = segments[(segments["start_row"] > first_row) & (segments["start_row"] <= last_row)]
+    start_indices = segments["start_row"].values - first_row
+    end_indices = np.minimum(segments["end_row"].values, last_row) - first_row
+
+    # print(f"{file.name}: detected {len(start_indices)} Step={STEP_VALUE} events")
+
+    for idx, end_idx in zip(start_indices, end_indices):
+
+        # ---------------- Plateau ----------------
+
+        if end_idx <= idx + 1:
+            continue  # skip too short
+
+        plateau = plateau_candidate(file.stem, time[idx], time[idx+1:end_idx+1], voltage[idx+1:end_idx+1], current[idx+1])
+        if plateau is not None:
+            results.append(plateau)
+
+    return results
+
+# ---------------- Batched fit with fixed tau ----------------
+# With tau fixed, V(t) = V0 + a*(1 - exp(-t/tau)) is linear in V0 and a, so the least squares fit of every plateau
+# has a closed form. All plateaus are stacked in one array and solved together: for each plateau
+# a = cov(x, V) / var(x) and V0 = mean(V) - a*mean(x), with x = 1 - exp(-t/tau).
+# R_pol = a / I_step, C_pol = tau / R_pol, and fit_rmse is the root mean square residual of the fit (V).
+def fit_plateaus_fixed_tau(plateaus):
+    if not plateaus:
+        return []
+    lengths = np.array([len(p["t_fit"]) for p in plateaus])
+    plateau_id = np.repeat(np.arange(len(plateaus)), lengths)
+    tau = np.array([p["tau"] for p in plateaus], dtype=float)
+    I_step = np.array([p["I_step"] for p in plateaus], dtype=float)
+    t_fit = np.concatenate([p["t_fit"] for p in plateaus]).astype(float)
+    V_fit = np.concatenate([p["V_fit"] for p in plateaus]).astype(float)
+
+    def per_plateau_sum(values):
+        return np.bincount(plateau_id, weights=values, minlength=len(plateaus))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x = 1 - np.exp(-t_fit / tau[plateau_id])
+        x_mean = per_plateau_sum(x) / lengths
+        V_mean = per_plateau_sum(V_fit) / lengths
+        dx = x - x_mean[plateau_id]
+        dV = V_fit - V_mean[plateau_id]
+        a_fit = per_plateau_sum(dx * dV) / per_plateau_sum(dx * dx)
+        V0_fit = V_mean - a_fit * x_mean
+        residuals = V_fit - V0_fit[plateau_id] - a_fit[plateau_id] * x
+        fit_rmse = np.sqrt(per_plateau_sum(residuals**2) / lengths)
+
+        a_fit[~np.isfinite(a_fit)] = np.nan  # degenerate plateau (tau = 0 or constant x): no fit
+        R_pol = a_fit / I_step
+        C_pol = np.where(R_pol > 0, tau / R_pol, np.nan)
+
+    return [
+        {"file": p["file"], "step_start_time": p["step_start_time"], "R_pol": R_pol[k], "tau": p["tau"],
+         "C_pol": C_pol[k], "fit_rmse": fit_rmse[k]}
+        for k, p in enumerate(plateaus)
+    ]
+
+def _results_dataframe(results):
+    df_results = pd.DataFrame(results, columns=RESULT_COLUMNS)
 
-            if abs(v_plateau[-1] - v_plateau[0]) < 1e-3:  # 1 mV threshold
-                continue
-
-            # ---------------- Tau from 63.2% method ----------------
-            delta_V = v_plateau[-1] - v_plateau[0]
-            V_tau = v_plateau[0] + 0.632 * delta_V
-            V_tau = min(max(V_tau, min(v_plateau)), max(v_plateau))
-            tau = np.interp(V_tau, v_plateau, t_plateau) - t_plateau[0]
-
-            # ---------------- Exponential fit with fixed tau ----------------
-            def V_exp_fixed_tau(t, V0, a):
-                return V0 + a * (1 - np.exp(-t / tau))  # tau fixed
+    # ---------------- Add pulse index ----------------
+    df_results["pulse_id"] = df_results.groupby("file").cumcount().add(1)
 
-            t_fit = t_plateau - t_plateau[0]
-            V_fit = v_plateau
+    return df_results
 
-            V0_guess = V_fit[0]
-            a_guess = V_fit[-1] - V_fit[0]
-            p0 = [V0_guess, a_guess]
+# Polarization parameters of the Step 9 plateaus of a single cell file.
+def extract_step9_plateaus_file(csv_path):
+    return _results_dataframe(fit_plateaus_fixed_tau(_step9_plateau_rows(csv_path)))
 
-            try:
-                popt, _ = curve_fit(V_exp_fixed_tau, t_fit, V_fit, p0=p0, maxfev=5000)
-                V0_fit, a_fit = popt
-                R_pol = a_fit / I_step
-            except Exception as e:
-                print(f"Step {STEP_VALUE} fit failed: {e}")
-                R_pol = np.nan
+# workers: number of processes reading the files (see parallel_extraction.py), serial by default.
+# The plateaus found by every worker are merged in file order and fitted together.
+def extract_step9_plateaus_fixed_tau(data_folder, workers=None):
+    data_folder = Path(data_folder)
+    files = sorted(data_folder.glob("*.csv"))
+    results = []
+    for file_rows in map_files(_step9_plateau_rows, files, workers):
+        results.extend(file_rows)
+    return _results_dataframe(fit_plateaus_fixed_tau(results)) # one batched fit for the plateaus of every file
 
-            C_pol = tau / R_pol if R_pol > 0 else np.nan
+# SoC, R_pol and tau of every pulse of one file, ready to be interpolated (x strictly increasing).
+def polarization_points(csv_path):
+    this_file = Path(csv_path).stem #Cell_data/CELL_E_TEST_00.csv" to "CELL_E_TEST_00. match the file name used in df_results["file"].
+    df_results = extract_step9_plateaus_file(csv_path) # Extract polarization params from the Step 9 plateaus of this file
 
-            # ---------------- Store ----------------
-            results.append({
-                "file": file.stem,
-                "step_start_time": time[idx],
-                "R_pol": R_pol,
-                "tau": tau,
-                "C_pol": C_pol
-            })
+    # SOC pulses for THIS file
+    df_soc = soc_df_single(csv_path) #returns a DataFrame with pulse_id and SoC.
+    df_soc["file"] = this_file #add a column "file" with the filename in order to merge by ["file", "pulse_id"].
 
-    df_results = pd.DataFrame(results, columns=["file", "step_start_time",  "R_pol", "tau", "C_pol"])
+    df_merged = df_results.merge(df_soc, on=["file", "pulse_id"], how="inner") # each pulse has: SoC (from Step 15 coulomb counting) R_pol and tau (from Step 9 exponential behavior)
 
-    # ---------------- Add pulse index ----------------
-    df_results["pulse_id"] = df_results.groupby("file").cumcount().add(1)
+    if df_merged.empty:
+        raise ValueError(
+            f"Empty merge for file '{this_file}'. "
+            f"Step=9 pulses and Step=15 pulses may not align by pulse_id."
+        )
 
-    return df_results
+    df_merged = df_merged.dropna(subset=["SoC", "R_pol", "tau"]).sort_values("SoC") #removes any row where SoC, R_pol, or tau is NaN
+    # PCHIP needs strictly increasing x; group duplicates
+    df_merged = df_merged.groupby("SoC", as_index=False).median(numeric_only=True) #Combine duplicate SOC values (so x is strictly increasing)
+    return df_merged["SoC"].values, df_merged["R_pol"].values, df_merged["tau"].values
 
 # ---------------- Run extraction ----------------
-
-    # ---------------- Run extraction ----------------
-df_results = extract_step9_plateaus_fixed_tau(DATA_FOLDER)
-df_soc = soc_df_all(DATA_FOLDER)
-
-# ---------------- Merge SoC with parameters ----------------
-df_merged = pd.merge(df_results, df_soc, on=["file", "pulse_id"], how="inner")
+# Polarization parameters and SoC of every pulse of every file in the folder. Computed on request only:
+# importing this module does not read any cell file.
+def merged_results(data_folder=DATA_FOLDER, workers=None):
+    df_results = extract_step9_plateaus_fixed_tau(data_folder, workers)
+    df_soc = soc_df_all(data_folder, workers)
+    return pd.merge(df_results, df_soc, on=["file", "pulse_id"], how="inner")
 
 # ---------------- Plot R_pol vs SoC ----------------
 def plot_SOC_R1(csv_path, coefficient=1.0):
@@ -190,6 +237,7 @@ def plot_SOC_R1(csv_path, coefficient=1.0):
     if df.empty:
         raise ValueError("No data after merge — check pulse indexing")
     df_rev = df.iloc[::-1]
+    import matplotlib.pyplot as plt
     fig, ax = plt.subplots(figsize=(9,6))
     ax.plot(
         df_rev["SoC"],
@@ -220,6 +268,7 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
     if args.file:
+        import matplotlib.pyplot as plt
 
         file_path = Path("Cell_data") / args.file
         
@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+
+from cell_data_cache import cached_derived
+
+# Run-length index of the "Step" column of a cell file.
+# Every continuous block of rows with the same step becomes one segment, described by its step id, first and last
+# row, first and last time, first current and mean current. The index is built in a single pass over the file and
+# kept with the cached data, so detecting the pulses (step 7/9), the coulomb-counting blocks (step 15), the
+# full discharge (step 27) or the Step 9 plateaus is a lookup over a few hundred segments instead of a scan of
+# every row.
+
+SEGMENT_COLUMNS = ["step", "start_row", "end_row", "start_time", "end_time", "start_current", "mean_current"]
+
+
+def build_step_segments(time, current, step):
+    time = np.asarray(time, dtype=float)
+    current = np.asarray(current, dtype=float)
+    step = np.asarray(step)
+    if len(step) == 0:
+        return pd.DataFrame({c: [] for c in SEGMENT_COLUMNS})
+    starts = np.concatenate(([0], np.flatnonzero(step[1:] != step[:-1]) + 1))
+    ends = np.concatenate((starts[1:] - 1, [len(step) - 1]))
+    return pd.DataFrame({
+        "step": step[starts],
+        "start_row": starts,
+        "end_row": ends,
+        "start_time": time[starts],
+        "end_time": time[ends],
+        "start_current": current[starts],
+        "mean_current": np.add.reduceat(current, starts) / (ends - starts + 1),
+    })
+
+
+def get_step_segments(csv_path):
+    return cached_derived(csv_path, "step_segments",
+                          lambda df: build_step_segments(df["Total Time"].values, df["Current"].values, df["Step"].values))
+
+
+def segments_of_step(csv_path, step_value):
+    segments = get_step_segments(csv_path)
+    return segments[segments["step"] == step_value]
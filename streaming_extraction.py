@@ -0,0 +1,242 @@
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from cell_data_cache import CELL_COLUMNS
+import socpolarization
+
+# Streaming extraction for cycler files too large to load at once.
+# The CSV is read in chunks of `chunksize` rows and only the 4 columns used are kept. The steps are run-length
+# encoded on the fly: a step segment can start in one chunk and end in a later one, and the row just before a
+# segment (needed for the R0/OCV pulses) can be the last row of the previous chunk. Events are emitted as soon as
+# they are known:
+#
+#   ("pulse", {...})          R0 and OCV of a step 7 (discharge) or step 9 (charge) pulse, as in identify_R0_OCV
+#   ("step15_block", {...})   charge (Ah) of one step 15 coulomb-counting block, as in soc_by_spike
+#   ("step9_plateau", {...})  fitted polarization parameters of one step 9 plateau, as in extract_step9_plateaus_fixed_tau
+#   ("capacity", {...})       capacity (Ah) from the step 27 full discharge, once the file is read
+#
+# Only the current segment and, while a step 9 plateau is being read, its samples are kept in memory, so the memory
+# used depends on the chunk size and the length of a pulse, not on the length of the file.
+
+DEFAULT_CHUNKSIZE = 100_000
+PULSE_STEPS = {7: "discharge", 9: "charge"}  # R0/OCV pulses start on the first row of these steps
+MIN_PULSE_CURRENT = 10  # same check as identify_R0_OCV: a pulse is a current change of more than 10 A
+SOC_STEP = 15
+CAPACITY_STEP = 27
+
+
+def iter_cell_chunks(csv_path, chunksize=DEFAULT_CHUNKSIZE):
+    reader = pd.read_csv(csv_path, chunksize=chunksize, usecols=lambda c: c.strip() in CELL_COLUMNS)
+    for chunk in reader:
+        chunk.columns = [c.strip() for c in chunk.columns]
+        columns = {c: pd.to_numeric(chunk[c], errors="coerce").to_numpy() for c in CELL_COLUMNS}
+        for c in ["Total Time", "Current", "Voltage"]:
+            columns[c] = columns[c].astype(float)
+        yield columns
+
+
+class CellStream:
+    """
+    Incremental step detection for one cell file: feed() the columns chunk by chunk, then finish().
+    Both return the list of events found in that call.
+    """
+
+    def __init__(self, file_stem):
+        self.file_stem = file_stem
+        self.rows = 0               # rows fed so far
+        self.segment = None         # the step segment still open at the end of the last chunk
+        self.previous = None        # (time, current, voltage, step) of the last row fed
+        self.pulse_numbers = {step: 0 for step in PULSE_STEPS}
+        self.step15_blocks = 0
+        self.capacity_segments = None  # (first start time, first start current, last end time) of step 27
+        self.step9_plateaus = 0
+
+    # ---------------- Segment start / end ----------------
+
+    def _open_segment(self, row, time, current, voltage, step, events):
+        self.segment = {"step": step, "start_row": row, "start_time": time, "start_current": current,
+                        "plateau": None}
+
+        if step in PULSE_STEPS and self.previous is not None:
+            # identify_R0_OCV: resistance from the jump between the row before the step and its first row
+            _, i1, v1, _ = self.previous
+            dV = v1 - voltage
+            dI = i1 - current
+            R = (dV / dI)
+            OCV = v1 + i1*R
+            if abs(dI) > MIN_PULSE_CURRENT:
+                events.append(("pulse", {"kind": PULSE_STEPS[step], "step": int(step),
+                                         "pulse_number": self.pulse_numbers[step], "time": float(time),
+                                         "R": float(R), "OCV": float(OCV)}))
+        if step in PULSE_STEPS:
+            self.pulse_numbers[step] += 1  # every pulse start is numbered, even when it is skipped
+
+        # socpolarization: step 9 plateaus starting inside [T_MIN, T_MAX], after the first row of the window
+        if (step == socpolarization.STEP_VALUE and self.previous is not None
+                and self.previous[0] >= socpolarization.T_MIN and time <= socpolarization.T_MAX):
+            self.segment["plateau"] = {"time": [], "voltage": [], "I_step": None}
+
+    def _close_segment(self, events):
+        segment = self.segment
+        if segment is None:
+            return
+        step = segment["step"]
+
+        if step == SOC_STEP:
+            duration = segment["end_time"] - segment["start_time"]
+            current = segment["start_current"]
+            self.step15_blocks += 1
+            events.append(("step15_block", {"block": self.step15_blocks, "start_time": segment["start_time"],
+                                            "end_time": segment["end_time"], "current": current,
+                                            "charge_ah": abs(duration * current / 3600)}))
+
+        if step == CAPACITY_STEP:
+            if self.capacity_segments is None:
+                self.capacity_segments = (segment["start_time"], segment["start_current"], segment["end_time"])
+            else:
+                self.capacity_segments = self.capacity_segments[:2] + (segment["end_time"],)
+
+        plateau = segment["plateau"]
+        if plateau is not None and len(plateau["time"]) > 0:
+            t_plateau = np.concatenate(plateau["time"])
+            v_plateau = np.concatenate(plateau["voltage"])
+            candidate = socpolarization.plateau_candidate(self.file_stem, segment["start_time"], t_plateau, v_plateau,
+                                                          plateau["I_step"])
+            if candidate is not None:
+                # each plateau is fitted alone as soon as it ends, with the same arithmetic as the batched fit
+                row = socpolarization.fit_plateaus_fixed_tau([candidate])[0]
+                self.step9_plateaus += 1
+                row["pulse_id"] = self.step9_plateaus
+                events.append(("step9_plateau", row))
+
+        self.segment = None
+
+    # ---------------- Chunks ----------------
+
+    def feed(self, columns):
+        time = columns["Total Time"]
+        current = columns["Current"]
+        voltage = columns["Voltage"]
+        step = columns["Step"]
+        events = []
+        n = len(step)
+        if n == 0:
+            return events
+
+        # rows (of this chunk) where a new step segment starts
+        starts = list(np.flatnonzero(step[1:] != step[:-1]) + 1)
+        if self.previous is None or step[0] != self.previous[3]:
+            starts.insert(0, 0)
+        bounds = starts + [n]
+        if not starts or starts[0] != 0:
+            bounds.insert(0, 0)  # the first rows continue the segment of the previous chunk
+        starts = set(starts)
+
+        for a, b in zip(bounds[:-1], bounds[1:]):
+            if a in starts:
+                self._close_segment(events)
+                self._open_segment(self.rows + a, time[a], current[a], voltage[a], step[a], events)
+            segment = self.segment
+            segment["end_row"] = self.rows + b - 1
+            segment["end_time"] = time[b - 1]
+
+            plateau = segment["plateau"]
+            if plateau is not None:
+                first = a + 1 if a in starts else a  # the plateau starts after the first row of the step
+                last = first + np.searchsorted(time[first:b], socpolarization.T_MAX, side="right")  # cut at T_MAX
+                if last > first:
+                    if plateau["I_step"] is None:
+                        plateau["I_step"] = current[first]  # current of the first row of the plateau
+                    plateau["time"].append(time[first:last].copy())
+                    plateau["voltage"].append(voltage[first:last].copy())
+
+            self.previous = (time[b - 1], current[b - 1], voltage[b - 1], step[b - 1])
+
+        self.rows += n
+        return events
+
+    def finish(self):
+        events = []
+        self._close_segment(events)
+        if self.capacity_segments is not None:
+            start_time, current, end_time = self.capacity_segments
+            events.append(("capacity", {"capacity_ah": abs(current * (end_time - start_time) / 3600)}))
+        return events
+
+
+def stream_cell_events(csv_path, chunksize=DEFAULT_CHUNKSIZE):
+    stream = CellStream(Path(csv_path).stem)
+    for columns in iter_cell_chunks(csv_path, chunksize):
+        yield from stream.feed(columns)
+    yield from stream.finish()
+
+
+# ---------------- Same outputs as the in-memory functions ----------------
+
+def summarize_cell_stream(csv_path, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Reads the file once and returns {"discharge": identify_R0_OCV(csv_path), "charge": identify_R0_OCV(csv_path, True),
+    "soc": soc_by_spike(csv_path), "capacity": overall_capacity(csv_path), "step9": list of plateau rows}.
+    """
+    csv_path = Path(csv_path)
+    key = ("file " + csv_path.stem[-1])
+    pulses = {"discharge": [], "charge": []}
+    block_charges = []
+    capacity = None
+    step9 = []
+    for kind, event in stream_cell_events(csv_path, chunksize):
+        if kind == "pulse":
+            pulses[event["kind"]].append((event["pulse_number"], event["R"], event["OCV"]))
+        elif kind == "step15_block":
+            block_charges.append(event["charge_ah"])
+        elif kind == "step9_plateau":
+            step9.append(event)
+        elif kind == "capacity":
+            capacity = event["capacity_ah"]
+
+    if capacity is None:
+        raise ValueError(f"{csv_path.name}: no Step {CAPACITY_STEP} full discharge, the capacity is unknown")
+
+    # SoC before each spike (the capacity is only known at the end of the file)
+    soc_list = [(0, 100.0)]
+    tot_SOC = 100.0
+    for i, charge in enumerate(block_charges, 1):
+        SOC_drop = charge / capacity * 100
+        tot_SOC = float(tot_SOC - SOC_drop)
+        soc_list.append((i, tot_SOC))
+
+    return {
+        "discharge": {key: pulses["discharge"]},
+        "charge": {key: pulses["charge"]},
+        "soc": {key: soc_list},
+        "capacity": capacity,
+        "step9": step9,
+    }
+
+
+def identify_R0_OCV_streaming(csv_path, charge=False, chunksize=DEFAULT_CHUNKSIZE):
+    return summarize_cell_stream(csv_path, chunksize)["charge" if charge else "discharge"]
+
+
+def soc_by_spike_streaming(csv_path, chunksize=DEFAULT_CHUNKSIZE):
+    return summarize_cell_stream(csv_path, chunksize)["soc"]
+
+
+def extract_step9_plateaus_streaming(data_folder, chunksize=DEFAULT_CHUNKSIZE):
+    rows = []
+    for file in sorted(Path(data_folder).glob("*.csv")):
+        rows.extend(summarize_cell_stream(file, chunksize)["step9"])
+    return socpolarization._results_dataframe(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract the cell parameters of large files chunk by chunk")
+    parser.add_argument("--file", required=True, help="Cell file to read (e.g., Cell_data/CELL_E_TEST_00.csv)")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE, help="Rows read at a time")
+    args = parser.parse_args()
+
+    for kind, event in stream_cell_events(args.file, args.chunksize):
+        print(kind, event)
@@ -1,93 +1,195 @@
-from SoC_0thorder_parameters_link import *
-from power_from_WLTP import *
+from pathlib import Path
+import numpy as np
+from power_from_WLTP import run_simulation
 import math
+from cell_model import as_cell_model
+from soc_lut import ScalarCurve, lut_error_report
 import argparse
-import matplotlib.pyplot as plt
 
-def energy_consumption_cell(csv_path, number_series_cells, number_parallel_cells, R0_coefficient, OCV_coefficient, SoC, mass, wind, angle):
+SOC_FLOOR = 0.1 # the simulation stops when the SoC reaches this value (%)
 
-    
-    soc_dict = OCV_SoC(csv_path)
-    SOC_points = []
-    #R0 interpolation for discharging
-    R0_points = []
-    OCV_points = []
-    #R0 interpolation for charging
-    soc_dict_charging = OCV_SoC(csv_path, True)
-    R0_points_charge = []
-    for key in soc_dict.keys():
-        for tuple_index in range(len(soc_dict[key])):
-            SOC_points.append(soc_dict[key][tuple_index][1])
-            R0_points.append(soc_dict[key][tuple_index][2])
-            OCV_points.append(soc_dict[key][tuple_index][3])
-            R0_points_charge.append(soc_dict_charging[key][tuple_index][2])
-    SOC_points.sort()
-    R0_points.reverse()
-    r0_interp =  PchipInterpolator(SOC_points, R0_points)
-
-    R0_points_charge.reverse()
-    r0_charge_interp = PchipInterpolator(SOC_points, R0_points_charge)
-
-    #OCV interpolation
-    OCV_points.reverse()
-    ocv_interp = PchipInterpolator(SOC_points, OCV_points)
-
-    power_demand_dictionary = run_simulation(mass, wind, angle)
+
+# Parameter curves used by the simulation loop: exact scalar PCHIP evaluation by default, or lookup tables
+# with the given SoC resolution (see soc_lut.py).
+def parameter_curves(model, lut_resolution=None):
+    if lut_resolution is None:
+        return ScalarCurve(model.ocv_interp), ScalarCurve(model.r0_interp), ScalarCurve(model.r0_charge_interp)
+    tables = model.lookup_tables(lut_resolution)
+    return tables["ocv"], tables["r0"], tables["r0_charge"]
+
+
+# Number of seconds needed to empty the pack, estimated from the usable energy and the mean power of the cycle.
+# Used to size the state buffers so they are (almost) never grown during the run.
+def estimate_steps(model, number_series_cells, number_parallel_cells, OCV_coefficient, SoC, p_batt):
+    usable_charge = model.capacity*number_parallel_cells*max(SoC - SOC_FLOOR, 0)/100 # Ah
+    mean_voltage = float(np.mean(model.ocv))*number_series_cells*OCV_coefficient
+    mean_power = max(float(np.mean(p_batt)), 1.0)
+    return int(1.2*usable_charge*mean_voltage*3600/mean_power) + len(p_batt)
+
+
+"""
+Core of the 0th order model: from the SoC `SoC`, at every second t the pack delivers p_batt[t % period]
+(t starting at start_step), until the SoC reaches soc_floor or max_steps seconds have been simulated.
+Only the SoC and the current depend on the previous second, so only they are computed in the loop, in plain
+Python floats written to preallocated NumPy buffers. Returns the currents and the SoC after each second,
+and whether the run stopped because the power demand could not be delivered.
+"""
+def simulate_0th_order(curves, p_batt, SoC, ocv_scale, r0_scale, capacity_pack, soc_floor=SOC_FLOOR,
+                       start_step=0, max_steps=None, buffer_size=None):
+    ocv_curve, r0_curve, r0_charge_curve = curves
+    power_list = np.asarray(p_batt, dtype=float).tolist()
+    period = len(power_list)
+    if buffer_size is None:
+        buffer_size = period
+    if max_steps is not None:
+        buffer_size = min(buffer_size, max_steps)
+    currents = np.empty(max(buffer_size, 1))
+    socs = np.empty(max(buffer_size, 1))
+
+    soc = float(SoC)
+    n = 0
+    infeasible = False
+    while soc > soc_floor and (max_steps is None or n < max_steps):
+        if n == len(currents): # estimate too short: double the buffers
+            currents = np.concatenate([currents, np.empty(len(currents))])
+            socs = np.concatenate([socs, np.empty(len(socs))])
+        power_demand = power_list[(start_step + n) % period]
+        ocv_now = ocv_curve(soc)*ocv_scale
+        if power_demand < 0:
+            R0_now = r0_charge_curve(soc)*r0_scale
+        else:
+            R0_now = r0_curve(soc)*r0_scale
+        discriminant = ocv_now*ocv_now - 4*power_demand*R0_now
+        if discriminant < 0: # the demanded power cannot be delivered at this SoC
+            infeasible = True
+            break
+        I2 = (ocv_now - math.sqrt(discriminant))/(2*R0_now)
+        soc = soc - ((I2/3600)/(capacity_pack))*100
+        currents[n] = I2
+        socs[n] = soc
+        n += 1
+    return currents[:n], socs[:n], infeasible
+
+
+# lut_resolution (SoC %) switches the parameter curves to lookup tables (see soc_lut.py): faster, at the cost of
+# a small error reported by model.lookup_tables(lut_resolution).
+# power_profile: output of run_simulation already computed by the caller, used instead of recomputing it.
+# cycle: drive cycle repeated until the pack is empty (see drive_cycles.py), WLTC class 3 by default.
+def energy_consumption_cell(csv_path, number_series_cells, number_parallel_cells, R0_coefficient, OCV_coefficient, SoC, mass, wind, angle, lut_resolution=None, power_profile=None, cycle=None):
+    # csv_path can also be a fitted CellModel, in which case no cell data is read at all
+    model = as_cell_model(csv_path)
+    curves = parameter_curves(model, lut_resolution)
+
+    power_demand_dictionary = run_simulation(mass, angle, wind, cycle) if power_profile is None else power_profile
     p_batt = power_demand_dictionary["p_batt"]
     distance_demand = power_demand_dictionary["speed_ms"]
-    SOC_now = [SoC]
-    t_now = 0
-    energy_consumed=0
-    overall_capacity_cell = number_parallel_cells*overall_capacity(csv_path)
-    U_list = []
-    I_list = []
-    distance_list = [0]
-    while SOC_now[-1]>0.1:
-        power_demand= p_batt[t_now%1801]
-        distance_list.append(distance_demand[t_now%1801]+distance_list[-1])
-        ocv_cell = ocv_interp(SOC_now[-1])
-        ocv_now = ocv_cell*number_series_cells*OCV_coefficient
-        if power_demand<0:
-            R0_cell = r0_charge_interp(SOC_now[-1])
-            R0_now = (R0_cell*number_series_cells*R0_coefficient)/number_parallel_cells
-        else:
-            R0_cell = r0_interp(SOC_now[-1])
-            R0_now = (R0_cell*number_series_cells*R0_coefficient)/number_parallel_cells
-        try:
-            I2 = (ocv_now - math.sqrt((ocv_now)**2 - 4*power_demand*R0_now))/(2*R0_now)
-        except ValueError:
-            print("Math domain error at time ", t_now, " seconds")    
-       
-        # print("I2 is: " , I2)   
-
-        U2 = power_demand/I2   
-        U_list.append(U2) 
-        I_list.append(I2)
-        # print("U1 is: " , U1)
-        # print("U2 is: " , U2)
-        energy_consumed += power_demand/3600000
-        #print("The energy consumed was ", energy_consumed, " kWh, and the power demanded was ", p_batt[t_now], " W")
-        
-        new_SOC_2 = SOC_now[-1] - ((I2/3600)/(overall_capacity_cell))*100
-        
-        
-        SOC_now.append(float(new_SOC_2))
-        t_now += 1
-
-    t_list = list(range(1,t_now+1))  
-    
-    
-    #print(t_now, energy_consumed,SOC_now[-1])
+    period = len(p_batt)
+
+    # per-run constants, hoisted out of the loop
+    ocv_scale = number_series_cells*OCV_coefficient
+    r0_scale = (number_series_cells*R0_coefficient)/number_parallel_cells
+    overall_capacity_cell = number_parallel_cells*model.capacity
+
+    buffer_size = estimate_steps(model, number_series_cells, number_parallel_cells, OCV_coefficient, SoC, p_batt)
+    I_list, SOC_steps, infeasible = simulate_0th_order(curves, p_batt, SoC, ocv_scale, r0_scale, overall_capacity_cell,
+                                                       buffer_size=buffer_size)
+    t_now = len(I_list)
+    if infeasible:
+        print("Math domain error at time ", t_now, " seconds")
+
+    # everything else only depends on the second of the cycle, so it is computed for all seconds at once
+    cycle_index = np.arange(t_now) % period
+    power_demand = p_batt[cycle_index]
+    energy_consumed = float(np.sum(power_demand)/3600000)
+
     return {
-        'distance': distance_list,
-        'SOC': SOC_now,
-        'time': t_list,
+        'distance': np.concatenate([[0.0], np.cumsum(distance_demand[cycle_index])]),
+        'SOC': np.concatenate([[float(SoC)], SOC_steps]),
+        'time': np.arange(1, t_now + 1),
         'energyconsumed': energy_consumed,
-        'voltages': U_list,
+        'voltages': power_demand/I_list,
         'Currents': I_list
     }
 
+"""
+Accelerated range run. The WLTC cycle is repeated until the SoC floor, and from one cycle to the next the cell
+parameters barely change, so each cycle draws almost the same charge. Here one cycle is simulated exactly
+(second by second), then the following cycles are skipped as a whole: the SoC is lowered by the drop of the
+exact cycle, at most max_soc_jump (%) at a time. The drop of the next exact cycle shows how much the drop varied
+during the jump; the jump is corrected with the mean of both drops, and half their difference times the number of
+skipped cycles bounds the SoC error. Per-second stepping is used for the last floor_margin (%) of SoC (and at
+least two cycles), so the end of the run is exact.
+Returns the range (m), energy consumed (kWh), end time (s) and SoC, the number of skipped cycles and the
+accumulated error bounds on the SoC (%) and on the range (m).
+"""
+def energy_consumption_cell_accelerated(csv_path, number_series_cells, number_parallel_cells, R0_coefficient, OCV_coefficient, SoC, mass, wind, angle, lut_resolution=None, max_soc_jump=10.0, floor_margin=2.0, cycle=None):
+    model = as_cell_model(csv_path)
+    curves = parameter_curves(model, lut_resolution)
+
+    power_demand_dictionary = run_simulation(mass, angle, wind, cycle)
+    p_batt = power_demand_dictionary["p_batt"]
+    period = len(p_batt)
+    cumulative_energy = np.concatenate([[0.0], np.cumsum(p_batt)])/3600000
+    cumulative_distance = np.concatenate([[0.0], np.cumsum(power_demand_dictionary["speed_ms"])])
+
+    ocv_scale = number_series_cells*OCV_coefficient
+    r0_scale = (number_series_cells*R0_coefficient)/number_parallel_cells
+    overall_capacity_cell = number_parallel_cells*model.capacity
+
+    soc = float(SoC)
+    t_now = 0
+    cycles_skipped = 0
+    soc_error_bound = 0.0
+    last_jump = None # (cycles skipped, SoC drop per cycle used for the jump)
+    last_drop = None
+    while True:
+        # one exact cycle (or the end of the run)
+        I_list, SOC_steps, infeasible = simulate_0th_order(curves, p_batt, soc, ocv_scale, r0_scale, overall_capacity_cell,
+                                                           max_steps=period)
+        t_now += len(I_list)
+        if infeasible:
+            print("Math domain error at time ", t_now, " seconds")
+        if infeasible or len(I_list) < period:
+            if len(SOC_steps):
+                soc = float(SOC_steps[-1])
+            break
+        drop = soc - float(SOC_steps[-1])
+        soc = float(SOC_steps[-1])
+        last_drop = drop
+
+        if last_jump is not None:
+            skipped, jump_drop = last_jump
+            soc -= skipped*(drop - jump_drop)/2 # mean of the drops before and after the jump
+            soc_error_bound += skipped*abs(drop - jump_drop)/2
+            last_jump = None
+        if drop <= 0:
+            continue # the SoC does not go down over a cycle (regeneration only): nothing to extrapolate
+
+        # skip whole cycles while staying clear of the floor
+        stop_jumping_at = SOC_FLOOR + max(floor_margin, 2*drop)
+        skipped = int(min(max_soc_jump, soc - stop_jumping_at)//drop)
+        if skipped >= 1:
+            soc -= skipped*drop
+            t_now += skipped*period
+            cycles_skipped += skipped
+            last_jump = (skipped, drop)
+
+    full_cycles, remainder = divmod(t_now, period)
+    distance = full_cycles*cumulative_distance[-1] + cumulative_distance[remainder]
+    # a SoC error of one cycle's drop is one cycle of distance
+    range_error_bound = soc_error_bound/last_drop*cumulative_distance[-1] if last_drop else 0.0
+    return {
+        'range': float(distance),
+        'energyconsumed': float(full_cycles*cumulative_energy[-1] + cumulative_energy[remainder]),
+        'end_time': t_now,
+        'SOC_end': soc,
+        'cycles_skipped': cycles_skipped,
+        'soc_error_bound': soc_error_bound,
+        'range_error_bound': float(range_error_bound)
+    }
+
 def plot_distance_SOC(results):
+    import matplotlib.pyplot as plt
     fig, ax = plt.subplots(figsize=(10, 4))
     ax.plot(results["distance"], results["SOC"], color='black', linestyle = 'None', marker=".",markersize=1)
     ax.set_title("SOC over a distance travelled")
@@ -96,6 +198,7 @@ def plot_distance_SOC(results):
     ax.grid(True)
     return fig
 def plot_voltage_time(results):
+    import matplotlib.pyplot as plt
     fig, ax = plt.subplots(figsize=(10, 4))
     ax.plot(results["time"], results["voltages"], color='black', linestyle = 'None', marker=".",markersize=1)
     ax.set_title("voltage over time")
@@ -104,6 +207,7 @@ def plot_voltage_time(results):
     ax.grid(True)
     return fig
 def plot_current_time(results):
+    import matplotlib.pyplot as plt
     fig, ax = plt.subplots(figsize=(10, 4))
     ax.plot(results["time"], results["Currents"], color='black', linestyle = 'None', marker=".", markersize=1)
     ax.set_title("current over time")
@@ -114,6 +218,7 @@ def plot_current_time(results):
 
 
 if __name__ == "__main__":
+    import matplotlib.pyplot as plt
     # 2. Set up the argument parser
     parser = argparse.ArgumentParser(description="Run Battery Simulation and Select Plot")
     
@@ -128,6 +233,12 @@ if __name__ == "__main__":
         help="Filename to plot (e.g., CELL_E_TEST_00.csv). If omitted, plots all files in Cell_data folder.",
         default=None
     )
+    parser.add_argument(
+        "--lut",
+        type=float,
+        help="Use lookup tables with this SoC resolution (%%) instead of the PCHIP curves, and print their maximum error",
+        default=None
+    )
     args = parser.parse_args()
  
     n_series = 110
@@ -147,12 +258,15 @@ if __name__ == "__main__":
     try:
         results = energy_consumption_cell(
             file_path, n_series, n_parallel, r0_coeff, 
-            ocv_coeff, initial_soc, mass, wind, angle
+            ocv_coeff, initial_soc, mass, wind, angle, lut_resolution=args.lut
         )
     except Exception as e:
         print(f"Error running simulation: {e}")
         exit()
 
+    if args.lut is not None:
+        print("Maximum lookup table errors:", lut_error_report(as_cell_model(file_path).lookup_tables(args.lut)))
+
     # 6. Check which option the user chose and run only that plot
     if args.plot_type == "current":
         plot_current_time(results)